@@ -0,0 +1,79 @@
+import argparse
+import random
+import threading
+from time import monotonic
+
+from cde_governor.auth import Authenticator
+
+from benchmarks.standins import FakeDatabase
+
+
+def measure(login, usernames: list[str], threads: int, duration: float) -> float:
+    logins = [0] * threads
+    deadline = monotonic() + duration
+
+    def worker(index: int) -> None:
+        rng = random.Random(index)
+        while monotonic() < deadline:
+            username = rng.choice(usernames)
+            assert login(username, f"pw-{username}") is not None
+            logins[index] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started_at = monotonic()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return sum(logins) / (monotonic() - started_at)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure logins/sec")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument(
+        "--db-latency-ms",
+        type=float,
+        default=1,
+        help="simulated round trip of the in-process DB stand-in",
+    )
+    parser.add_argument(
+        "--mysql-host",
+        help="benchmark against a real MariaDB/MySQL instead of the stand-in",
+    )
+    parser.add_argument("--mysql-user", default="root")
+    parser.add_argument("--mysql-password", default="")
+    parser.add_argument("--mysql-database", default="cde_bench")
+    args = parser.parse_args()
+
+    if args.mysql_host:
+        from cde_governor.db import Database
+
+        db = Database(
+            host=args.mysql_host,
+            user=args.mysql_user,
+            password=args.mysql_password,
+            database=args.mysql_database,
+            pool_max_size=args.threads,
+        )
+    else:
+        db = FakeDatabase(latency=args.db_latency_ms / 1000)
+
+    usernames = [f"bench_user_{i}" for i in range(args.users)]
+    for username in usernames:
+        if db.get_credentials(username) is None:
+            db.create_user(username, f"pw-{username}")
+
+    uncached = measure(db.auth, usernames, args.threads, args.duration)
+    print(f"Database.auth:      {uncached:10.1f} logins/s")
+
+    authenticator = Authenticator(db)
+    cached = measure(authenticator.auth, usernames, args.threads, args.duration)
+    print(f"Authenticator.auth: {cached:10.1f} logins/s ({cached / uncached:.1f}x)")
+    print(f"Auth cache: {authenticator.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+import argparse
+import io
+import json
+import os
+import tempfile
+from time import monotonic, sleep
+
+from benchmarks.fake_docker import FakeDockerDaemon
+from benchmarks.load import LoadReport, print_reports, run
+from benchmarks.standins import FakeDatabase
+
+CDE_IMAGE = "bench/cde:latest"
+CDE_PORT = "8443/tcp"
+ADMIN_TOKEN = "bench"
+ROUTE_SCENARIOS = [
+    "signup",
+    "login",
+    "dashboard",
+    "connect",
+    "upload",
+    "backup",
+    "bulk",
+]
+MANAGER_SCENARIOS = [
+    "create_cde",
+    "get_cde_url",
+    "statuses",
+    "inventory",
+    "upload",
+    "backup",
+]
+
+
+def start_daemons(args) -> list[FakeDockerDaemon]:
+    return [
+        FakeDockerDaemon(
+            name=f"fake-docker-{index}",
+            latency=args.docker_latency_ms / 1000,
+            workspace_size=args.workspace_size,
+        ).start()
+        for index in range(args.hosts)
+    ]
+
+
+def wait_for_provisioning(db: FakeDatabase, timeout: float = 600) -> float:
+    started_at = monotonic()
+    while db.get_unfinished_provisioning_jobs():
+        if monotonic() - started_at > timeout:
+            raise TimeoutError("Provisioning did not finish")
+        sleep(0.05)
+    return monotonic() - started_at
+
+
+def bench_routes(args, workdir: str) -> list[LoadReport]:
+    daemons = start_daemons(args)
+    os.environ.update(
+        {
+            "LOG_PATH": os.path.join(workdir, "logs"),
+            "BACKUP_PATH": os.path.join(workdir, "backups"),
+            "ANNOUNCEMENT_PATH": os.path.join(workdir, "announcements"),
+            "LEADER_LOCK_PATH": os.path.join(workdir, "leader.lock"),
+            "ADMIN_TOKEN": ADMIN_TOKEN,
+            "CDE_IMAGE": CDE_IMAGE,
+            "CDE_PORT": CDE_PORT,
+            "SERVER_INFO": json.dumps([[d.address, args.gpus] for d in daemons]),
+            "PROVISIONING_WORKERS": str(args.threads),
+            "WATCH_CONTAINER_EVENTS": str(args.watch_events).lower(),
+            "DOCKER_MAX_POOL_SIZE": str(args.threads),
+            "STARTUP_MODE": args.startup_mode,
+        }
+    )
+    # main reads its configuration from the environment when imported
+    started_at = monotonic()
+    import main
+
+    imported_at = monotonic()
+    db = FakeDatabase(latency=args.db_latency_ms / 1000)
+    cores = main.server_core(db=db)
+    app = cores.app
+    constructed_at = monotonic()
+    live = app.test_client().get("/livez").status_code == 200
+    if not cores.wait_until_ready(timeout=600):
+        raise TimeoutError("Governor did not become ready")
+    ready_at = monotonic()
+    print(
+        f"Cold start ({args.startup_mode}): import {imported_at - started_at:.3f}s, "
+        f"serving {constructed_at - started_at:.3f}s (live: {live}), "
+        f"ready {ready_at - started_at:.3f}s"
+    )
+    clients = [app.test_client() for _ in range(args.threads)]
+    payload = os.urandom(args.upload_size)
+    reports = []
+
+    def flashes(worker: int) -> list[str]:
+        # Flashes are never rendered here, so drop them before the cookie grows
+        with clients[worker].session_transaction() as session:
+            return [message for _, message in session.pop("_flashes", [])]
+
+    def signup(worker: int, iteration: int) -> bool:
+        username = f"user_{worker}_{iteration}"
+        response = clients[worker].post(
+            "/signup",
+            data={
+                "username": username,
+                "password": username,
+                "password_confirm": username,
+            },
+        )
+        return response.status_code == 302 and response.location == "/"
+
+    def login(worker: int, iteration: int) -> bool:
+        username = f"user_{worker}_{worker}"
+        response = clients[worker].post(
+            "/login", data={"username": username, "password": username}
+        )
+        return response.location == "/dashboard"
+
+    def dashboard(worker: int, iteration: int) -> bool:
+        return clients[worker].get("/dashboard").status_code == 200
+
+    def connect(worker: int, iteration: int) -> bool:
+        response = clients[worker].get("/connect/dev")
+        return response.status_code == 302 and response.location.startswith("http")
+
+    def upload(worker: int, iteration: int) -> bool:
+        clients[worker].post(
+            "/upload",
+            data={"type": "dev", "files": [(io.BytesIO(payload), "payload.bin")]},
+            content_type="multipart/form-data",
+        )
+        return "Upload completed" in flashes(worker)
+
+    def backup(worker: int, iteration: int) -> bool:
+        response = clients[worker].post("/backup", data={"type": "dev"})
+        return response.status_code == 200 and len(response.get_data()) > 0
+
+    def bulk(worker: int, iteration: int) -> bool:
+        csv = "username,password\n" + "".join(
+            f"bulk_{iteration}_{index},password\n" for index in range(args.bulk_size)
+        )
+        response = clients[worker].post(
+            "/admin/users",
+            data=csv,
+            headers={"Authorization": f"Bearer {ADMIN_TOKEN}"},
+        )
+        return response.status_code == 202 and not response.json["rejected"]
+
+    scenarios = {
+        "signup": signup,
+        "login": login,
+        "dashboard": dashboard,
+        "connect": connect,
+        "upload": upload,
+        "backup": backup,
+        "bulk": bulk,
+    }
+    try:
+        # Every worker signs up as user_<worker>_<worker> first and the other
+        # scenarios run logged in as that user
+        if "signup" in args.scenarios:
+            requests = max(args.requests, args.threads)
+            reports.append(run("signup", signup, args.threads, requests))
+        else:
+            run("setup", signup, args.threads, args.threads)
+        elapsed = wait_for_provisioning(db)
+        print(f"Provisioning drained {elapsed:.2f}s after the last signup")
+
+        for worker in range(args.threads):
+            login(worker, 0)
+            flashes(worker)
+        for name in ROUTE_SCENARIOS[1:-1]:
+            if name in args.scenarios:
+                reports.append(run(name, scenarios[name], args.threads, args.requests))
+        if "bulk" in args.scenarios:
+            # Every request submits a cohort, the containers are created after
+            requests = max(args.requests // args.bulk_size, 1)
+            reports.append(run("bulk", bulk, args.threads, requests))
+            elapsed = wait_for_provisioning(db)
+            print(
+                f"Bulk provisioning of {requests * args.bulk_size} users drained "
+                f"{elapsed:.2f}s after the last submission"
+            )
+    finally:
+        cores.shutdown()
+        for daemon in daemons:
+            daemon.stop()
+    return reports
+
+
+def bench_manager(args, workdir: str) -> list[LoadReport]:
+    from cde_governor.manage import Manager
+
+    daemons = start_daemons(args)
+    db = FakeDatabase(latency=args.db_latency_ms / 1000)
+    manager = Manager(
+        {
+            "servers": [[daemon.address, args.gpus] for daemon in daemons],
+            "container_types": [0, 1],
+            "backup_dir": os.path.join(workdir, "manager_backups"),
+            "cde_image": CDE_IMAGE,
+            "cde_port": CDE_PORT,
+            "db": db,
+            "docker_max_pool_size": args.threads,
+            "watch_events": args.watch_events,
+            "background_tasks": False,
+        }
+    )
+    manager.distribute_image()
+    payload = os.urandom(args.upload_size)
+    users = [
+        db.create_user(f"user_{worker}", "password") for worker in range(args.threads)
+    ]
+    reports = []
+
+    def create_cde(worker: int, iteration: int) -> bool:
+        user_id = db.create_user(f"user_{worker}_{iteration}", "password")
+        return len(manager.create_cde(user_id, f"user_{worker}_{iteration}")) == 2
+
+    def get_cde_url(worker: int, iteration: int) -> bool:
+        return manager.get_cde_url(users[worker], 0).startswith("http")
+
+    def statuses(worker: int, iteration: int) -> bool:
+        return None not in manager.get_cde_statuses(users[worker]).values()
+
+    def inventory(worker: int, iteration: int) -> bool:
+        return all(listing is not None for listing in manager.inventory().values())
+
+    def upload(worker: int, iteration: int) -> bool:
+        manager.upload_file(user_id=users[worker], container_type=0, file=payload)
+        return True
+
+    def backup(worker: int, iteration: int) -> bool:
+        chunks, _, _ = manager.stream_backup(
+            user_id=users[worker], container_type=0, store=False
+        )
+        return sum(len(chunk) for chunk in chunks) > 0
+
+    scenarios = {
+        "create_cde": create_cde,
+        "get_cde_url": get_cde_url,
+        "statuses": statuses,
+        "inventory": inventory,
+        "upload": upload,
+        "backup": backup,
+    }
+    try:
+        for worker, user_id in enumerate(users):
+            manager.create_cde(user_id, f"user_{worker}")
+        for name in MANAGER_SCENARIOS:
+            if name in args.scenarios:
+                reports.append(run(name, scenarios[name], args.threads, args.requests))
+    finally:
+        manager.close()
+        for daemon in daemons:
+            daemon.stop()
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Drive the governor against in-process Docker and DB stand-ins"
+    )
+    parser.add_argument(
+        "--target", choices=["all", "routes", "manager"], default="all"
+    )
+    parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        default=sorted(set(ROUTE_SCENARIOS + MANAGER_SCENARIOS)),
+        help="subset of scenarios to run",
+    )
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--hosts", type=int, default=4)
+    parser.add_argument("--gpus", type=int, default=4)
+    parser.add_argument("--docker-latency-ms", type=float, default=1)
+    parser.add_argument("--db-latency-ms", type=float, default=1)
+    parser.add_argument("--workspace-size", type=int, default=4 * 1024 * 1024)
+    parser.add_argument("--upload-size", type=int, default=1024 * 1024)
+    parser.add_argument("--bulk-size", type=int, default=50)
+    parser.add_argument("--watch-events", action="store_true")
+    parser.add_argument(
+        "--startup-mode", choices=["background", "eager"], default="background"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="governor-bench-") as workdir:
+        # Peak RSS is per process, so run one target per process to compare them
+        if args.target in ("all", "routes"):
+            print_reports("server_core (Flask routes)", bench_routes(args, workdir))
+        if args.target in ("all", "manager"):
+            print_reports("Manager", bench_manager(args, workdir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+import base64
+import hashlib
+import io
+import json
+import re
+import sys
+import tarfile
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+from urllib.parse import parse_qs, urlsplit
+
+API_VERSION = "1.43"
+
+
+def _workspace_archive(size: int) -> bytes:
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        tarinfo = tarfile.TarInfo("workspace/data.bin")
+        tarinfo.size = size
+        # Incompressible like most real workspaces
+        data = hashlib.shake_256(b"workspace").digest(size) if size else b""
+        tar.addfile(tarinfo, io.BytesIO(data))
+    return archive.getvalue()
+
+
+class FakeDockerDaemon:
+    def __init__(
+        self,
+        name: str = "fake-docker",
+        latency: float = 0,
+        workspace_size: int = 1024 * 1024,
+        mem_total: int = 256 * 1024**3,
+        chunk_size: int | None = None,
+    ):
+        self.name = name
+        self.latency = latency
+        # Like dockerd for larger bodies, send responses chunked when set
+        self.chunk_size = chunk_size
+        self.mem_total = mem_total
+        self.archive = _workspace_archive(workspace_size)
+        self.image_digest = "sha256:" + hashlib.sha256(name.encode()).hexdigest()
+        self.requests = 0
+        self.connections = 0
+
+        self.__lock = threading.Lock()
+        self.__containers: dict[str, dict] = dict()
+        self.__execs: set[str] = set()
+        self.__images: set[str] = set()
+        self.__next_port = 40000
+        self.__stopped = threading.Event()
+
+        self.__server = _Server(self)
+        self.__thread = threading.Thread(
+            target=self.__server.serve_forever, name=name, daemon=True
+        )
+
+    @property
+    def address(self) -> str:
+        host, port = self.__server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self) -> "FakeDockerDaemon":
+        self.__thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.__stopped.set()
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def containers(self) -> list[dict]:
+        with self.__lock:
+            return list(self.__containers.values())
+
+    def __find(self, ref: str) -> dict | None:
+        container = self.__containers.get(ref)
+        if container is not None:
+            return container
+        for container in self.__containers.values():
+            if container["Name"] == "/" + ref or container["Id"].startswith(ref):
+                return container
+        return None
+
+    def __set_running(self, container: dict, running: bool) -> None:
+        container["State"] = {
+            "Status": "running" if running else "exited",
+            "Running": running,
+        }
+        ports = dict()
+        for container_port in container["Config"].get("ExposedPorts") or {}:
+            if running:
+                self.__next_port += 1
+                ports[container_port] = [
+                    {"HostIp": "0.0.0.0", "HostPort": str(self.__next_port)}
+                ]
+            else:
+                ports[container_port] = None
+        container["NetworkSettings"] = {"Ports": ports}
+
+    def __list(self, query: dict) -> list[dict]:
+        filters = json.loads(query.get("filters", ["{}"])[0])
+        include_stopped = query.get("all", ["0"])[0] in ("1", "True", "true")
+        result = []
+        for container in self.__containers.values():
+            if not include_stopped and not container["State"]["Running"]:
+                continue
+            if any(
+                not re.search(name, container["Name"])
+                for name in filters.get("name", [])
+            ):
+                continue
+            labels = container["Config"]["Labels"]
+            if any(
+                labels.get(key) != value
+                for key, _, value in (
+                    label.partition("=") for label in filters.get("label", [])
+                )
+            ):
+                continue
+            result.append(
+                {
+                    "Id": container["Id"],
+                    "Names": [container["Name"]],
+                    "Image": container["Config"]["Image"],
+                    "Labels": labels,
+                    "State": container["State"]["Status"],
+                }
+            )
+        return result
+
+    def __create(self, query: dict, body: dict) -> tuple[int, dict]:
+        name = query.get("name", [None])[0] or uuid.uuid4().hex[:12]
+        if self.__find(name) is not None:
+            return 409, {"message": f'The container name "/{name}" is in use'}
+
+        container_id = uuid.uuid4().hex + uuid.uuid4().hex
+        container = {
+            "Id": container_id,
+            "Name": "/" + name,
+            "Created": time(),
+            "Config": {
+                "Image": body.get("Image"),
+                "Labels": body.get("Labels") or {},
+                "ExposedPorts": body.get("ExposedPorts") or {},
+            },
+            "HostConfig": body.get("HostConfig") or {},
+            "cpu_usage": 0,
+        }
+        self.__set_running(container, False)
+        container["State"]["Status"] = "created"
+        self.__containers[container_id] = container
+        return 201, {"Id": container_id, "Warnings": []}
+
+    def __stats(self, container: dict, one_shot: bool) -> dict:
+        container["cpu_usage"] += 1000
+        usage = container["cpu_usage"]
+        # Like dockerd, one-shot stats do not carry the previous sample
+        precpu_stats = (
+            {"cpu_usage": {"total_usage": 0}}
+            if one_shot
+            else {
+                "cpu_usage": {"total_usage": usage - 1000},
+                "system_cpu_usage": (usage - 1000) * 1000,
+            }
+        )
+        return {
+            "read": "",
+            "cpu_stats": {
+                "cpu_usage": {"total_usage": usage},
+                "system_cpu_usage": usage * 1000,
+                "online_cpus": 32,
+            },
+            "precpu_stats": precpu_stats,
+            "memory_stats": {"usage": 512 * 1024**2, "limit": self.mem_total},
+            "networks": {"eth0": {"rx_bytes": usage, "tx_bytes": usage}},
+        }
+
+    def __image(self, name: str) -> dict:
+        repository = name.rpartition(":")[0] if ":" in name else name
+        return {
+            "Id": "sha256:" + hashlib.sha256(name.encode()).hexdigest(),
+            "RepoTags": [name],
+            "RepoDigests": [f"{repository}@{self.image_digest}"],
+        }
+
+    def record_connection(self) -> None:
+        with self.__lock:
+            self.connections += 1
+
+    def wait_stopped(self) -> None:
+        self.__stopped.wait()
+
+    def handle(
+        self, method: str, path: str, query: dict, body: bytes
+    ) -> tuple[int, bytes | dict | list | None, str, dict]:
+        with self.__lock:
+            self.requests += 1
+        if self.latency:
+            sleep(self.latency)
+
+        path = re.sub(r"^/v\d+\.\d+", "", path)
+        if path == "/_ping":
+            return 200, b"OK", "text/plain", {}
+        if path == "/version":
+            return _json(
+                200,
+                {
+                    "ApiVersion": API_VERSION,
+                    "MinAPIVersion": "1.12",
+                    "Version": "24.0.0",
+                },
+            )
+        if path == "/info":
+            with self.__lock:
+                running = sum(
+                    container["State"]["Running"]
+                    for container in self.__containers.values()
+                )
+            return _json(
+                200,
+                {
+                    "Name": self.name,
+                    "NCPU": 32,
+                    "MemTotal": self.mem_total,
+                    "ContainersRunning": running,
+                },
+            )
+        if path == "/events":
+            return STREAM_EVENTS
+
+        if path == "/containers/json":
+            with self.__lock:
+                return _json(200, self.__list(query))
+        if path == "/containers/create" and method == "POST":
+            with self.__lock:
+                return _json(*self.__create(query, json.loads(body or b"{}")))
+        match = re.fullmatch(r"/containers/([^/]+)(?:/(\w+))?", path)
+        if match is not None:
+            return self.__container(method, query, *match.groups())
+
+        match = re.fullmatch(r"/exec/([^/]+)/(start|json)", path)
+        if match is not None:
+            exec_id, action = match.groups()
+            with self.__lock:
+                if exec_id not in self.__execs:
+                    return _json(404, {"message": "No such exec instance"})
+            if action == "start":
+                return HIJACK
+            return _json(200, {"ExitCode": 0, "Running": False})
+
+        if path == "/images/create" and method == "POST":
+            image = query["fromImage"][0]
+            tag = query.get("tag", ["latest"])[0]
+            with self.__lock:
+                self.__images.add(f"{image}:{tag}")
+            return _json(200, {"status": "Downloaded newer image"})
+        match = re.fullmatch(r"/images/(.+)/json", path)
+        if match is not None:
+            name = match.group(1)
+            if ":" not in name.rpartition("/")[2]:
+                name += ":latest"
+            with self.__lock:
+                if name not in self.__images:
+                    return _json(404, {"message": f"No such image: {name}"})
+            return _json(200, self.__image(name))
+        match = re.fullmatch(r"/distribution/(.+)/json", path)
+        if match is not None:
+            return _json(
+                200,
+                {
+                    "Descriptor": {
+                        "mediaType": "application/vnd.oci.image.index.v1+json",
+                        "digest": self.image_digest,
+                        "size": 1024,
+                    },
+                    "Platforms": [{"architecture": "amd64", "os": "linux"}],
+                },
+            )
+
+        return _json(404, {"message": "page not found"})
+
+    def __container(
+        self, method: str, query: dict, ref: str, action: str | None
+    ) -> tuple[int, bytes | dict | list | None, str, dict]:
+        with self.__lock:
+            container = self.__find(ref)
+            if container is None:
+                return _json(404, {"message": f"No such container: {ref}"})
+
+            if action is None and method == "DELETE":
+                del self.__containers[container["Id"]]
+                return _json(204, None)
+            if action == "json":
+                return _json(
+                    200,
+                    {
+                        key: value
+                        for key, value in container.items()
+                        if key != "cpu_usage"
+                    },
+                )
+            if action in ("start", "restart", "unpause"):
+                if not container["State"]["Running"] or action == "restart":
+                    self.__set_running(container, True)
+                return _json(204, None)
+            if action in ("stop", "kill", "pause"):
+                if container["State"]["Running"]:
+                    self.__set_running(container, False)
+                return _json(204, None)
+            if action == "rename":
+                name = query["name"][0]
+                if self.__find(name) not in (None, container):
+                    return _json(409, {"message": "Conflict"})
+                container["Name"] = "/" + name
+                return _json(204, None)
+            if action == "stats":
+                one_shot = query.get("one-shot", ["0"])[0] in ("1", "true")
+                return _json(200, self.__stats(container, one_shot))
+            if action == "exec" and method == "POST":
+                exec_id = uuid.uuid4().hex
+                self.__execs.add(exec_id)
+                return _json(201, {"Id": exec_id})
+
+        if action == "archive" and method == "PUT":
+            return _json(200, None)
+        if action == "archive":
+            stat = {
+                "name": "workspace",
+                "size": len(self.archive),
+                "mode": 2147484141,
+                "mtime": "2024-01-01T00:00:00Z",
+                "linkTarget": "",
+            }
+            encoded_stat = base64.b64encode(json.dumps(stat).encode("utf-8"))
+            return (
+                200,
+                self.archive,
+                "application/x-tar",
+                {"X-Docker-Container-Path-Stat": encoded_stat.decode("ascii")},
+            )
+
+        return _json(404, {"message": "page not found"})
+
+
+def _json(
+    status: int, body: dict | list | None
+) -> tuple[int, bytes | dict | list | None, str, dict]:
+    return status, body, "application/json", {}
+
+
+# Responses that do not fit a plain request/response exchange
+STREAM_EVENTS = (0, None, "events", {})
+HIJACK = (0, None, "hijack", {})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Like dockerd, otherwise Nagle's algorithm adds delayed ACK stalls
+    disable_nagle_algorithm = True
+    server: "_Server"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.daemon.record_connection()
+
+    def do_GET(self):
+        self.__dispatch()
+
+    def do_POST(self):
+        self.__dispatch()
+
+    def do_PUT(self):
+        self.__dispatch()
+
+    def do_DELETE(self):
+        self.__dispatch()
+
+    def do_HEAD(self):
+        self.__dispatch()
+
+    def __body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            body = io.BytesIO()
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return body.getvalue()
+                body.write(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def __dispatch(self) -> None:
+        url = urlsplit(self.path)
+        response = self.server.daemon.handle(
+            self.command, url.path, parse_qs(url.query), self.__body()
+        )
+
+        if response == STREAM_EVENTS:
+            # Hold the stream open without events until the daemon stops
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self.wfile.flush()
+            self.server.daemon.wait_stopped()
+            self.wfile.write(b"0\r\n\r\n")
+            self.close_connection = True
+            return
+        if response == HIJACK:
+            # Exec output is read from the raw socket until it closes
+            self.send_response(200)
+            self.send_header("Content-Type", "application/vnd.docker.raw-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            return
+
+        status, body, content_type, headers = response
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode("utf-8")
+        body = body or b""
+        chunk_size = self.server.daemon.chunk_size
+        chunked = chunk_size and self.command != "HEAD" and status not in (204, 304)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        if chunked:
+            for start in range(0, len(body), chunk_size):
+                chunk = body[start : start + chunk_size]
+                self.wfile.write(
+                    f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n"
+                )
+            self.wfile.write(b"0\r\n\r\n")
+        elif self.command != "HEAD":
+            self.wfile.write(body)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, daemon: FakeDockerDaemon):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.daemon = daemon
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on answers they stopped waiting for, e.g. on timeouts
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
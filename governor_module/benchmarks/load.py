@@ -0,0 +1,87 @@
+import resource
+import sys
+import threading
+from time import perf_counter
+from typing import Callable, TypedDict
+
+
+class LoadReport(TypedDict):
+    name: str
+    requests: int
+    errors: int
+    duration: float
+    throughput: float
+    p50: float
+    p99: float
+    peak_rss: int
+
+
+def peak_rss() -> int:
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def percentile(latencies: list[float], ratio: float) -> float:
+    if not latencies:
+        return 0.0
+    return latencies[min(int(len(latencies) * ratio), len(latencies) - 1)]
+
+
+def run(
+    name: str,
+    operation: Callable[[int, int], bool],
+    threads: int,
+    requests: int,
+) -> LoadReport:
+    # operation(worker, iteration) does one request and tells if it succeeded
+    latencies: list[list[float]] = [[] for _ in range(threads)]
+    errors = [0] * threads
+
+    def worker(index: int) -> None:
+        for iteration in range(index, requests, threads):
+            started_at = perf_counter()
+            try:
+                succeeded = operation(index, iteration)
+            except Exception:
+                succeeded = False
+            latencies[index].append(perf_counter() - started_at)
+            if not succeeded:
+                errors[index] += 1
+
+    workers = [
+        threading.Thread(target=worker, args=(index,), name=f"{name}-{index}")
+        for index in range(threads)
+    ]
+    started_at = perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    duration = perf_counter() - started_at
+
+    merged = sorted(latency for worker in latencies for latency in worker)
+    return LoadReport(
+        name=name,
+        requests=len(merged),
+        errors=sum(errors),
+        duration=duration,
+        throughput=len(merged) / duration if duration else 0.0,
+        p50=percentile(merged, 0.5),
+        p99=percentile(merged, 0.99),
+        peak_rss=peak_rss(),
+    )
+
+
+def print_reports(title: str, reports: list[LoadReport]) -> None:
+    print(title)
+    print(
+        f"  {'scenario':<12} {'requests':>8} {'errors':>6} {'req/s':>9} "
+        f"{'p50 ms':>9} {'p99 ms':>9} {'peak RSS MiB':>13}"
+    )
+    for report in reports:
+        print(
+            f"  {report['name']:<12} {report['requests']:>8} {report['errors']:>6} "
+            f"{report['throughput']:>9.1f} {report['p50'] * 1000:>9.2f} "
+            f"{report['p99'] * 1000:>9.2f} {report['peak_rss'] / 1024**2:>13.1f}"
+        )
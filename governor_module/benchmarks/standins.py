@@ -0,0 +1,244 @@
+import threading
+from datetime import datetime
+from time import monotonic, sleep
+
+from cde_governor.crpyto import encrypt_with_salt, verify_with_salt
+from pymysql import IntegrityError
+
+
+class FakeDatabase:
+    def __init__(self, latency: float = 0.001):
+        self.__latency = latency
+        self.__lock = threading.Lock()
+        self.__users: dict[str, tuple[int, str]] = dict()
+        self.__containers: dict[tuple[int, int], tuple[str, str, int]] = dict()
+        self.__jobs: dict[int, tuple[int, str, int, str | None]] = dict()
+        self.__job_batches: dict[int, str | None] = dict()
+        self.__backups: dict[int, tuple] = dict()
+        self.__deleted_backups: set[int] = set()
+        self.__connected_at: dict[str, float] = dict()
+        self.queries = 0
+
+    def __round_trip(self) -> None:
+        with self.__lock:
+            self.queries += 1
+        if self.__latency:
+            sleep(self.__latency)
+
+    def create_user(self, username: str, password: str) -> int:
+        self.__round_trip()
+        with self.__lock:
+            if username in self.__users:
+                raise IntegrityError(1062, f"Duplicate entry '{username}'")
+            user_id = len(self.__users) + 1
+            self.__users[username] = (user_id, encrypt_with_salt(password))
+            return user_id
+
+    def get_existing_usernames(self, usernames: list[str]) -> set[str]:
+        self.__round_trip()
+        with self.__lock:
+            return {username for username in usernames if username in self.__users}
+
+    def create_users(
+        self, users: list[tuple[str, str]], batch: str | None = None
+    ) -> list[tuple[str, int, int]]:
+        self.__round_trip()
+        with self.__lock:
+            if any(username in self.__users for username, _ in users):
+                raise IntegrityError(1062, "Duplicate entry")
+            created = []
+            for username, password in users:
+                user_id = len(self.__users) + 1
+                self.__users[username] = (user_id, encrypt_with_salt(password))
+                job_id = len(self.__jobs) + 1
+                self.__jobs[job_id] = (user_id, "pending", 0, None)
+                self.__job_batches[job_id] = batch
+                created.append((username, user_id, job_id))
+            return created
+
+    def get_credentials(self, username: str) -> tuple[int, str] | None:
+        self.__round_trip()
+        with self.__lock:
+            return self.__users.get(username)
+
+    def auth(self, username: str, password: str) -> int | None:
+        credentials = self.get_credentials(username)
+        if credentials is None:
+            return None
+        if verify_with_salt(credentials[1], password):
+            return credentials[0]
+        return None
+
+    def update_pw(self, username: str, new_password: str) -> None:
+        self.__round_trip()
+        with self.__lock:
+            user_id, _ = self.__users[username]
+            self.__users[username] = (user_id, encrypt_with_salt(new_password))
+
+    def sync_servers(self, servers: list[tuple[str, int]]) -> None:
+        self.__round_trip()
+
+    def save_containers(self, containers: list[tuple[str, str, int, int, int]]) -> None:
+        self.__round_trip()
+        with self.__lock:
+            for id, host, gpu, user_id, container_type in containers:
+                self.__containers[(user_id, int(container_type))] = (host, id, gpu)
+
+    def get_container(self, user_id: int, container_type: int) -> tuple[str, str]:
+        self.__round_trip()
+        with self.__lock:
+            container = self.__containers.get((user_id, int(container_type)))
+            return None if container is None else container[:2]
+
+    def get_containers(self) -> list[tuple[str, str]]:
+        self.__round_trip()
+        with self.__lock:
+            return [(host, id) for host, id, _ in self.__containers.values()]
+
+    def touch_container(self, container_id: str) -> None:
+        self.__round_trip()
+        with self.__lock:
+            self.__connected_at[container_id] = monotonic()
+
+    def get_container_activity(self) -> list[tuple[str, str, int | None]]:
+        self.__round_trip()
+        now = monotonic()
+        with self.__lock:
+            return [
+                (
+                    host,
+                    id,
+                    (
+                        int(now - self.__connected_at[id])
+                        if id in self.__connected_at
+                        else None
+                    ),
+                )
+                for host, id, _ in self.__containers.values()
+            ]
+
+    def inspect_container_allocation(self) -> dict[tuple[str, int], int]:
+        self.__round_trip()
+        allocations = dict()
+        with self.__lock:
+            for host, _, gpu in self.__containers.values():
+                allocations[(host, gpu)] = allocations.get((host, gpu), 0) + 1
+        return allocations
+
+    def update_provisioning_job(
+        self, job_id: int, status: str, progress: int, error: str | None = None
+    ) -> None:
+        self.__round_trip()
+        with self.__lock:
+            self.__jobs[job_id] = (self.__jobs[job_id][0], status, progress, error)
+
+    def get_provisioning_job(self, user_id: int) -> tuple[int, str, int, str] | None:
+        self.__round_trip()
+        with self.__lock:
+            for job_id in sorted(self.__jobs, reverse=True):
+                job_user, status, progress, error = self.__jobs[job_id]
+                if job_user == user_id:
+                    return job_id, status, progress, error
+        return None
+
+    def claim_provisioning_jobs(self, limit: int = 1000) -> list[tuple[int, int, str]]:
+        self.__round_trip()
+        with self.__lock:
+            usernames = {user_id: name for name, (user_id, _) in self.__users.items()}
+            jobs = [
+                (job_id, user_id, usernames[user_id])
+                for job_id, (user_id, status, _, _) in sorted(self.__jobs.items())
+                if status == "pending"
+            ][:limit]
+            for job_id, user_id, _ in jobs:
+                self.__jobs[job_id] = (user_id, "running", 0, None)
+            return jobs
+
+    def requeue_provisioning_jobs(self) -> int:
+        self.__round_trip()
+        with self.__lock:
+            running = [
+                job_id
+                for job_id, (_, status, _, _) in self.__jobs.items()
+                if status == "running"
+            ]
+            for job_id in running:
+                self.__jobs[job_id] = (self.__jobs[job_id][0], "pending", 0, None)
+            return len(running)
+
+    def get_unfinished_provisioning_jobs(self) -> list[tuple[int, int, str]]:
+        self.__round_trip()
+        usernames = {user_id: name for name, (user_id, _) in self.__users.items()}
+        with self.__lock:
+            return [
+                (job_id, user_id, usernames[user_id])
+                for job_id, (user_id, status, _, _) in sorted(self.__jobs.items())
+                if status in ("pending", "running")
+            ]
+
+    def get_provisioning_jobs(
+        self, batch: str
+    ) -> list[tuple[int, str, str, int, str | None]]:
+        self.__round_trip()
+        with self.__lock:
+            usernames = {user_id: name for name, (user_id, _) in self.__users.items()}
+            return [
+                (job_id, usernames[user_id], status, progress, error)
+                for job_id, (user_id, status, progress, error) in sorted(
+                    self.__jobs.items()
+                )
+                if self.__job_batches.get(job_id) == batch
+            ]
+
+    def add_backup(
+        self, container_id: str, name: str, path: str, mode: str, size: int
+    ) -> int:
+        self.__round_trip()
+        with self.__lock:
+            user_id = next(
+                (
+                    user
+                    for (user, _), (_, id, _) in self.__containers.items()
+                    if id == container_id
+                ),
+                None,
+            )
+            backup_id = len(self.__backups) + 1
+            self.__backups[backup_id] = (
+                backup_id,
+                user_id,
+                container_id,
+                name,
+                path,
+                mode,
+                size,
+                datetime.now(),
+            )
+            return backup_id
+
+    def get_backups(self, user_id: int | None = None) -> list[tuple]:
+        self.__round_trip()
+        with self.__lock:
+            return [
+                backup
+                for backup_id, backup in sorted(self.__backups.items(), reverse=True)
+                if backup_id not in self.__deleted_backups
+                and (user_id is None or backup[1] == user_id)
+            ]
+
+    def get_deleted_backups(self) -> list[tuple]:
+        self.__round_trip()
+        with self.__lock:
+            return [self.__backups[backup_id] for backup_id in self.__deleted_backups]
+
+    def mark_backups_deleted(self, backup_ids: list[int]) -> None:
+        self.__round_trip()
+        with self.__lock:
+            self.__deleted_backups.update(backup_ids)
+
+    def purge_backups(self, backup_ids: list[int]) -> None:
+        self.__round_trip()
+        with self.__lock:
+            for backup_id in backup_ids:
+                self.__backups.pop(backup_id, None)
+                self.__deleted_backups.discard(backup_id)
@@ -0,0 +1,70 @@
+import argparse
+import os
+import sys
+from time import sleep
+
+import requests
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Create users and their environments from a CSV of username,password"
+    )
+    parser.add_argument("csv", help="CSV file with a username,password header")
+    parser.add_argument(
+        "--url",
+        default=os.getenv("GOVERNOR_URL", "https://localhost"),
+        help="governor base URL",
+    )
+    parser.add_argument("--token", default=os.getenv("ADMIN_TOKEN"))
+    parser.add_argument("--interval", type=float, default=5)
+    parser.add_argument(
+        "--insecure", action="store_true", help="skip TLS certificate verification"
+    )
+    args = parser.parse_args()
+    if not args.token:
+        parser.error("--token or ADMIN_TOKEN is required")
+
+    session = requests.Session()
+    session.headers["Authorization"] = f"Bearer {args.token}"
+    session.verify = not args.insecure
+
+    with open(args.csv, "rb") as f:
+        response = session.post(f"{args.url}/admin/users", files={"users": f})
+    if response.status_code != 202:
+        sys.exit(f"Failed to submit users ({response.status_code}): {response.text}")
+
+    submission = response.json()
+    for rejection in submission["rejected"]:
+        print(
+            f"line {rejection['line']}: {rejection['username'] or '-'}: {rejection['error']}"
+        )
+    print(
+        f"{len(submission['accepted'])} users created, {len(submission['rejected'])} rejected"
+    )
+    if not submission["accepted"]:
+        return
+
+    # Progress covers only the jobs of this submission
+    while True:
+        progress = session.get(
+            f"{args.url}/admin/provisioning", params={"batch": submission["batch"]}
+        ).json()
+        finished = progress["done"] + progress["failed"]
+        print(
+            f"{finished}/{progress['total']} environments finished "
+            f"({progress['done']} done, {progress['failed']} failed)",
+            flush=True,
+        )
+        if progress["pending"] + progress["running"] == 0:
+            break
+        sleep(args.interval)
+
+    for failure in progress["failures"]:
+        print(f"{failure['username']}: {failure['error']}")
+    if progress["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,14 @@
+import os
+
 import main
 
+SERVE_MODE = os.getenv("SERVE_MODE", "dev")
+
 if __name__ == "__main__":
-    cores = main.server_core()
-    gov = cores.runner()
+    if SERVE_MODE == "production":
+        from serving import GovernorApplication
+
+        GovernorApplication().run()
+    else:
+        cores = main.server_core()
+        gov = cores.runner()
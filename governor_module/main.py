@@ -1,44 +1,242 @@
+import functools
+import hmac
 import io
 import os
 import tarfile
+import threading
+from datetime import datetime
+from time import perf_counter
 from hashlib import sha512 as hash
 from json import loads
 
 from apscheduler.schedulers.background import BackgroundScheduler
+from cde_governor.announcements import AnnouncementStore
+from cde_governor.auth import Authenticator
+from cde_governor.bulk import USERNAME_MAX_LENGTH, BulkProvisioner, parse_users
+from cde_governor.compression import check_compression, compress_stream, is_compressed
 from cde_governor.db import Database
-from cde_governor.manage import Manager
-from flask import Flask, flash, redirect, render_template, request, send_file, session
+from cde_governor.health import HostUnavailableError
+from cde_governor.leader import LeaderLock
+from cde_governor.manage import ContainerNotFoundError, Manager
+from cde_governor.metrics import (
+    REQUEST_DURATION,
+    SCHEDULER_JOB_DURATION,
+    SCHEDULER_JOB_FAILURES,
+    render,
+)
+from cde_governor.provisioning import ProvisioningQueue
+from cde_governor.streams import tar_stream
+from flask import (
+    Flask,
+    Response,
+    flash,
+    g,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    send_file,
+    session,
+    stream_with_context,
+)
 from logger_initializer import setup_logger
 from pymysql import IntegrityError
 
 ANNOUNCEMENT_PATH = os.getenv("ANNOUNCEMENT_PATH")
+ANNOUNCEMENT_RELOAD_INTERVAL = float(os.getenv("ANNOUNCEMENT_RELOAD_INTERVAL", 10))
+
+SECRET_KEY = os.getenv("SECRET_KEY")
+SSL_CERT_PATH = os.getenv("SSL_CERT_PATH")
+SSL_KEY_PATH = os.getenv("SSL_KEY_PATH")
+# The Werkzeug debugger runs arbitrary code for anyone who can reach it
+DEV_DEBUG = os.getenv("DEV_DEBUG", "false").lower() == "true"
+LEADER_LOCK_PATH = os.getenv("LEADER_LOCK_PATH", "governor.leader.lock")
+STARTUP_MODE = os.getenv("STARTUP_MODE", "background")
+STARTUP_RETRY_INTERVAL = float(os.getenv("STARTUP_RETRY_INTERVAL", 10))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
 LOG_PATH = os.getenv("LOG_PATH")
 BACKUP_PATH = os.getenv("BACKUP_PATH")
 CDE_IMAGE = os.getenv("CDE_IMAGE")
 CDE_PORT = os.getenv("CDE_PORT")
 SERVER_INFO = loads(os.getenv("SERVER_INFO"))
+DOCKER_API_VERSION = os.getenv("DOCKER_API_VERSION", "auto")
+DOCKER_MAX_POOL_SIZE = int(os.getenv("DOCKER_MAX_POOL_SIZE", 10))
+DOCKER_IDLE_TIMEOUT = float(os.getenv("DOCKER_IDLE_TIMEOUT", 600))
+DOCKER_FANOUT_CONCURRENCY = int(os.getenv("DOCKER_FANOUT_CONCURRENCY", 4))
+DOCKER_FANOUT_TIMEOUT = float(os.getenv("DOCKER_FANOUT_TIMEOUT", 10))
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", 10))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", 3))
+HEALTH_FAILURE_THRESHOLD = int(os.getenv("HEALTH_FAILURE_THRESHOLD", 3))
+ENDPOINT_CACHE_TTL = float(os.getenv("ENDPOINT_CACHE_TTL", 300))
+PLACEMENT_STRATEGY = os.getenv("PLACEMENT_STRATEGY", "least_loaded")
+PLACEMENT_SLOT_CAPACITY = (
+    int(os.getenv("PLACEMENT_SLOT_CAPACITY"))
+    if os.getenv("PLACEMENT_SLOT_CAPACITY")
+    else None
+)
+RESOURCE_SAMPLE_INTERVAL = float(os.getenv("RESOURCE_SAMPLE_INTERVAL", 30))
+GPU_PROBE_IMAGE = os.getenv("GPU_PROBE_IMAGE") or None
+GPU_PROBE_INTERVAL = float(os.getenv("GPU_PROBE_INTERVAL", 600))
+IMAGE_PULL_CONCURRENCY = int(os.getenv("IMAGE_PULL_CONCURRENCY", 2))
+IMAGE_PULL_INTERVAL_HOURS = float(os.getenv("IMAGE_PULL_INTERVAL_HOURS", 6))
+IMAGE_REFRESH_INTERVAL = float(os.getenv("IMAGE_REFRESH_INTERVAL", 60))
+IDLE_TIMEOUT_MINUTES = float(os.getenv("IDLE_TIMEOUT_MINUTES", 0))
+WARM_POOL_MIN_SIZE = int(os.getenv("WARM_POOL_MIN_SIZE", 0))
+WARM_POOL_MAX_SIZE = int(os.getenv("WARM_POOL_MAX_SIZE", 0))
+PROVISIONING_WORKERS = int(os.getenv("PROVISIONING_WORKERS", 4))
+PROVISIONING_POLL_INTERVAL = float(os.getenv("PROVISIONING_POLL_INTERVAL", 1))
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", 100))
+BULK_PER_HOST_CONCURRENCY = int(os.getenv("BULK_PER_HOST_CONCURRENCY", 2))
+WATCH_CONTAINER_EVENTS = os.getenv("WATCH_CONTAINER_EVENTS", "true").lower() == "true"
+BACKUP_PER_HOST_CONCURRENCY = int(os.getenv("BACKUP_PER_HOST_CONCURRENCY", 2))
+BACKUP_GLOBAL_CONCURRENCY = int(os.getenv("BACKUP_GLOBAL_CONCURRENCY", 8))
+BACKUP_RETRIES = int(os.getenv("BACKUP_RETRIES", 2))
+BACKUP_MODE = os.getenv("BACKUP_MODE", "full")
+BACKUP_COMPRESSION = os.getenv("BACKUP_COMPRESSION", "none")
+BACKUP_COMPRESSION_LEVEL = (
+    int(os.getenv("BACKUP_COMPRESSION_LEVEL"))
+    if os.getenv("BACKUP_COMPRESSION_LEVEL")
+    else None
+)
+BACKUP_KEEP_LAST = int(os.getenv("BACKUP_KEEP_LAST", 0))
+BACKUP_KEEP_DAILY = int(os.getenv("BACKUP_KEEP_DAILY", 0))
+BACKUP_KEEP_WEEKLY = int(os.getenv("BACKUP_KEEP_WEEKLY", 0))
+BACKUP_KEEP_MONTHLY = int(os.getenv("BACKUP_KEEP_MONTHLY", 0))
+BACKUP_USER_QUOTA = int(os.getenv("BACKUP_USER_QUOTA", 0))
+BACKUP_CHUNK_GRACE_HOURS = float(os.getenv("BACKUP_CHUNK_GRACE_HOURS", 24))
+BACKUP_DOWNLOAD_MODE = os.getenv("BACKUP_DOWNLOAD_MODE", "stream")
+BACKUP_DOWNLOAD_STORE = os.getenv("BACKUP_DOWNLOAD_STORE", "true").lower() == "true"
+
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", 0)) or None
+UPLOAD_COMPRESSION = os.getenv("UPLOAD_COMPRESSION", "gzip")
+UPLOAD_COMPRESSION_LEVEL = (
+    int(os.getenv("UPLOAD_COMPRESSION_LEVEL"))
+    if os.getenv("UPLOAD_COMPRESSION_LEVEL")
+    else None
+)
+UPLOAD_SKIP_COMPRESSED = os.getenv("UPLOAD_SKIP_COMPRESSED", "true").lower() == "true"
 
 DB_HOST = os.getenv("MYSQL_HOST")
 DB_NAME = os.getenv("MYSQL_DATABASE")
 DB_USER = os.getenv("MYSQL_USER")
 DB_USER_PW = os.getenv("MYSQL_PASSWORD")
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+DB_POOL_MAX_IDLE_TIME = float(os.getenv("DB_POOL_MAX_IDLE_TIME", 300))
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 30))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10000))
 
 CONTAINER_TYPE_DEV = 0
 CONTAIENR_TYPE_VAL = 1
+# Forms and URLs name container types, Manager works with the numbers
+CONTAINER_TYPES = {"dev": CONTAINER_TYPE_DEV, "val": CONTAIENR_TYPE_VAL}
 
 
 class server_core:
-    def __init__(self):
+    def __init__(self, db: Database | None = None):
+        # A typo would otherwise only fail mid-upload or mid-backup
+        check_compression(BACKUP_COMPRESSION)
+        check_compression(UPLOAD_COMPRESSION)
         self.__app = Flask(__name__)
-        self.__app.secret_key = hash(os.urandom(32)).hexdigest()
+        # Workers must share the key or sessions break between processes
+        self.__app.secret_key = SECRET_KEY or hash(os.urandom(32)).hexdigest()
+        self.__app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_SIZE
         self.__logger = self.__setup_logger()
-        self.__db = self.__setup_db()
-        self.__manager = self.__setup_manager()
-        self.__scheduler = self.__setup_backup_scheduler()
+        self.__db = db
+        self.__auth = None
+        self.__manager = None
+        self.__provisioning = None
+        self.__bulk = None
+        self.__scheduler = None
+        self.__announcements = AnnouncementStore(
+            ANNOUNCEMENT_PATH, interval=ANNOUNCEMENT_RELOAD_INTERVAL
+        )
+        self.__announcements.start()
+        self.__leader = self.__elect_leader()
+
+        self.__started_at = perf_counter()
+        self.__ready = threading.Event()
+        self.__stopping = threading.Event()
+        self.__startup_steps = dict()
+        self.__startup_error = None
+
+        self.__measure_requests()
+        self.__check_readiness()
         self.__handle_routes()
         self.__handle_requests()
 
+        if STARTUP_MODE == "background":
+            # Serve liveness and readiness right away, the DB and the Docker
+            # hosts can take long to come up on a big fleet
+            threading.Thread(
+                target=self.__initialize_until_ready,
+                name="governor-startup",
+                daemon=True,
+            ).start()
+        else:
+            self.__initialize()
+
+    def __timed_step(self, name, setup):
+        started_at = perf_counter()
+        result = setup()
+        self.__startup_steps[name] = perf_counter() - started_at
+        return result
+
+    def __initialize(self):
+        # Steps that succeeded are kept when a later one fails and is retried
+        if self.__db is None:
+            self.__db = self.__timed_step("db", self.__setup_db)
+            if self.__db is None:
+                raise RuntimeError("DB is unavailable")
+        if self.__auth is None:
+            self.__auth = Authenticator(
+                self.__db,
+                ttl=AUTH_CACHE_TTL,
+                max_size=AUTH_CACHE_SIZE,
+            )
+        if self.__manager is None:
+            self.__manager = self.__timed_step("manager", self.__setup_manager)
+        if self.__provisioning is None:
+            self.__provisioning = self.__timed_step(
+                "provisioning", self.__setup_provisioning
+            )
+        self.__bulk = BulkProvisioner(
+            self.__db, self.__provisioning.wake, batch_size=BULK_BATCH_SIZE
+        )
+        if self.__scheduler is None:
+            self.__scheduler = self.__setup_backup_scheduler()
+            self.__schedule_image_distribution()
+            if self.__leader.is_leader:
+                self.__lead()
+            else:
+                # Take over if the current leader goes away
+                self.__leader.wait_for_leadership(self.__lead)
+
+        self.__ready.set()
+        self.__logger.info(
+            f"Governor is ready after {perf_counter() - self.__started_at:.2f}s"
+        )
+
+    def __initialize_until_ready(self):
+        while not self.__stopping.is_set():
+            try:
+                self.__initialize()
+                self.__startup_error = None
+                return
+            except Exception as e:
+                self.__startup_error = f"{type(e).__name__}: {e}"
+                self.__logger.error(
+                    f"Failed to start, retrying in {STARTUP_RETRY_INTERVAL}s",
+                    exc_info=True,
+                )
+            self.__stopping.wait(STARTUP_RETRY_INTERVAL)
+
+    def wait_until_ready(self, timeout=None):
+        return self.__ready.wait(timeout)
+
     def __setup_logger(self):
         return setup_logger(
             "cde_logger",
@@ -46,11 +244,35 @@ class server_core:
             log_format='%(asctime)s %(name)-12s %(levelname)-8s at "%(filename)s", line %(lineno)s, in %(funcName)s: %(message)s',
         )
 
+    def __elect_leader(self):
+        leader = LeaderLock(LEADER_LOCK_PATH)
+        leader.try_acquire()
+        return leader
+
+    def __lead(self):
+        # Everything that must run in a single process: provisioning (placement
+        # and the warm pool), the background tasks and the scheduled jobs
+        self.__logger.info(f"Process {os.getpid()} leads the governor")
+        self.__manager.start_background_tasks()
+        self.__provisioning.start_dispatching()
+        self.__scheduler.start()
+
+    @property
+    def app(self):
+        return self.__app
+
     def __setup_db(self):
         self.__logger.info("Setting up DB")
         try:
             return Database(
-                host=DB_HOST, user=DB_USER, password=DB_USER_PW, database=DB_NAME
+                host=DB_HOST,
+                user=DB_USER,
+                password=DB_USER_PW,
+                database=DB_NAME,
+                pool_min_size=DB_POOL_MIN_SIZE,
+                pool_max_size=DB_POOL_MAX_SIZE,
+                pool_timeout=DB_POOL_TIMEOUT,
+                pool_max_idle_time=DB_POOL_MAX_IDLE_TIME,
             )
         except Exception:
             self.__logger.error("Failed to setup DB", exc_info=True)
@@ -65,9 +287,65 @@ class server_core:
                 "cde_image": CDE_IMAGE,
                 "cde_port": CDE_PORT,
                 "db": self.__db,
+                "background_tasks": self.__leader.is_leader,
+                "docker_api_version": DOCKER_API_VERSION,
+                "docker_max_pool_size": DOCKER_MAX_POOL_SIZE,
+                "docker_idle_timeout": DOCKER_IDLE_TIMEOUT,
+                "docker_fanout_concurrency": DOCKER_FANOUT_CONCURRENCY,
+                "docker_fanout_timeout": DOCKER_FANOUT_TIMEOUT,
+                "health_check_interval": HEALTH_CHECK_INTERVAL,
+                "health_probe_timeout": HEALTH_PROBE_TIMEOUT,
+                "health_failure_threshold": HEALTH_FAILURE_THRESHOLD,
+                "endpoint_cache_ttl": ENDPOINT_CACHE_TTL,
+                "watch_events": WATCH_CONTAINER_EVENTS,
+                "placement_strategy": PLACEMENT_STRATEGY,
+                "placement_slot_capacity": PLACEMENT_SLOT_CAPACITY,
+                "resource_sample_interval": RESOURCE_SAMPLE_INTERVAL,
+                "gpu_probe_image": GPU_PROBE_IMAGE,
+                "gpu_probe_interval": GPU_PROBE_INTERVAL,
+                "image_pull_concurrency": IMAGE_PULL_CONCURRENCY,
+                "image_refresh_interval": IMAGE_REFRESH_INTERVAL,
+                "idle_timeout": IDLE_TIMEOUT_MINUTES * 60,
+                "warm_pool_min_size": WARM_POOL_MIN_SIZE,
+                "warm_pool_max_size": WARM_POOL_MAX_SIZE,
+                "bulk_per_host_concurrency": BULK_PER_HOST_CONCURRENCY,
+                "backup_per_host_concurrency": BACKUP_PER_HOST_CONCURRENCY,
+                "backup_global_concurrency": BACKUP_GLOBAL_CONCURRENCY,
+                "backup_retries": BACKUP_RETRIES,
+                "backup_mode": BACKUP_MODE,
+                "backup_compression": BACKUP_COMPRESSION,
+                "backup_compression_level": BACKUP_COMPRESSION_LEVEL,
+                "backup_retention": {
+                    "keep_last": BACKUP_KEEP_LAST,
+                    "keep_daily": BACKUP_KEEP_DAILY,
+                    "keep_weekly": BACKUP_KEEP_WEEKLY,
+                    "keep_monthly": BACKUP_KEEP_MONTHLY,
+                    "max_bytes_per_user": BACKUP_USER_QUOTA,
+                },
+                "backup_chunk_grace_period": BACKUP_CHUNK_GRACE_HOURS * 60 * 60,
             }
         )
 
+    def __setup_provisioning(self):
+        self.__logger.info("Setting up provisioning queue")
+        provisioning = ProvisioningQueue(
+            self.__db,
+            self.__manager.create_cde,
+            create_cdes=self.__manager.create_cdes,
+            workers=PROVISIONING_WORKERS,
+            poll_interval=PROVISIONING_POLL_INTERVAL,
+        )
+        provisioning.start(dispatch=False)
+        return provisioning
+
+    def __timed_job(self, job):
+        @functools.wraps(job)
+        def timed():
+            with SCHEDULER_JOB_DURATION.labels(job.__name__).time():
+                job()
+
+        return timed
+
     def __setup_backup_scheduler(self):
         self.__logger.info("Setting up backup scheduler")
         scheduler = BackgroundScheduler()
@@ -75,24 +353,129 @@ class server_core:
         def backup_containers():
             self.__logger.info("Start backing up containers")
             try:
-                self.__manager.backup_containers()
+                report = self.__manager.backup_containers()
             except:
+                SCHEDULER_JOB_FAILURES.labels("backup_containers").inc()
                 self.__logger.error("Failed to backup containers", exc_info=True)
                 return
-            self.__logger.info("Finished backing up containers")
+
+            for result in report["results"]:
+                if result["error"] is not None:
+                    self.__logger.error(
+                        f"Failed to backup container {result['container_id']} on {result['host']} after {result['attempts']} attempts: {result['error']}"
+                    )
+            self.__logger.info(
+                f"Finished backing up containers ({report['succeeded']} succeeded, {report['failed']} failed, {report['total_bytes']} bytes, {report['duration']:.1f}s)"
+            )
+
+            try:
+                # Deletion runs in the background and does not hold up the job
+                expired = self.__manager.enforce_retention()
+                if expired:
+                    self.__logger.info(f"{len(expired)} backups expired")
+            except:
+                self.__logger.error("Failed to enforce backup retention", exc_info=True)
 
         scheduler.add_job(
-            backup_containers, "cron", day_of_week="mon", hour=0, minute=0
+            self.__timed_job(backup_containers),
+            "cron",
+            day_of_week="mon",
+            hour=0,
+            minute=0,
         )
         # self.__scheduler.add_job(backup_containers, 'interval', seconds=10)
-        scheduler.start()
-
         return scheduler
 
+    def __schedule_image_distribution(self):
+        self.__logger.info("Scheduling image distribution")
+
+        def distribute_image():
+            self.__logger.info(f"Start distributing {CDE_IMAGE}")
+            try:
+                results = self.__manager.distribute_image()
+            except:
+                SCHEDULER_JOB_FAILURES.labels("distribute_image").inc()
+                self.__logger.error("Failed to distribute image", exc_info=True)
+                return
+
+            for result in results:
+                if result["error"] is not None:
+                    self.__logger.error(
+                        f"Failed to pull {CDE_IMAGE} on {result['host']}: {result['error']}"
+                    )
+                else:
+                    self.__logger.info(
+                        f"{result['host']} has {CDE_IMAGE}@{result['digest']} ({result['duration']:.1f}s)"
+                    )
+
+        # Run once right away so hosts are warmed before the first placement
+        self.__scheduler.add_job(
+            self.__timed_job(distribute_image),
+            "interval",
+            hours=IMAGE_PULL_INTERVAL_HOURS,
+            next_run_time=datetime.now(),
+            max_instances=1,
+            coalesce=True,
+        )
+
+    def __measure_requests(self):
+        @self.__app.before_request
+        def start_timer():
+            g.started_at = perf_counter()
+
+        @self.__app.after_request
+        def observe_duration(response):
+            started_at = g.pop("started_at", None)
+            if started_at is not None:
+                # Label by rule rather than path to keep the series bounded
+                route = request.url_rule.rule if request.url_rule else "unmatched"
+                REQUEST_DURATION.labels(
+                    request.method, route, response.status_code
+                ).observe(perf_counter() - started_at)
+            return response
+
+        @self.__app.route("/metrics", methods=["GET"])
+        def metrics():
+            body, content_type = render()
+            return Response(body, content_type=content_type)
+
+    def __check_readiness(self):
+        # Everything else needs the DB or the manager
+        available_while_starting = {"liveness", "readiness", "metrics", "static"}
+
+        @self.__app.before_request
+        def reject_until_ready():
+            if self.__ready.is_set() or request.endpoint in available_while_starting:
+                return None
+            response = jsonify({"error": "Governor is starting"})
+            response.status_code = 503
+            response.headers["Retry-After"] = "5"
+            return response
+
+        @self.__app.route("/livez", methods=["GET"])
+        def liveness():
+            return jsonify({"status": "alive"})
+
+        @self.__app.route("/readyz", methods=["GET"])
+        def readiness():
+            status = {
+                "status": "ready" if self.__ready.is_set() else "starting",
+                "steps": self.__startup_steps,
+                "error": self.__startup_error,
+            }
+            return jsonify(status), 200 if self.__ready.is_set() else 503
+
     def __is_authenticated(self):
         user = session.get("user", None)
         return user is not None
 
+    def __is_admin(self):
+        if not ADMIN_TOKEN:
+            return False
+        return hmac.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {ADMIN_TOKEN}"
+        )
+
     def __handle_routes(self):
         @self.__app.route("/", methods=["GET"])
         def index():
@@ -116,8 +499,46 @@ class server_core:
                 flash("Login required")
                 return redirect("/login")
 
+            user = session.get("user")
+            try:
+                cde_statuses = self.__manager.get_cde_statuses(user)
+            except Exception:
+                self.__logger.debug("Failed to get CDE statuses", exc_info=True)
+                cde_statuses = dict()
+            statuses = {
+                type_name: cde_statuses.get(container_type)
+                for type_name, container_type in CONTAINER_TYPES.items()
+            }
+
             return render_template(
-                "dashboard.html", username=session.get("username", "Unknown user")
+                "dashboard.html",
+                username=session.get("username", "Unknown user"),
+                statuses=statuses,
+                provisioning=self.__provisioning.get_job(user),
+            )
+
+        @self.__app.route("/provisioning", methods=["GET"])
+        def provisioning_status():
+            if not self.__is_authenticated():
+                return jsonify(None), 401
+
+            return jsonify(self.__provisioning.get_job(session.get("user")))
+
+        @self.__app.route("/backups", methods=["GET"])
+        def backup_list():
+            if not self.__is_authenticated():
+                return jsonify(None), 401
+
+            return jsonify(
+                [
+                    {
+                        "id": backup["id"],
+                        "name": os.path.basename(backup["path"]),
+                        "size": backup["size"],
+                        "created_at": backup["created_at"].isoformat(),
+                    }
+                    for backup in self.__manager.list_backups(session.get("user"))
+                ]
             )
 
         @self.__app.route("/check_pw", methods=["GET"])
@@ -144,11 +565,34 @@ class server_core:
                 flash("Login required")
                 return redirect("/login")
 
-            return redirect(
-                self.__manager.get_cde_url(session.get("user"), container_type)
-            )
+            if container_type not in CONTAINER_TYPES:
+                flash("Unknown environment")
+                return redirect("/dashboard")
+
+            try:
+                return redirect(
+                    self.__manager.get_cde_url(
+                        session.get("user"), CONTAINER_TYPES[container_type]
+                    )
+                )
+            except HostUnavailableError:
+                self.__logger.warning("Failed to connect to CDE", exc_info=True)
+                flash("The server of your environment is unavailable at the moment")
+                return redirect("/dashboard")
+            except ContainerNotFoundError:
+                job = self.__provisioning.get_job(session.get("user"))
+                if job is not None and job["status"] in ("pending", "running"):
+                    flash("Your environment is still being prepared")
+                else:
+                    flash("You have no environment to connect to")
+                return redirect("/dashboard")
 
     def __handle_requests(self):
+        @self.__app.errorhandler(413)
+        def handle_request_too_large(e):
+            flash("Upload is too large")
+            return redirect("/dashboard")
+
         @self.__app.route("/login", methods=["POST"])
         def handle_login_request():
             data = request.form.to_dict()
@@ -156,7 +600,7 @@ class server_core:
             password = data.get("password", None)
 
             self.__logger.debug(f'User "{username}" tries to log in')
-            user_id = self.__db.auth(username, password)
+            user_id = self.__auth.auth(username, password)
             if user_id is None:
                 self.__logger.debug(f'User "{username}" failed to log in')
                 flash("Incorrect user info")
@@ -166,12 +610,8 @@ class server_core:
             session["user"] = user_id
             session["username"] = username
 
-            if not os.path.exists(ANNOUNCEMENT_PATH):
-                os.mkdir(ANNOUNCEMENT_PATH)
-
-            for announcement in os.listdir(ANNOUNCEMENT_PATH):
-                with open(os.path.join(ANNOUNCEMENT_PATH, announcement), "r") as file:
-                    flash(file.read())
+            for message in self.__announcements.messages():
+                flash(message)
 
             return redirect("/dashboard")
 
@@ -185,12 +625,17 @@ class server_core:
             if password != password_confirm:
                 flash("Password and password confirm does not match")
                 return redirect("/signup")
+            if len(username or "") > USERNAME_MAX_LENGTH:
+                flash(f"Username must be at most {USERNAME_MAX_LENGTH} characters")
+                return redirect("/signup")
 
             try:
-                user_id = self.__db.create_user(username, password)
+                # The user and its provisioning job are saved together, so a
+                # crash in between cannot leave a user nobody provisions
+                [(_, _, job_id)] = self.__db.create_users([(username, password)])
                 self.__logger.debug(f"User {username} created")
-                self.__manager.create_cde(user_id, username)
-                flash(f"Signup complete")
+                self.__provisioning.submit(job_id)
+                flash(f"Signup complete. Your environment is being prepared")
                 return redirect("/")
             except IntegrityError:
                 self.__logger.debug("Username already in use", exc_info=True)
@@ -201,6 +646,47 @@ class server_core:
                 flash("Failed to sign up")
                 return redirect("/signup")
 
+        @self.__app.route("/admin/users", methods=["POST"])
+        def handle_bulk_signup_request():
+            if not self.__is_admin():
+                return jsonify(None), 401
+
+            file = request.files.get("users")
+            data = file.read() if file is not None else request.get_data()
+            try:
+                users, rejected = parse_users(data.decode("utf-8-sig"))
+            except (UnicodeDecodeError, ValueError) as e:
+                return jsonify({"error": str(e)}), 400
+
+            try:
+                submission = self.__bulk.submit(users)
+            except Exception:
+                self.__logger.error("Failed to create users in bulk", exc_info=True)
+                return jsonify({"error": "Failed to create users"}), 500
+
+            submission["rejected"] = rejected + submission["rejected"]
+            self.__logger.info(
+                f"{len(submission['accepted'])} users created in bulk, {len(submission['rejected'])} rejected"
+            )
+            return jsonify(submission), 202
+
+        @self.__app.route("/admin/provisioning", methods=["GET"])
+        def bulk_provisioning_status():
+            if not self.__is_admin():
+                return jsonify(None), 401
+
+            batch = request.args.get("batch")
+            if not batch:
+                return jsonify({"error": "batch is required"}), 400
+            return jsonify(self.__bulk.progress(batch))
+
+        @self.__app.route("/admin/hosts", methods=["GET"])
+        def host_health():
+            if not self.__is_admin():
+                return jsonify(None), 401
+
+            return jsonify(self.__manager.host_health())
+
         @self.__app.route("/upload", methods=["POST"])
         def handle_upload_request():
             if not self.__is_authenticated():
@@ -208,25 +694,34 @@ class server_core:
                 return redirect("/login")
 
             data = request.form.to_dict()
-            container_type = data.get("type", "dev")
+            container_type = CONTAINER_TYPES.get(data.get("type", "dev"))
             self.__logger.debug(container_type)
+            # Werkzeug has already spooled the files (to disk when large) while
+            # parsing the form, so they are streamed from the spool onward
             files = request.files.getlist("files")
 
-            tar_bytes = io.BytesIO()
-            with tarfile.open(mode="w:gz", fileobj=tar_bytes) as tar:
-                for file in files:
-                    tarinfo = tarfile.TarInfo(name=file.filename)
-                    file.seek(0, io.SEEK_END)
-                    tarinfo.size = file.tell()
-                    file.seek(0)
-                    tar.addfile(tarinfo, file)
-            tar_bytes.seek(0)
+            entries = []
+            for file in files:
+                tarinfo = tarfile.TarInfo(name=file.filename)
+                file.seek(0, io.SEEK_END)
+                tarinfo.size = file.tell()
+                file.seek(0)
+                entries.append((tarinfo, file))
+
+            compression = UPLOAD_COMPRESSION
+            if UPLOAD_SKIP_COMPRESSED and all(
+                is_compressed(file.filename) for file in files
+            ):
+                compression = "none"
+            archive = compress_stream(
+                tar_stream(entries), compression, UPLOAD_COMPRESSION_LEVEL
+            )
 
             user = session.get("user")
 
             try:
                 self.__manager.upload_file(
-                    user_id=user, container_type=container_type, file=tar_bytes
+                    user_id=user, container_type=container_type, file=archive
                 )
             except:
                 self.__logger.error("Failed to upload files", exc_info=True)
@@ -246,7 +741,7 @@ class server_core:
             password = data.get("password")
 
             username = session.get("username")
-            user_id = self.__db.auth(username, password)
+            user_id = self.__auth.auth(username, password)
             if user_id is None:
                 flash("Wrong password")
                 return redirect(f"/check_pw?next={request.args.get('next', '')}")
@@ -269,13 +764,13 @@ class server_core:
                 flash("Password and password confirm does not match")
                 return redirect("/user_info")
 
-            user_id = self.__db.auth(username, cur_password)
+            user_id = self.__auth.auth(username, cur_password)
             if user_id is None:
                 flash("Wrong current password")
                 return redirect("/user_info")
 
             try:
-                self.__db.update_pw(username, new_password)
+                self.__auth.update_pw(username, new_password)
             except:
                 self.__logger.error(
                     f"""Failed to update password (user {
@@ -298,17 +793,39 @@ class server_core:
 
             user = session.get("user", None)
             data = request.form.to_dict()
-            container_type = data.get("type", "dev")
+            container_type = CONTAINER_TYPES.get(data.get("type", "dev"))
             self.__logger.debug(container_type)
 
             try:
+                if BACKUP_DOWNLOAD_MODE == "stream":
+                    chunks, download_name, mimetype = self.__manager.stream_backup(
+                        user_id=user,
+                        container_type=container_type,
+                        store=BACKUP_DOWNLOAD_STORE,
+                    )
+                    response = Response(stream_with_context(chunks), mimetype=mimetype)
+                    response.headers.set(
+                        "Content-Disposition", "attachment", filename=download_name
+                    )
+                    return response
+
                 result_file_path = self.__manager.backup_container(
                     user_id=user, container_type=container_type
                 )
+                archive, download_name, mimetype = self.__manager.open_backup(
+                    result_file_path
+                )
                 return send_file(
-                    result_file_path, mimetype="application/x-tar", as_attachment=True
+                    archive,
+                    mimetype=mimetype,
+                    as_attachment=True,
+                    download_name=download_name,
                 )
-            except AssertionError:
+            except HostUnavailableError:
+                self.__logger.warning("Failed to backup container", exc_info=True)
+                flash("The server of your environment is unavailable at the moment")
+                return redirect("/dashboard")
+            except (AssertionError, ContainerNotFoundError):
                 self.__logger.debug(
                     f"User {session.get('username')} tried to backup container while ther is no container for them",
                     exc_info=True,
@@ -324,9 +841,26 @@ class server_core:
                 return redirect("/dashboard")
 
     def runner(self):
+        ssl_context = "adhoc"
+        if SSL_CERT_PATH and SSL_KEY_PATH:
+            ssl_context = (SSL_CERT_PATH, SSL_KEY_PATH)
+
         try:
-            self.__app.run(host="0.0.0.0", port=443, ssl_context="adhoc", debug=True)
+            self.__app.run(
+                host="0.0.0.0", port=443, ssl_context=ssl_context, debug=DEV_DEBUG
+            )
         finally:
-            self.__logger.info("Exiting server")
+            self.shutdown()
+
+    def shutdown(self):
+        self.__logger.info("Exiting server")
+        self.__stopping.set()
+        if self.__scheduler is not None and self.__scheduler.running:
             self.__logger.info("Shutting down backup scheduler")
             self.__scheduler.shutdown()
+        if self.__provisioning is not None:
+            self.__provisioning.stop()
+        self.__announcements.stop()
+        if self.__manager is not None:
+            self.__manager.close()
+        self.__leader.release()
@@ -0,0 +1,52 @@
+import os
+
+import main
+from cde_governor.metrics import mark_process_dead
+from gunicorn.app.base import BaseApplication
+
+SERVE_BIND = os.getenv("SERVE_BIND", "0.0.0.0:443")
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", (os.cpu_count() or 1) * 2 + 1))
+SERVE_THREADS = int(os.getenv("SERVE_THREADS", 8))
+SERVE_KEEPALIVE = int(os.getenv("SERVE_KEEPALIVE", 5))
+SERVE_TIMEOUT = int(os.getenv("SERVE_TIMEOUT", 300))
+
+
+class GovernorApplication(BaseApplication):
+    def __init__(self):
+        if not (main.SSL_CERT_PATH and main.SSL_KEY_PATH):
+            raise ValueError("SSL_CERT_PATH and SSL_KEY_PATH are required")
+        if not main.SECRET_KEY and SERVE_WORKERS > 1:
+            raise ValueError("SECRET_KEY is required to share sessions across workers")
+
+        self.__options = {
+            "bind": SERVE_BIND,
+            "workers": SERVE_WORKERS,
+            "threads": SERVE_THREADS,
+            "worker_class": "gthread",
+            "keepalive": SERVE_KEEPALIVE,
+            # Backups and uploads stream for a long time
+            "timeout": SERVE_TIMEOUT,
+            "certfile": main.SSL_CERT_PATH,
+            "keyfile": main.SSL_KEY_PATH,
+            "worker_exit": self.__worker_exit,
+            "child_exit": self.__child_exit,
+        }
+        self.__cores: main.server_core | None = None
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.__options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Each worker builds its own core after the fork so that pools,
+        # threads and locks are never shared between processes
+        self.__cores = main.server_core()
+        return self.__cores.app
+
+    def __worker_exit(self, server, worker):
+        if self.__cores is not None:
+            self.__cores.shutdown()
+
+    def __child_exit(self, server, worker):
+        mark_process_dead(worker.pid)
@@ -0,0 +1,95 @@
+import socket
+import unittest
+from time import sleep
+
+from benchmarks.fake_docker import FakeDockerDaemon
+from cde_governor.fanout import DockerAPIError, DockerFanout
+
+
+def unused_address() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return "%s:%d" % sock.getsockname()
+
+
+class FanoutTest(unittest.TestCase):
+    def setUp(self):
+        self.daemon = FakeDockerDaemon().start()
+        self.addresses = {"fake": self.daemon.address, "down": unused_address()}
+        self.fanout = DockerFanout(
+            lambda host: f"tcp://{self.addresses[host]}", timeout=0.5
+        )
+        self.fanout.start()
+
+    def tearDown(self):
+        self.fanout.close()
+        self.daemon.stop()
+
+    def create(self, name: str) -> str:
+        return self.fanout.call(
+            "fake",
+            lambda client: client.request(
+                "POST", "/containers/create", {"name": name}, {"Image": "cde"}
+            ),
+        )["Id"]
+
+    def test_chunked_bodies(self):
+        self.daemon.chunk_size = 7
+        for index in range(20):
+            self.create(f"chunked_{index}")
+
+        containers = self.fanout.call("fake", lambda client: client.containers())
+        self.assertEqual(len(containers), 20)
+        self.assertEqual(
+            self.fanout.call("fake", lambda client: client.info())["Name"],
+            self.daemon.name,
+        )
+        self.assertTrue(self.fanout.call("fake", lambda client: client.ping()))
+
+    def test_connection_reuse(self):
+        for _ in range(10):
+            self.fanout.call("fake", lambda client: client.info())
+        self.assertEqual(self.daemon.connections, 1)
+
+    def test_connection_after_timeout(self):
+        self.fanout.call("fake", lambda client: client.info())
+        self.daemon.latency = 1
+        with self.assertRaises(TimeoutError):
+            self.fanout.call("fake", lambda client: client.containers())
+
+        # The late answer must not be read as the answer to the next request
+        self.daemon.latency = 0
+        sleep(1)
+        info = self.fanout.call("fake", lambda client: client.info())
+        self.assertEqual(info["Name"], self.daemon.name)
+        self.assertEqual(self.daemon.connections, 2)
+
+    def test_error_mapping(self):
+        self.assertIsNone(
+            self.fanout.call("fake", lambda client: client.inspect_container("gone"))
+        )
+
+        with self.assertRaises(DockerAPIError) as context:
+            self.fanout.call("fake", lambda client: client.request("GET", "/nothing"))
+        self.assertEqual(context.exception.status, 404)
+        self.assertIn("page not found", str(context.exception))
+
+        container_id = self.create("taken")
+        self.create("other")
+        with self.assertRaises(DockerAPIError) as context:
+            self.fanout.call(
+                "fake",
+                lambda client: client.request(
+                    "POST", f"/containers/{container_id}/rename", {"name": "other"}
+                ),
+            )
+        self.assertEqual(context.exception.status, 409)
+
+    def test_unreachable_host_fails_alone(self):
+        results = self.fanout.map(["fake", "down"], lambda client: client.ping())
+        self.assertIs(results["fake"], True)
+        self.assertIsInstance(results["down"], ConnectionRefusedError)
+
+
+if __name__ == "__main__":
+    unittest.main()
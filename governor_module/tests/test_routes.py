@@ -0,0 +1,114 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from benchmarks.fake_docker import FakeDockerDaemon
+from benchmarks.standins import FakeDatabase
+from cde_governor.leader import LeaderLock
+
+
+class PendingProvisioningTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.TemporaryDirectory()
+        cls.daemon = FakeDockerDaemon().start()
+        os.environ.update(
+            {
+                "LOG_PATH": os.path.join(cls.workdir.name, "logs"),
+                "BACKUP_PATH": os.path.join(cls.workdir.name, "backups"),
+                "ANNOUNCEMENT_PATH": os.path.join(cls.workdir.name, "announcements"),
+                "LEADER_LOCK_PATH": os.path.join(cls.workdir.name, "leader.lock"),
+                "CDE_IMAGE": "test/cde:latest",
+                "CDE_PORT": "8443/tcp",
+                "SERVER_INFO": json.dumps([[cls.daemon.address, 1]]),
+                "STARTUP_MODE": "eager",
+                "ADMIN_TOKEN": "test-token",
+            }
+        )
+        # Another process leads, so provisioning jobs stay pending here
+        cls.leader = LeaderLock(os.environ["LEADER_LOCK_PATH"])
+        cls.leader.try_acquire()
+
+        import main
+
+        cls.cores = main.server_core(db=FakeDatabase(latency=0))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.cores.shutdown()
+        cls.leader.release()
+        cls.daemon.stop()
+        cls.workdir.cleanup()
+
+    def setUp(self):
+        self.client = self.cores.app.test_client()
+        username = self.id().rpartition(".")[2]
+        self.client.post(
+            "/signup",
+            data={
+                "username": username,
+                "password": username,
+                "password_confirm": username,
+            },
+        )
+        self.client.post("/login", data={"username": username, "password": username})
+        self.flashes()
+
+    def flashes(self) -> list[str]:
+        with self.client.session_transaction() as session:
+            return [message for _, message in session.pop("_flashes", [])]
+
+    def test_connect_while_provisioning(self):
+        response = self.client.get("/connect/dev")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.location, "/dashboard")
+        self.assertEqual(self.flashes(), ["Your environment is still being prepared"])
+
+    def test_dashboard_disables_connect_while_provisioning(self):
+        response = self.client.get("/dashboard")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'<a id="connect" class="disabled"', response.data)
+        self.assertNotIn(b'href="/connect/', response.data)
+
+    def test_signup_rejects_long_username(self):
+        username = "u" * 65
+        response = self.client.post(
+            "/signup",
+            data={
+                "username": username,
+                "password": "password",
+                "password_confirm": "password",
+            },
+        )
+        self.assertEqual(response.location, "/signup")
+        self.assertEqual(self.flashes(), ["Username must be at most 64 characters"])
+
+    def test_bulk_progress_covers_only_its_submission(self):
+        headers = {"Authorization": "Bearer test-token"}
+        submissions = []
+        for csv in (
+            "username,password\nbulk_a,a\nbulk_b,b\n",
+            "username,password\nbulk_c,c\n",
+        ):
+            response = self.client.post(
+                "/admin/users",
+                data={"users": (io.BytesIO(csv.encode()), "users.csv")},
+                headers=headers,
+            )
+            self.assertEqual(response.status_code, 202)
+            submissions.append(response.get_json())
+
+        response = self.client.get(
+            "/admin/provisioning",
+            query_string={"batch": submissions[0]["batch"]},
+            headers=headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["total"], 2)
+        self.assertEqual(response.get_json()["pending"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
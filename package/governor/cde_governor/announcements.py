@@ -0,0 +1,131 @@
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import TypedDict
+
+import natsort
+
+logger = logging.getLogger(__name__)
+
+HEADER_DELIMITER = "---"
+
+
+class Announcement(TypedDict):
+    name: str
+    message: str
+    order: int
+    starts_at: datetime | None
+    expires_at: datetime | None
+
+
+def _parse(name: str, text: str) -> Announcement:
+    # An optional header sets the metadata:
+    # ---
+    # order: 10
+    # starts: 2024-03-01 09:00
+    # expires: 2024-03-08
+    # ---
+    metadata = dict()
+    lines = text.splitlines(keepends=True)
+    if lines and lines[0].strip() == HEADER_DELIMITER:
+        for index, line in enumerate(lines[1:], start=1):
+            if line.strip() == HEADER_DELIMITER:
+                text = "".join(lines[index + 1 :])
+                break
+            key, _, value = line.partition(":")
+            metadata[key.strip().lower()] = value.strip()
+        else:
+            metadata = dict()
+
+    def timestamp(key: str) -> datetime | None:
+        value = metadata.get(key)
+        return datetime.fromisoformat(value) if value else None
+
+    return Announcement(
+        name=name,
+        message=text.strip(),
+        order=int(metadata.get("order", 0)),
+        starts_at=timestamp("starts"),
+        expires_at=timestamp("expires"),
+    )
+
+
+class AnnouncementStore:
+    def __init__(self, path: str, interval: float = 10):
+        self.__path = path
+        self.__interval = interval
+
+        # Replaced as a whole so readers never need the lock
+        self.__announcements: list[Announcement] = []
+        self.__signature: dict[str, tuple[int, int]] | None = None
+        self.__lock = threading.Lock()
+
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(
+            target=self.__run, name="announcements", daemon=True
+        )
+
+    def start(self) -> None:
+        self.reload()
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__stop.set()
+
+    def messages(self, now: datetime | None = None) -> list[str]:
+        now = now or datetime.now()
+        return [
+            announcement["message"]
+            for announcement in self.__announcements
+            if (announcement["starts_at"] is None or announcement["starts_at"] <= now)
+            and (announcement["expires_at"] is None or now < announcement["expires_at"])
+        ]
+
+    def announcements(self) -> list[Announcement]:
+        return list(self.__announcements)
+
+    def __scan(self) -> dict[str, tuple[int, int]]:
+        if not os.path.exists(self.__path):
+            os.makedirs(self.__path, exist_ok=True)
+
+        signature = dict()
+        with os.scandir(self.__path) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.name.startswith("."):
+                    continue
+                stat = entry.stat()
+                signature[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        return signature
+
+    def reload(self) -> bool:
+        with self.__lock:
+            signature = self.__scan()
+            if signature == self.__signature:
+                return False
+
+            announcements = []
+            for name in signature:
+                try:
+                    with open(
+                        os.path.join(self.__path, name), "r", encoding="utf-8"
+                    ) as file:
+                        announcements.append(_parse(name, file.read()))
+                except Exception:
+                    logger.warning(f"Failed to load announcement {name}", exc_info=True)
+
+            announcements = natsort.natsorted(
+                announcements,
+                key=lambda announcement: (announcement["order"], announcement["name"]),
+            )
+            self.__announcements = announcements
+            self.__signature = signature
+            logger.info(f"Loaded {len(announcements)} announcements")
+            return True
+
+    def __run(self) -> None:
+        while not self.__stop.wait(self.__interval):
+            try:
+                self.reload()
+            except Exception:
+                logger.error("Failed to reload announcements", exc_info=True)
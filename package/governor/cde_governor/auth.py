@@ -0,0 +1,66 @@
+from typing import Callable
+
+from cde_governor.cache import TTLCache
+from cde_governor.crpyto import verify_with_salt
+from cde_governor.db import Database
+
+
+class Authenticator:
+    def __init__(
+        self,
+        db: Database,
+        ttl: float = 30,
+        max_size: int = 10000,
+        verify: Callable[[str, str], bool] = verify_with_salt,
+    ):
+        self.__db = db
+        self.__verify = verify
+        # username -> (user id, salted hash), a ttl of 0 turns caching off.
+        # A password changed through another worker is only seen here once the
+        # entry expires, so the ttl bounds how long an old password still works
+        self.__credentials: TTLCache[str, tuple[int, str]] | None = (
+            TTLCache(ttl, max_size) if ttl > 0 else None
+        )
+
+    def __load_credentials(self, username: str) -> tuple[int, str] | None:
+        credentials = self.__db.get_credentials(username)
+        if credentials is not None and self.__credentials is not None:
+            self.__credentials.set(username, credentials)
+        return credentials
+
+    def auth(self, username: str, password: str) -> int | None:
+        if username is None or password is None:
+            return None
+
+        cached = None
+        if self.__credentials is not None:
+            cached = self.__credentials.get(username)
+        if cached is not None and self.__verify(cached[1], password):
+            return cached[0]
+
+        # A mismatch may come from a password changed in another worker
+        credentials = self.__load_credentials(username)
+        if credentials is None or credentials == cached:
+            return None
+        user_id, salted_hash = credentials
+        return user_id if self.__verify(salted_hash, password) else None
+
+    def update_pw(self, username: str, new_password: str) -> None:
+        self.invalidate(username)
+        try:
+            self.__db.update_pw(username, new_password)
+        finally:
+            self.invalidate(username)
+
+    def invalidate(self, username: str) -> None:
+        if self.__credentials is not None:
+            self.__credentials.pop(username)
+
+    def stats(self) -> dict[str, int]:
+        if self.__credentials is None:
+            return {"size": 0, "hits": 0, "misses": 0}
+        return {
+            "size": len(self.__credentials),
+            "hits": self.__credentials.hits,
+            "misses": self.__credentials.misses,
+        }
@@ -0,0 +1,122 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import monotonic, sleep
+from typing import Callable, TypedDict
+
+
+class BackupResult(TypedDict):
+    host: str
+    container_id: str
+    path: str | None
+    bytes: int
+    duration: float
+    attempts: int
+    error: str | None
+
+
+class BackupReport(TypedDict):
+    duration: float
+    total_bytes: int
+    succeeded: int
+    failed: int
+    results: list[BackupResult]
+
+
+class BackupEngine:
+    def __init__(
+        self,
+        backup: Callable[[str, str], tuple[str, int]],
+        per_host_concurrency: int = 2,
+        global_concurrency: int = 8,
+        retries: int = 2,
+        retry_delay: float = 5,
+    ):
+        self.__backup = backup
+        self.__per_host_concurrency = per_host_concurrency
+        self.__global_slots = threading.BoundedSemaphore(global_concurrency)
+        self.__retries = retries
+        self.__retry_delay = retry_delay
+
+    def __run_one(self, host: str, container_id: str) -> BackupResult:
+        result = BackupResult(
+            host=host,
+            container_id=container_id,
+            path=None,
+            bytes=0,
+            duration=0.0,
+            attempts=0,
+            error=None,
+        )
+
+        started_at = monotonic()
+        while result["attempts"] <= self.__retries:
+            result["attempts"] += 1
+            try:
+                with self.__global_slots:
+                    result["path"], result["bytes"] = self.__backup(
+                        host, container_id
+                    )
+                result["error"] = None
+                break
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+                if result["attempts"] <= self.__retries:
+                    sleep(self.__retry_delay)
+        result["duration"] = monotonic() - started_at
+
+        return result
+
+    def run(
+        self,
+        targets: list[tuple[str, str]],
+        unavailable: dict[tuple[str, str], str] | None = None,
+    ) -> BackupReport:
+        started_at = monotonic()
+
+        # Targets known to be unreachable fail right away instead of retrying
+        unavailable = unavailable or dict()
+        skipped = [
+            BackupResult(
+                host=host,
+                container_id=container_id,
+                path=None,
+                bytes=0,
+                duration=0.0,
+                attempts=0,
+                error=unavailable[(host, container_id)],
+            )
+            for host, container_id in targets
+            if (host, container_id) in unavailable
+        ]
+
+        containers_by_host: dict[str, list[str]] = dict()
+        for host, container_id in targets:
+            if (host, container_id) not in unavailable:
+                containers_by_host.setdefault(host, []).append(container_id)
+
+        executors = {
+            host: ThreadPoolExecutor(
+                max_workers=self.__per_host_concurrency,
+                thread_name_prefix=f"backup-{host}",
+            )
+            for host in containers_by_host
+        }
+        try:
+            futures = [
+                executors[host].submit(self.__run_one, host, container_id)
+                for host, container_ids in containers_by_host.items()
+                for container_id in container_ids
+            ]
+            results = skipped + [future.result() for future in as_completed(futures)]
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=True)
+
+        failed = sum(1 for result in results if result["error"] is not None)
+        return BackupReport(
+            duration=monotonic() - started_at,
+            total_bytes=sum(result["bytes"] for result in results),
+            succeeded=len(results) - failed,
+            failed=failed,
+            results=results,
+        )
@@ -0,0 +1,163 @@
+import csv
+import io
+import uuid
+from typing import Callable, TypedDict
+
+from cde_governor.db import Database
+from pymysql import IntegrityError
+
+USERNAME_MAX_LENGTH = 64
+
+
+class BulkUser(TypedDict):
+    line: int
+    username: str
+    password: str
+
+
+class BulkRejection(TypedDict):
+    line: int
+    username: str
+    error: str
+
+
+class BulkAccepted(TypedDict):
+    username: str
+    user_id: int
+    job_id: int
+
+
+class BulkSubmission(TypedDict):
+    accepted: list[BulkAccepted]
+    rejected: list[BulkRejection]
+    batch: str | None
+
+
+class BulkProgress(TypedDict):
+    total: int
+    pending: int
+    running: int
+    done: int
+    failed: int
+    failures: list[dict[str, str | None]]
+
+
+def parse_users(text: str) -> tuple[list[BulkUser], list[BulkRejection]]:
+    reader = csv.DictReader(io.StringIO(text))
+    if reader.fieldnames is None:
+        raise ValueError("CSV is empty")
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    if not {"username", "password"} <= set(reader.fieldnames):
+        raise ValueError("CSV header needs username and password columns")
+
+    users = []
+    rejected = []
+    seen = set()
+    for row in reader:
+        username = (row.get("username") or "").strip()
+        password = row.get("password") or ""
+        error = None
+        if not username or not password:
+            error = "Missing username or password"
+        elif len(username) > USERNAME_MAX_LENGTH:
+            error = f"Username is longer than {USERNAME_MAX_LENGTH} characters"
+        elif username in seen:
+            error = "Username appears more than once"
+
+        if error is not None:
+            rejected.append(
+                BulkRejection(line=reader.line_num, username=username, error=error)
+            )
+            continue
+        seen.add(username)
+        users.append(
+            BulkUser(line=reader.line_num, username=username, password=password)
+        )
+    return users, rejected
+
+
+class BulkProvisioner:
+    def __init__(
+        self,
+        db: Database,
+        on_submitted: Callable[[], None] | None = None,
+        batch_size: int = 100,
+    ):
+        self.__db = db
+        self.__on_submitted = on_submitted
+        self.__batch_size = batch_size
+
+    def submit(self, users: list[BulkUser]) -> BulkSubmission:
+        accepted: list[BulkAccepted] = []
+        rejected: list[BulkRejection] = []
+        # Tags the jobs of this submission so progress leaves out everyone else's
+        batch_id = uuid.uuid4().hex
+        for start in range(0, len(users), self.__batch_size):
+            batch = users[start : start + self.__batch_size]
+            existing = self.__db.get_existing_usernames(
+                [user["username"] for user in batch]
+            )
+            for user in batch:
+                if user["username"] in existing:
+                    rejected.append(
+                        BulkRejection(
+                            line=user["line"],
+                            username=user["username"],
+                            error="Username already in use",
+                        )
+                    )
+            batch = [user for user in batch if user["username"] not in existing]
+            self.__insert(batch, batch_id, accepted, rejected)
+
+        # Each user has an ordinary provisioning job, so the jobs show up on
+        # their dashboards and are run by whichever process provisions
+        if accepted and self.__on_submitted is not None:
+            self.__on_submitted()
+
+        return BulkSubmission(
+            accepted=accepted,
+            rejected=rejected,
+            batch=batch_id if accepted else None,
+        )
+
+    def __insert(
+        self,
+        batch: list[BulkUser],
+        batch_id: str,
+        accepted: list[BulkAccepted],
+        rejected: list[BulkRejection],
+    ) -> None:
+        try:
+            created = self.__db.create_users(
+                [(user["username"], user["password"]) for user in batch], batch_id
+            )
+        except IntegrityError:
+            if len(batch) == 1:
+                rejected.append(
+                    BulkRejection(
+                        line=batch[0]["line"],
+                        username=batch[0]["username"],
+                        error="Username already in use",
+                    )
+                )
+                return
+            # Someone signed up with one of the names meanwhile, find out who
+            for user in batch:
+                self.__insert([user], batch_id, accepted, rejected)
+            return
+
+        for username, user_id, job_id in created:
+            accepted.append(
+                BulkAccepted(username=username, user_id=user_id, job_id=job_id)
+            )
+
+    def progress(self, batch_id: str) -> BulkProgress:
+        progress = BulkProgress(
+            total=0, pending=0, running=0, done=0, failed=0, failures=[]
+        )
+        for _, username, status, _, error in self.__db.get_provisioning_jobs(batch_id):
+            progress["total"] += 1
+            progress[status] += 1
+            if status == "failed":
+                progress["failures"].append({"username": username, "error": error})
+        return progress
@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    def __init__(self, ttl: float, max_size: int = 1024):
+        self.__ttl = ttl
+        self.__max_size = max_size
+        self.__lock = threading.Lock()
+        # key -> (value, expires_at), least recently used first
+        self.__entries: OrderedDict[K, tuple[V, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: K) -> V | None:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at <= monotonic():
+                del self.__entries[key]
+                self.misses += 1
+                return None
+
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: K, value: V) -> None:
+        with self.__lock:
+            self.__entries[key] = (value, monotonic() + self.__ttl)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+
+    def pop(self, key: K) -> V | None:
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            return None if entry is None else entry[0]
+
+    def pop_where(self, predicate: Callable[[K, V], bool]) -> int:
+        with self.__lock:
+            keys = [
+                key
+                for key, (value, _) in self.__entries.items()
+                if predicate(key, value)
+            ]
+            for key in keys:
+                del self.__entries[key]
+            return len(keys)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+
+class EndpointCache:
+    def __init__(self, ttl: float = 300, max_size: int = 4096):
+        self.__lock = threading.Lock()
+        # (user_id, container_type) -> (container_id, url)
+        self.__endpoints: TTLCache[tuple[int, int], tuple[str, str]] = TTLCache(
+            ttl, max_size
+        )
+        self.__keys: dict[str, tuple[int, int]] = dict()
+
+    def get(self, user_id: int, container_type: int) -> tuple[str, str] | None:
+        return self.__endpoints.get((user_id, container_type))
+
+    def set(self, user_id: int, container_type: int, container_id: str, url: str):
+        with self.__lock:
+            self.__endpoints.set((user_id, container_type), (container_id, url))
+            self.__keys[container_id] = (user_id, container_type)
+
+    def invalidate(self, user_id: int, container_type: int) -> None:
+        with self.__lock:
+            entry = self.__endpoints.pop((user_id, container_type))
+            if entry is not None:
+                self.__keys.pop(entry[0], None)
+
+    def invalidate_container(self, container_id: str) -> None:
+        with self.__lock:
+            key = self.__keys.pop(container_id, None)
+            if key is None:
+                return
+            entry = self.__endpoints.pop(key)
+            if entry is not None and entry[0] != container_id:
+                self.__endpoints.set(key, entry)
@@ -0,0 +1,305 @@
+import io
+import json
+import os
+import queue
+import tarfile
+import tempfile
+import threading
+from datetime import datetime
+from hashlib import sha256
+from typing import IO, Iterable, Iterator, TypedDict
+
+from cde_governor.streams import read_stream
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+class ManifestEntry(TypedDict):
+    name: str
+    type: str
+    mode: int
+    uid: int
+    gid: int
+    uname: str
+    gname: str
+    mtime: float
+    linkname: str
+    size: int
+    chunks: list[str]
+
+
+class Manifest(TypedDict):
+    created_at: str
+    source: str
+    size: int
+    entries: list[ManifestEntry]
+
+
+class BackupStats(TypedDict):
+    manifest_path: str
+    logical_bytes: int
+    stored_bytes: int
+    new_chunks: int
+    reused_chunks: int
+
+
+class ChunkReader:
+    def __init__(self, store: "ChunkStore", chunks: list[str]):
+        self.__store = store
+        self.__chunks = iter(chunks)
+        self.__current = io.BytesIO()
+
+    def read(self, size: int = -1) -> bytes:
+        parts = []
+        while size != 0:
+            data = self.__current.read(size)
+            if data:
+                parts.append(data)
+                if size > 0:
+                    size -= len(data)
+                continue
+
+            digest = next(self.__chunks, None)
+            if digest is None:
+                break
+            self.__current = io.BytesIO(self.__store.read_chunk(digest))
+
+        return b"".join(parts)
+
+
+class BackupAborted(Exception):
+    pass
+
+
+class ChunkStoreWriter:
+    def __init__(
+        self,
+        store: "ChunkStore",
+        manifest_path: str,
+        source: str,
+        max_pending: int = 16,
+    ):
+        self.__store = store
+        self.__manifest_path = manifest_path
+        self.__source = source
+        self.__queue: queue.Queue[bytes | BaseException | None] = queue.Queue(
+            max_pending
+        )
+        self.__stats: BackupStats | None = None
+        self.__error: BaseException | None = None
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def __chunks(self) -> Iterator[bytes]:
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    def __run(self) -> None:
+        try:
+            self.__stats = self.__store.backup(
+                read_stream(self.__chunks()), self.__manifest_path, self.__source
+            )
+        except BaseException as e:
+            self.__error = e
+
+    def __put(self, item: bytes | BaseException | None) -> None:
+        # The reader may stop early (e.g. at the tar end-of-archive marker), in
+        # which case anything still being written is simply dropped
+        while self.__thread.is_alive():
+            try:
+                self.__queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data: bytes) -> int:
+        if self.__error is not None:
+            raise self.__error
+        self.__put(data)
+        return len(data)
+
+    def close(self) -> BackupStats:
+        self.__put(None)
+        self.__thread.join()
+        if self.__error is not None:
+            raise self.__error
+        return self.__stats
+
+    def abort(self) -> None:
+        self.__put(BackupAborted())
+        self.__thread.join()
+
+
+class ChunkStore:
+    def __init__(self, root: str, chunk_size: int = 4 * 1024 * 1024):
+        self.__root = root
+        self.__chunk_size = chunk_size
+        os.makedirs(self.__root, exist_ok=True)
+
+    def __chunk_path(self, digest: str) -> str:
+        return os.path.join(self.__root, digest[:2], digest[2:])
+
+    def has_chunk(self, digest: str) -> bool:
+        return os.path.exists(self.__chunk_path(digest))
+
+    def read_chunk(self, digest: str) -> bytes:
+        with open(self.__chunk_path(digest), "rb") as f:
+            return f.read()
+
+    def write_chunk(self, data: bytes) -> tuple[str, bool]:
+        digest = sha256(data).hexdigest()
+        path = self.__chunk_path(digest)
+        if os.path.exists(path):
+            try:
+                # The mtime tells garbage collection the chunk is still in use
+                os.utime(path)
+                return digest, False
+            except FileNotFoundError:
+                pass
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a temporary name so a concurrent reader never sees a
+        # partially written chunk
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest, True
+
+    def chunks(self) -> Iterator[str]:
+        for prefix in os.listdir(self.__root):
+            prefix_path = os.path.join(self.__root, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefix_path):
+                continue
+            for rest in os.listdir(prefix_path):
+                if not rest.endswith(".tmp"):
+                    yield prefix + rest
+
+    def remove_chunk(self, digest: str) -> int:
+        path = self.__chunk_path(digest)
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+
+    def collect_garbage(self, referenced: set[str], older_than: float) -> int:
+        freed = 0
+        for digest in self.chunks():
+            if digest in referenced:
+                continue
+            path = self.__chunk_path(digest)
+            try:
+                if os.path.getmtime(path) >= older_than:
+                    # May belong to a backup whose manifest is not written yet
+                    continue
+                # Move the chunk aside first, so a backup that reuses it in the
+                # meantime either refreshes the mtime or writes it again
+                doomed_path = path + ".gc.tmp"
+                os.replace(path, doomed_path)
+                if os.path.getmtime(doomed_path) >= older_than:
+                    os.replace(doomed_path, path)
+                    continue
+                freed += os.path.getsize(doomed_path)
+                os.remove(doomed_path)
+            except FileNotFoundError:
+                continue
+        return freed
+
+    def backup(
+        self, archive: IO[bytes], manifest_path: str, source: str
+    ) -> BackupStats:
+        stats = BackupStats(
+            manifest_path=manifest_path,
+            logical_bytes=0,
+            stored_bytes=0,
+            new_chunks=0,
+            reused_chunks=0,
+        )
+        manifest = Manifest(
+            created_at=datetime.now().isoformat(),
+            source=source,
+            size=0,
+            entries=[],
+        )
+
+        with tarfile.open(fileobj=archive, mode="r|") as tar:
+            for member in tar:
+                entry = ManifestEntry(
+                    name=member.name,
+                    type=member.type.decode("ascii"),
+                    mode=member.mode,
+                    uid=member.uid,
+                    gid=member.gid,
+                    uname=member.uname,
+                    gname=member.gname,
+                    mtime=member.mtime,
+                    linkname=member.linkname,
+                    size=member.size if member.isreg() else 0,
+                    chunks=[],
+                )
+
+                if member.isreg():
+                    file = tar.extractfile(member)
+                    while data := file.read(self.__chunk_size):
+                        digest, created = self.write_chunk(data)
+                        entry["chunks"].append(digest)
+                        stats["logical_bytes"] += len(data)
+                        if created:
+                            stats["new_chunks"] += 1
+                            stats["stored_bytes"] += len(data)
+                        else:
+                            stats["reused_chunks"] += 1
+
+                manifest["entries"].append(entry)
+
+        manifest["size"] = stats["logical_bytes"]
+
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, separators=(",", ":"))
+        os.replace(tmp_path, manifest_path)
+
+        return stats
+
+    def open_writer(self, manifest_path: str, source: str) -> ChunkStoreWriter:
+        return ChunkStoreWriter(self, manifest_path, source)
+
+    def load_manifest(self, manifest_path: str) -> Manifest:
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+
+    def referenced_chunks(self, manifest_paths: Iterable[str]) -> set[str]:
+        referenced = set()
+        for manifest_path in manifest_paths:
+            for entry in self.load_manifest(manifest_path)["entries"]:
+                referenced.update(entry["chunks"])
+        return referenced
+
+    def restore(self, manifest_path: str, fileobj: IO[bytes]) -> None:
+        manifest = self.load_manifest(manifest_path)
+        with tarfile.open(fileobj=fileobj, mode="w|") as tar:
+            for entry in manifest["entries"]:
+                tarinfo = tarfile.TarInfo(name=entry["name"])
+                tarinfo.type = entry["type"].encode("ascii")
+                tarinfo.mode = entry["mode"]
+                tarinfo.uid = entry["uid"]
+                tarinfo.gid = entry["gid"]
+                tarinfo.uname = entry["uname"]
+                tarinfo.gname = entry["gname"]
+                tarinfo.mtime = entry["mtime"]
+                tarinfo.linkname = entry["linkname"]
+                tarinfo.size = entry["size"]
+
+                if tarinfo.isreg():
+                    tar.addfile(tarinfo, ChunkReader(self, entry["chunks"]))
+                else:
+                    tar.addfile(tarinfo)
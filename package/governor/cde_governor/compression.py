@@ -0,0 +1,124 @@
+import zlib
+from typing import IO, Iterable, Iterator, Literal, get_args
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+Compression = Literal["none", "gzip", "zstd"]
+
+ARCHIVE_FORMATS: dict[str, tuple[str, str]] = {
+    "none": (".tar", "application/x-tar"),
+    "gzip": (".tar.gz", "application/gzip"),
+    "zstd": (".tar.zst", "application/zstd"),
+}
+
+COMPRESSED_EXTENSIONS = (
+    ".gz",
+    ".tgz",
+    ".bz2",
+    ".xz",
+    ".zst",
+    ".zip",
+    ".7z",
+    ".rar",
+    ".jpg",
+    ".jpeg",
+    ".png",
+    ".gif",
+    ".webp",
+    ".mp3",
+    ".mp4",
+    ".mkv",
+    ".pdf",
+    ".whl",
+    ".npz",
+)
+
+
+def check_compression(compression: str) -> Compression:
+    if compression not in get_args(Compression):
+        raise ValueError(
+            f"Unknown compression: {compression}, "
+            f"expected one of {', '.join(get_args(Compression))}"
+        )
+    if compression == "zstd" and zstandard is None:
+        raise RuntimeError("zstd compression requires the zstandard package")
+    return compression
+
+
+def is_compressed(filename: str) -> bool:
+    return filename.lower().endswith(COMPRESSED_EXTENSIONS)
+
+
+def archive_suffix(compression: Compression) -> str:
+    return ARCHIVE_FORMATS[compression][0]
+
+
+def archive_mimetype(path: str) -> str:
+    for suffix, mimetype in ARCHIVE_FORMATS.values():
+        if path.endswith(suffix):
+            return mimetype
+    return "application/octet-stream"
+
+
+def is_archive(path: str) -> bool:
+    return any(path.endswith(suffix) for suffix, _ in ARCHIVE_FORMATS.values())
+
+
+def _compressor(compression: Compression, level: int | None):
+    if compression == "gzip":
+        # wbits=16+MAX_WBITS makes zlib emit a gzip header and trailer
+        return zlib.compressobj(
+            6 if level is None else level, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+        )
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd compression requires the zstandard package")
+        return zstandard.ZstdCompressor(
+            level=3 if level is None else level
+        ).compressobj()
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def compress_stream(
+    chunks: Iterable[bytes],
+    compression: Compression = "none",
+    level: int | None = None,
+) -> Iterator[bytes]:
+    if compression == "none":
+        yield from chunks
+        return
+
+    compressor = _compressor(compression, level)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class CompressedWriter:
+    def __init__(
+        self,
+        fileobj: IO[bytes],
+        compression: Compression = "none",
+        level: int | None = None,
+    ):
+        self.__fileobj = fileobj
+        self.__compressor = (
+            None if compression == "none" else _compressor(compression, level)
+        )
+
+    def write(self, data: bytes) -> int:
+        if self.__compressor is None:
+            self.__fileobj.write(data)
+        else:
+            self.__fileobj.write(self.__compressor.compress(data))
+        return len(data)
+
+    def finish(self) -> None:
+        if self.__compressor is not None:
+            self.__fileobj.write(self.__compressor.flush())
+            self.__compressor = None
@@ -1,20 +1,48 @@
+from contextlib import AbstractContextManager
 from time import sleep
 
 import pymysql
 from cde_governor.crpyto import encrypt_with_salt, verify_with_salt
+from cde_governor.metrics import timed_query
+from cde_governor.migrations import migrate
+from cde_governor.pool import ConnectionPool, PoolStats
+
+BACKUP_COLUMNS = "id, user, container, name, path, mode, size, created_at"
 
 
 class Database:
-    def __init__(self, host: str, user: str, password: str, database: str):
+    def __init__(
+        self,
+        host: str,
+        user: str,
+        password: str,
+        database: str,
+        pool_min_size: int = 1,
+        pool_max_size: int = 10,
+        pool_timeout: float = 10,
+        pool_max_idle_time: float = 300,
+        pool_max_lifetime: float = 3600,
+        pool_ping_interval: float = 30,
+    ):
         self.__host = host
         self.__user = user
         self.__password = password
         self.__database = database
+        self.__pool = ConnectionPool(
+            self.__connect,
+            min_size=pool_min_size,
+            max_size=pool_max_size,
+            timeout=pool_timeout,
+            max_idle_time=pool_max_idle_time,
+            max_lifetime=pool_max_lifetime,
+            ping_interval=pool_ping_interval,
+        )
 
         self.__connection_test()
         self.__setup()
+        self.__pool.fill()
 
-    def __get_connection(self) -> pymysql.Connection:
+    def __connect(self) -> pymysql.Connection:
         return pymysql.connect(
             host=self.__host,
             user=self.__user,
@@ -22,6 +50,15 @@ class Database:
             database=self.__database,
         )
 
+    def __get_connection(self) -> AbstractContextManager[pymysql.Connection]:
+        return self.__pool.connection()
+
+    def pool_stats(self) -> PoolStats:
+        return self.__pool.stats()
+
+    def close(self) -> None:
+        self.__pool.close()
+
     def __connection_test(self, maximum_retries: int = 10, wait_time: int = 3) -> None:
         tries = 0
         while True:
@@ -36,53 +73,9 @@ class Database:
 
     def __setup(self):
         with self.__get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SHOW TABLES LIKE 'users'")
-            users_table_exists = cursor.fetchone()
-            if not users_table_exists:
-                cursor.execute(
-                    """CREATE TABLE users (
-                    id          INT AUTO_INCREMENT,
-                    username    TINYTEXT NOT NULL,
-                    password    TINYTEXT NOT NULL,
-                    PRIMARY KEY(id),
-                    UNIQUE(username))"""
-                )
-                conn.commit()
-
-            cursor.execute("SHOW TABLES LIKE 'servers'")
-            servers_table_exists = cursor.fetchone()
-            if not servers_table_exists:
-                cursor.execute(
-                    """CREATE TABLE servers (
-                        host    INET4,
-                        GPUs    TINYINT UNSIGNED NOT NULL,
-                        PRIMARY KEY(host))"""
-                )
-                conn.commit()
-
-            cursor.execute("SHOW TABLES LIKE 'containers'")
-            containers_table_exists = cursor.fetchone()
-            if not containers_table_exists:
-                cursor.execute(
-                    """CREATE TABLE containers (
-                        id      VARCHAR(64),
-                        server  INET4 NOT NULL,
-                        GPU     TINYINT UNSIGNED NOT NULL,
-                        user    INT NOT NULL NOT NULL,
-                        type    TINYINT UNSIGNED NOT NULL,
-                        PRIMARY KEY(server, id),
-                        UNIQUE(user, type),
-                        FOREIGN KEY(server) REFERENCES servers(host)
-                        ON UPDATE CASCADE
-                        ON DELETE CASCADE,
-                        FOREIGN KEY(user) REFERENCES users(id)
-                        ON UPDATE CASCADE
-                        ON DELETE CASCADE
-                        )"""
-                )
-                conn.commit()
+            migrate(conn)
 
+    @timed_query
     def create_user(self, username: str, password: str) -> int:
         with self.__get_connection() as conn:
             cursor = conn.cursor()
@@ -93,21 +86,77 @@ class Database:
             conn.commit()
             return cursor.lastrowid
 
-    def auth(self, username: str, password: str) -> bool:
+    @timed_query
+    def get_credentials(self, username: str) -> tuple[int, str] | None:
         with self.__get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "SELECT password, id from users WHERE username=%s", (username,)
+                "SELECT id, password from users WHERE username=%s", (username,)
             )
-            data = cursor.fetchone()
-            if data is None:
-                return None
-
-            if verify_with_salt(salted_ciphertext=data[0], plaintext=password):
-                return data[1]
+            return cursor.fetchone()
 
+    def auth(self, username: str, password: str) -> bool:
+        # Verify after the connection went back to the pool
+        data = self.get_credentials(username)
+        if data is None:
             return None
 
+        if verify_with_salt(salted_ciphertext=data[1], plaintext=password):
+            return data[0]
+
+        return None
+
+    @timed_query
+    def get_existing_usernames(self, usernames: list[str]) -> set[str]:
+        if not usernames:
+            return set()
+        with self.__get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT username FROM users WHERE username IN ({', '.join(['%s'] * len(usernames))})",
+                usernames,
+            )
+            return {username for username, in cursor.fetchall()}
+
+    @timed_query
+    def create_users(
+        self, users: list[tuple[str, str]], batch: str | None = None
+    ) -> list[tuple[str, int, int]]:
+        # A batch of users and a provisioning job for each in one transaction,
+        # a duplicate username fails the whole batch
+        if not users:
+            return []
+        usernames = [username for username, _ in users]
+        with self.__get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "INSERT INTO users (username, password) values (%s, %s)",
+                [
+                    (username, encrypt_with_salt(password))
+                    for username, password in users
+                ],
+            )
+            cursor.execute(
+                f"SELECT username, id FROM users WHERE username IN ({', '.join(['%s'] * len(usernames))})",
+                usernames,
+            )
+            user_ids = dict(cursor.fetchall())
+            cursor.executemany(
+                "INSERT INTO provisioning_jobs (user, batch) values (%s, %s)",
+                [(user_ids[username], batch) for username in usernames],
+            )
+            cursor.execute(
+                f"SELECT user, id FROM provisioning_jobs WHERE user IN ({', '.join(['%s'] * len(usernames))})",
+                list(user_ids.values()),
+            )
+            job_ids = dict(cursor.fetchall())
+            conn.commit()
+            return [
+                (username, user_ids[username], job_ids[user_ids[username]])
+                for username in usernames
+            ]
+
+    @timed_query
     def update_pw(self, username: str, new_password: str) -> None:
         with self.__get_connection() as conn:
             cursor = conn.cursor()
@@ -117,49 +166,220 @@ class Database:
             )
             conn.commit()
 
-    def get_server_of_user(self, user_id: int) -> str:
+    @timed_query
+    def get_server_of_user(self, user_id: int) -> str | None:
         with self.__get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "SELECT server FROM containers WHERE user=%d LIMIT=1", (user_id)
+                "SELECT server FROM containers WHERE user=%s LIMIT 1", (user_id,)
+            )
+            row = cursor.fetchone()
+            return None if row is None else row[0]
+
+    @timed_query
+    def sync_servers(self, servers: list[tuple[str, int]]) -> None:
+        with self.__get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "INSERT INTO servers (host, GPUs) VALUES (%s, %s) ON DUPLICATE KEY UPDATE GPUs=VALUES(GPUs)",
+                [(host, gpus) for host, gpus in servers],
+            )
+            cursor.executemany(
+                "INSERT IGNORE INTO slot_allocations (server, GPU) VALUES (%s, %s)",
+                [(host, gpu) for host, gpus in servers for gpu in range(gpus)],
             )
             conn.commit()
 
-    def save_container_info(
-        self, id: int, host: str, gpu: int, user_id: int, container_type: int
-    ) -> None:
+    @timed_query
+    def save_containers(self, containers: list[tuple[str, str, int, int, int]]) -> None:
+        # (id, host, gpu, user id, type) rows, all or none of them are saved
+        allocations: dict[tuple[str, int], int] = dict()
+        for _, host, gpu, _, _ in containers:
+            allocations[(host, gpu)] = allocations.get((host, gpu), 0) + 1
         with self.__get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO containrs (id, server, gpu, user, type) values (%s, %s, %d, %d, %d)",
-                (id, host, gpu, user_id, container_type),
+            cursor.executemany(
+                "INSERT INTO containers (id, server, GPU, user, type) values (%s, %s, %s, %s, %s)",
+                containers,
+            )
+            cursor.executemany(
+                "INSERT INTO slot_allocations (server, GPU, containers) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE containers=containers+VALUES(containers)",
+                [(host, gpu, count) for (host, gpu), count in allocations.items()],
             )
             conn.commit()
 
+    @timed_query
     def get_container(self, user_id: int, container_type: int) -> tuple[str, str]:
         with self.__get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "SELECT server, id from containers WHERE user=%d, type=%d",
+                "SELECT server, id FROM containers WHERE user=%s AND type=%s",
                 (user_id, container_type),
             )
             return cursor.fetchone()
 
+    @timed_query
     def get_containers(self) -> list[tuple[str, str]]:
         with self.__get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT server, id from containers")
             return cursor.fetchall()
 
+    @timed_query
+    def touch_container(self, container_id: str) -> None:
+        with self.__get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE containers SET connected_at=CURRENT_TIMESTAMP WHERE id=%s",
+                (container_id,),
+            )
+            conn.commit()
+
+    @timed_query
+    def get_container_activity(self) -> list[tuple[str, str, int | None]]:
+        # Seconds since the last connect, counted by the DB so clocks never mix
+        with self.__get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT server, id, TIMESTAMPDIFF(SECOND, connected_at, CURRENT_TIMESTAMP) FROM containers"
+            )
+            return cursor.fetchall()
+
+    @timed_query
     def inspect_container_allocation(self) -> dict[tuple[str, int], int]:
         with self.__get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "SELECT server, GPU, COUNT(*) AS container_count FROM containers GROUP BY server, GPU"
+                "SELECT server, GPU, containers FROM slot_allocations WHERE containers > 0"
+            )
+            return {(server, gpu): count for server, gpu, count in cursor.fetchall()}
+
+    @timed_query
+    def update_provisioning_job(
+        self, job_id: int, status: str, progress: int, error: str | None = None
+    ) -> None:
+        with self.__get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE provisioning_jobs SET status=%s, progress=%s, error=%s WHERE id=%s",
+                (status, progress, error, job_id),
+            )
+            conn.commit()
+
+    @timed_query
+    def get_provisioning_job(self, user_id: int) -> tuple[int, str, int, str] | None:
+        with self.__get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT id, status, progress, error FROM provisioning_jobs WHERE user=%s ORDER BY id DESC LIMIT 1",
+                (user_id,),
+            )
+            return cursor.fetchone()
+
+    @timed_query
+    def claim_provisioning_jobs(self, limit: int = 1000) -> list[tuple[int, int, str]]:
+        with self.__get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """SELECT provisioning_jobs.id, users.id, users.username
+                FROM provisioning_jobs JOIN users ON provisioning_jobs.user = users.id
+                WHERE provisioning_jobs.status = 'pending'
+                ORDER BY provisioning_jobs.id
+                LIMIT %s
+                FOR UPDATE""",
+                (limit,),
             )
-            container_counts = cursor.fetchall()
-            allocation_info = dict()
-            for server, gpu, count in container_counts:
-                allocation_info[(server, gpu)] = count
+            jobs = cursor.fetchall()
+            cursor.executemany(
+                "UPDATE provisioning_jobs SET status='running', progress=0 WHERE id=%s",
+                [(job_id,) for job_id, _, _ in jobs],
+            )
+            conn.commit()
+            return jobs
+
+    @timed_query
+    def requeue_provisioning_jobs(self) -> int:
+        with self.__get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE provisioning_jobs SET status='pending', progress=0 WHERE status='running'"
+            )
+            conn.commit()
+            return cursor.rowcount
 
-            return allocation_info
+    @timed_query
+    def get_provisioning_jobs(
+        self, batch: str
+    ) -> list[tuple[int, str, str, int, str | None]]:
+        with self.__get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """SELECT provisioning_jobs.id, users.username, provisioning_jobs.status, provisioning_jobs.progress, provisioning_jobs.error
+                FROM provisioning_jobs JOIN users ON provisioning_jobs.user = users.id
+                WHERE provisioning_jobs.batch = %s
+                ORDER BY provisioning_jobs.id""",
+                (batch,),
+            )
+            return cursor.fetchall()
+
+    @timed_query
+    def add_backup(
+        self, container_id: str, name: str, path: str, mode: str, size: int
+    ) -> int:
+        with self.__get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """INSERT INTO backups (user, container, name, path, mode, size)
+                VALUES ((SELECT user FROM containers WHERE id=%s LIMIT 1), %s, %s, %s, %s, %s)""",
+                (container_id, container_id, name, path, mode, size),
+            )
+            conn.commit()
+            return cursor.lastrowid
+
+    @timed_query
+    def get_backups(self, user_id: int | None = None) -> list[tuple]:
+        with self.__get_connection() as conn:
+            cursor = conn.cursor()
+            if user_id is None:
+                cursor.execute(
+                    f"SELECT {BACKUP_COLUMNS} FROM backups WHERE deleted_at IS NULL ORDER BY created_at DESC, id DESC"
+                )
+            else:
+                cursor.execute(
+                    f"SELECT {BACKUP_COLUMNS} FROM backups WHERE user=%s AND deleted_at IS NULL ORDER BY created_at DESC, id DESC",
+                    (user_id,),
+                )
+            return cursor.fetchall()
+
+    @timed_query
+    def get_deleted_backups(self) -> list[tuple]:
+        with self.__get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT {BACKUP_COLUMNS} FROM backups WHERE deleted_at IS NOT NULL ORDER BY id"
+            )
+            return cursor.fetchall()
+
+    @timed_query
+    def mark_backups_deleted(self, backup_ids: list[int]) -> None:
+        if not backup_ids:
+            return
+        with self.__get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "UPDATE backups SET deleted_at=CURRENT_TIMESTAMP WHERE id=%s AND deleted_at IS NULL",
+                [(backup_id,) for backup_id in backup_ids],
+            )
+            conn.commit()
+
+    @timed_query
+    def purge_backups(self, backup_ids: list[int]) -> None:
+        if not backup_ids:
+            return
+        with self.__get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "DELETE FROM backups WHERE id=%s",
+                [(backup_id,) for backup_id in backup_ids],
+            )
+            conn.commit()
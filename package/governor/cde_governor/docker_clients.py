@@ -0,0 +1,163 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Callable, TypeVar
+
+import docker
+from cde_governor.metrics import (
+    DOCKER_CALL_DURATION,
+    DOCKER_CALL_ERRORS,
+    docker_operation,
+)
+from requests import Response
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from requests.exceptions import Timeout
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class DockerClientRegistry:
+    def __init__(
+        self,
+        port: int = 2375,
+        version: str = "auto",
+        max_pool_size: int = 10,
+        timeout: int = 60,
+        idle_timeout: float = 600,
+        on_unreachable: Callable[[str, Exception], None] | None = None,
+    ):
+        self.__port = port
+        self.__version = version
+        self.__max_pool_size = max_pool_size
+        self.__timeout = timeout
+        self.__idle_timeout = idle_timeout
+        self.__on_unreachable = on_unreachable
+
+        self.__lock = threading.Lock()
+        self.__host_locks: dict[str, threading.Lock] = dict()
+        # host -> (client, last_used_at)
+        self.__clients: dict[str, tuple[docker.DockerClient, float]] = dict()
+
+    def base_url(self, host: str) -> str:
+        if ":" in host:
+            return host
+        return f"{host}:{self.__port}"
+
+    def __host_lock(self, host: str) -> threading.Lock:
+        with self.__lock:
+            return self.__host_locks.setdefault(host, threading.Lock())
+
+    def __create(self, host: str) -> docker.DockerClient:
+        client = docker.DockerClient(
+            base_url=self.base_url(host),
+            version=self.__version,
+            timeout=self.__timeout,
+            max_pool_size=self.__max_pool_size,
+        )
+
+        def observe(response: Response, *args, **kwargs) -> None:
+            request = response.request
+            operation = docker_operation(request.method, request.path_url)
+            DOCKER_CALL_DURATION.labels(host, operation).observe(
+                response.elapsed.total_seconds()
+            )
+
+        # Every API call of the client goes through its requests session
+        client.api.hooks["response"].append(observe)
+        return client
+
+    def get(self, host: str) -> docker.DockerClient:
+        self.evict_idle()
+
+        now = monotonic()
+        with self.__lock:
+            entry = self.__clients.get(host)
+            if entry is not None:
+                self.__clients[host] = (entry[0], now)
+                return entry[0]
+
+        # Creating a client negotiates the API version with the daemon, so do it
+        # once per host without holding up lookups for other hosts
+        with self.__host_lock(host):
+            with self.__lock:
+                entry = self.__clients.get(host)
+                if entry is not None:
+                    return entry[0]
+            client = self.__create(host)
+            with self.__lock:
+                self.__clients[host] = (client, monotonic())
+            return client
+
+    def warm_up(self, hosts: list[str], max_workers: int = 16) -> None:
+        # Version negotiation takes a round trip per host, so a large fleet is
+        # connected in parallel and callers do not wait for it
+        def connect(host: str) -> None:
+            try:
+                self.get(host)
+            except Exception as e:
+                logger.warning(f"Failed to connect to {host}: {e}")
+
+        if not hosts:
+            return
+        executor = ThreadPoolExecutor(
+            max_workers=min(max_workers, len(hosts)),
+            thread_name_prefix="docker-warm-up",
+        )
+        for host in hosts:
+            executor.submit(connect, host)
+        executor.shutdown(wait=False)
+
+    def call(self, host: str, operation: Callable[[docker.DockerClient], T]) -> T:
+        try:
+            try:
+                return operation(self.get(host))
+            except RequestsConnectionError:
+                DOCKER_CALL_ERRORS.labels(host).inc()
+                self.invalidate(host)
+                return operation(self.get(host))
+        except (RequestsConnectionError, Timeout) as e:
+            if self.__on_unreachable is not None:
+                self.__on_unreachable(host, e)
+            raise
+
+    def invalidate(self, host: str) -> None:
+        with self.__lock:
+            entry = self.__clients.pop(host, None)
+        if entry is not None:
+            self.__close(entry[0])
+
+    def evict_idle(self) -> None:
+        if not self.__idle_timeout:
+            return
+
+        now = monotonic()
+        with self.__lock:
+            idle_hosts = [
+                host
+                for host, (_, last_used_at) in self.__clients.items()
+                if now - last_used_at > self.__idle_timeout
+            ]
+            idle_clients = [self.__clients.pop(host)[0] for host in idle_hosts]
+
+        for client in idle_clients:
+            self.__close(client)
+
+    def hosts(self) -> list[str]:
+        with self.__lock:
+            return list(self.__clients)
+
+    def close(self) -> None:
+        with self.__lock:
+            clients = [client for client, _ in self.__clients.values()]
+            self.__clients.clear()
+        for client in clients:
+            self.__close(client)
+
+    def __close(self, client: docker.DockerClient) -> None:
+        try:
+            client.close()
+        except Exception:
+            pass
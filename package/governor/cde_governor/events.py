@@ -0,0 +1,175 @@
+import logging
+import threading
+from typing import Callable, TypedDict
+
+from cde_governor.docker_clients import DockerClientRegistry
+from docker.errors import NotFound
+from docker.models.containers import Container
+
+logger = logging.getLogger(__name__)
+
+
+class ContainerState(TypedDict):
+    host: str
+    id: str
+    name: str
+    status: str
+    ports: dict[str, str]
+    labels: dict[str, str]
+
+
+def _published_ports(attrs: dict) -> dict[str, str]:
+    ports = dict()
+    for container_port, bindings in (attrs["NetworkSettings"]["Ports"] or {}).items():
+        if bindings:
+            ports[container_port] = bindings[0]["HostPort"]
+    return ports
+
+
+def _state(host: str, container: Container) -> ContainerState:
+    return ContainerState(
+        host=host,
+        id=container.id,
+        name=container.name,
+        status=container.status,
+        ports=_published_ports(container.attrs),
+        labels=container.labels,
+    )
+
+
+class ContainerIndex:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__containers: dict[str, ContainerState] = dict()
+
+    def get(self, container_id: str) -> ContainerState | None:
+        with self.__lock:
+            return self.__containers.get(container_id)
+
+    def update(self, host: str, container: Container) -> ContainerState:
+        state = _state(host, container)
+        with self.__lock:
+            self.__containers[container.id] = state
+        return state
+
+    def set_status(self, container_id: str, status: str) -> None:
+        with self.__lock:
+            state = self.__containers.get(container_id)
+            if state is not None:
+                self.__containers[container_id] = ContainerState(state, status=status)
+
+    def remove(self, container_id: str) -> None:
+        with self.__lock:
+            self.__containers.pop(container_id, None)
+
+    def replace_host(self, host: str, containers: list[Container]) -> None:
+        states = {container.id: _state(host, container) for container in containers}
+        with self.__lock:
+            for container_id in [
+                container_id
+                for container_id, state in self.__containers.items()
+                if state["host"] == host
+            ]:
+                del self.__containers[container_id]
+            self.__containers.update(states)
+
+    def containers(self, host: str | None = None) -> list[ContainerState]:
+        with self.__lock:
+            return [
+                state
+                for state in self.__containers.values()
+                if host is None or state["host"] == host
+            ]
+
+
+class EventsListener:
+    # Events after which the container has to be inspected again to learn its
+    # status and published ports
+    REFRESH_ACTIONS = {"create", "start", "restart", "unpause", "rename", "update"}
+    STATUS_ACTIONS = {
+        "die": "exited",
+        "stop": "exited",
+        "pause": "paused",
+    }
+
+    def __init__(
+        self,
+        docker: DockerClientRegistry,
+        hosts: list[str],
+        index: ContainerIndex,
+        on_change: Callable[[str, str], None] | None = None,
+        retry_delay: float = 5,
+    ):
+        self.__docker = docker
+        self.__index = index
+        self.__on_change = on_change
+        self.__retry_delay = retry_delay
+
+        self.__stop = threading.Event()
+        self.__streams: dict[str, object] = dict()
+        self.__threads = [
+            threading.Thread(
+                target=self.__listen, args=(host,), name=f"events-{host}", daemon=True
+            )
+            for host in hosts
+        ]
+
+    def start(self) -> None:
+        for thread in self.__threads:
+            thread.start()
+
+    def stop(self) -> None:
+        self.__stop.set()
+        for stream in list(self.__streams.values()):
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    def __listen(self, host: str) -> None:
+        while not self.__stop.is_set():
+            try:
+                client = self.__docker.get(host)
+                # Subscribe before listing so no event is lost in between
+                stream = client.events(decode=True, filters={"type": "container"})
+                self.__streams[host] = stream
+                if self.__stop.is_set():
+                    # Stopped while subscribing, stop() did not see this stream
+                    stream.close()
+                    return
+                self.__index.replace_host(host, client.containers.list(all=True))
+                for event in stream:
+                    self.__handle(host, event)
+            except Exception:
+                if self.__stop.is_set():
+                    return
+                logger.warning(
+                    f"Lost Docker events stream of {host}, reconnecting", exc_info=True
+                )
+                self.__docker.invalidate(host)
+                self.__stop.wait(self.__retry_delay)
+            finally:
+                self.__streams.pop(host, None)
+
+    def __handle(self, host: str, event: dict) -> None:
+        container_id = event.get("id") or event.get("Actor", {}).get("ID")
+        action = event.get("Action", event.get("status", "")).split(":")[0]
+        if not container_id:
+            return
+
+        if action == "destroy":
+            self.__index.remove(container_id)
+        elif action in self.STATUS_ACTIONS:
+            self.__index.set_status(container_id, self.STATUS_ACTIONS[action])
+        elif action in self.REFRESH_ACTIONS:
+            try:
+                container = self.__docker.get(host).containers.get(container_id)
+            except NotFound:
+                self.__index.remove(container_id)
+            else:
+                self.__index.update(host, container)
+        else:
+            return
+
+        if self.__on_change is not None:
+            self.__on_change(container_id, action)
@@ -0,0 +1,301 @@
+import asyncio
+import json
+import logging
+import threading
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Coroutine, Iterable, TypeVar
+from urllib.parse import quote, urlencode
+
+from cde_governor.metrics import (
+    DOCKER_CALL_DURATION,
+    DOCKER_CALL_ERRORS,
+    docker_operation,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class DockerAPIError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class AsyncDockerClient:
+    def __init__(
+        self,
+        host: str,
+        base_url: str,
+        version: str = "auto",
+        max_idle_connections: int = 4,
+    ):
+        self.__host = host
+        address = base_url.removeprefix("tcp://").removeprefix("http://")
+        self.__address, _, port = address.rpartition(":")
+        self.__port = int(port)
+        self.__version = None if version == "auto" else version
+        self.__version_lock = asyncio.Lock()
+        self.__max_idle_connections = max_idle_connections
+        self.__idle: list[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+
+    async def ping(self) -> bool:
+        return await self.__request("GET", "/_ping") == b"OK"
+
+    async def info(self) -> dict:
+        return await self.request("GET", "/info")
+
+    async def containers(self, all: bool = True) -> list[dict]:
+        return await self.request("GET", "/containers/json", {"all": int(all)})
+
+    async def inspect_container(self, container_id: str) -> dict | None:
+        try:
+            return await self.request("GET", f"/containers/{quote(container_id)}/json")
+        except DockerAPIError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    async def container_stats(self, container_id: str) -> dict:
+        # one-shot skips the second sample the daemon otherwise waits a second
+        # for, so precpu_stats is left empty
+        return await self.request(
+            "GET",
+            f"/containers/{quote(container_id)}/stats",
+            {"stream": 0, "one-shot": 1},
+        )
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        query: dict | None = None,
+        body: Any = None,
+    ) -> Any:
+        version = await self.__api_version()
+        return await self.__request(method, f"/v{version}{path}", query, body)
+
+    async def __api_version(self) -> str:
+        if self.__version is None:
+            async with self.__version_lock:
+                if self.__version is None:
+                    version = await self.__request("GET", "/version")
+                    self.__version = version["ApiVersion"]
+        return self.__version
+
+    async def __request(
+        self,
+        method: str,
+        path: str,
+        query: dict | None = None,
+        body: Any = None,
+    ) -> Any:
+        url = f"{path}?{urlencode(query)}" if query else path
+        payload = b"" if body is None else json.dumps(body).encode("utf-8")
+        request = (
+            f"{method} {url} HTTP/1.1\r\n"
+            f"Host: {self.__address}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            "\r\n"
+        ).encode("latin-1") + payload
+
+        # A kept-alive connection may have been closed by the daemon meanwhile,
+        # which only shows when using it, so such a request is sent once more
+        while True:
+            reader, writer, reused = await self.__connect()
+            started_at = perf_counter()
+            try:
+                writer.write(request)
+                await writer.drain()
+                status, headers = await self.__read_head(reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    continue
+                DOCKER_CALL_ERRORS.labels(self.__host).inc()
+                raise
+            except BaseException:
+                # Also cancelled by timeouts, the response would be left unread
+                writer.close()
+                raise
+            break
+
+        DOCKER_CALL_DURATION.labels(self.__host, docker_operation(method, url)).observe(
+            perf_counter() - started_at
+        )
+        try:
+            data, keep_alive = await self.__read_body(reader, method, status, headers)
+        except BaseException:
+            writer.close()
+            raise
+        if keep_alive and len(self.__idle) < self.__max_idle_connections:
+            self.__idle.append((reader, writer))
+        else:
+            writer.close()
+
+        content = data
+        if data and headers.get("content-type", "").startswith("application/json"):
+            content = json.loads(data)
+        if status >= 400:
+            message = content.get("message", "") if isinstance(content, dict) else ""
+            raise DockerAPIError(status, message or str(data[:200]))
+        return content
+
+    async def __connect(
+        self,
+    ) -> tuple[asyncio.StreamReader, asyncio.StreamWriter, bool]:
+        while self.__idle:
+            reader, writer = self.__idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        try:
+            reader, writer = await asyncio.open_connection(self.__address, self.__port)
+        except OSError:
+            DOCKER_CALL_ERRORS.labels(self.__host).inc()
+            raise
+        return reader, writer, False
+
+    async def __read_head(
+        self, reader: asyncio.StreamReader
+    ) -> tuple[int, dict[str, str]]:
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by the daemon")
+        status = int(status_line.split()[1])
+
+        headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                return status, headers
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+    async def __read_body(
+        self,
+        reader: asyncio.StreamReader,
+        method: str,
+        status: int,
+        headers: dict[str, str],
+    ) -> tuple[bytes, bool]:
+        keep_alive = headers.get("connection", "").lower() != "close"
+        if method == "HEAD" or status in (204, 304):
+            return b"", keep_alive
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    return b"".join(chunks), keep_alive
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+
+        if "content-length" in headers:
+            return await reader.readexactly(int(headers["content-length"])), keep_alive
+        return await reader.read(), False
+
+    async def close(self) -> None:
+        idle, self.__idle = self.__idle, []
+        for _, writer in idle:
+            writer.close()
+
+
+class DockerFanout:
+    def __init__(
+        self,
+        base_url: Callable[[str], str],
+        version: str = "auto",
+        per_host_concurrency: int = 4,
+        timeout: float = 10,
+    ):
+        self.__base_url = base_url
+        self.__version = version
+        self.__per_host_concurrency = per_host_concurrency
+        self.__timeout = timeout
+
+        # Only touched from the loop thread
+        self.__clients: dict[str, AsyncDockerClient] = dict()
+        self.__semaphores: dict[str, asyncio.Semaphore] = dict()
+
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(
+            target=self.__loop.run_forever, name="docker-fanout", daemon=True
+        )
+
+    def start(self) -> None:
+        self.__thread.start()
+
+    def close(self) -> None:
+        if not self.__thread.is_alive():
+            return
+        self.run(self.__close_clients())
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+        self.__loop.close()
+
+    async def __close_clients(self) -> None:
+        for client in self.__clients.values():
+            await client.close()
+        self.__clients.clear()
+
+    def __client(self, host: str) -> AsyncDockerClient:
+        client = self.__clients.get(host)
+        if client is None:
+            client = self.__clients[host] = AsyncDockerClient(
+                host,
+                self.__base_url(host),
+                version=self.__version,
+                max_idle_connections=self.__per_host_concurrency,
+            )
+            self.__semaphores[host] = asyncio.Semaphore(self.__per_host_concurrency)
+        return client
+
+    async def call_async(
+        self, host: str, operation: Callable[[AsyncDockerClient], Awaitable[T]]
+    ) -> T:
+        client = self.__client(host)
+        async with self.__semaphores[host]:
+            try:
+                return await asyncio.wait_for(operation(client), self.__timeout)
+            except TimeoutError:
+                DOCKER_CALL_ERRORS.labels(host).inc()
+                raise TimeoutError(f"{host} did not answer in time") from None
+
+    async def gather_async(
+        self, calls: Iterable[tuple[str, Callable[[AsyncDockerClient], Awaitable[T]]]]
+    ) -> list[T | Exception]:
+        return await asyncio.gather(
+            *(self.call_async(host, operation) for host, operation in calls),
+            return_exceptions=True,
+        )
+
+    def run(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        if threading.current_thread() is self.__thread:
+            coroutine.close()
+            raise RuntimeError("The sync facade must not be used from the loop")
+        return asyncio.run_coroutine_threadsafe(coroutine, self.__loop).result()
+
+    def call(
+        self, host: str, operation: Callable[[AsyncDockerClient], Awaitable[T]]
+    ) -> T:
+        return self.run(self.call_async(host, operation))
+
+    def gather(
+        self, calls: Iterable[tuple[str, Callable[[AsyncDockerClient], Awaitable[T]]]]
+    ) -> list[T | Exception]:
+        # Failures are returned in place of results so one host cannot fail all
+        return self.run(self.gather_async(list(calls)))
+
+    def map(
+        self,
+        hosts: Iterable[str],
+        operation: Callable[[AsyncDockerClient], Awaitable[T]],
+    ) -> dict[str, T | Exception]:
+        hosts = list(dict.fromkeys(hosts))
+        results = self.gather((host, operation) for host in hosts)
+        return dict(zip(hosts, results))
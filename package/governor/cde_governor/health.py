@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import threading
+from collections import deque
+from time import perf_counter, time
+from typing import Literal, TypedDict
+
+from cde_governor.fanout import AsyncDockerClient, DockerFanout
+from cde_governor.metrics import DOCKER_HOST_PROBE_DURATION, DOCKER_HOST_UP
+
+logger = logging.getLogger(__name__)
+
+BreakerState = Literal["closed", "open"]
+
+
+class HostHealth(TypedDict):
+    host: str
+    state: BreakerState
+    latency: float | None
+    availability: float | None
+    consecutive_failures: int
+    last_error: str | None
+    last_checked_at: float | None
+
+
+class HostUnavailableError(Exception):
+    pass
+
+
+class _HostState:
+    def __init__(self, window: int):
+        self.state: BreakerState = "closed"
+        self.consecutive_failures = 0
+        self.latency: float | None = None
+        self.last_error: str | None = None
+        self.last_checked_at: float | None = None
+        self.results: deque[bool] = deque(maxlen=window)
+
+
+class HealthMonitor:
+    def __init__(
+        self,
+        fanout: DockerFanout,
+        hosts: list[str],
+        interval: float = 10,
+        probe_timeout: float = 3,
+        failure_threshold: int = 3,
+        window: int = 60,
+    ):
+        self.__fanout = fanout
+        self.__hosts = hosts
+        self.__interval = interval
+        self.__probe_timeout = probe_timeout
+        self.__failure_threshold = failure_threshold
+
+        self.__lock = threading.Lock()
+        self.__states = {host: _HostState(window) for host in hosts}
+
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(
+            target=self.__run, name="health-monitor", daemon=True
+        )
+
+    def start(self) -> None:
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__stop.set()
+
+    async def __probe_host(self, client: AsyncDockerClient) -> float:
+        started_at = perf_counter()
+        await asyncio.wait_for(client.ping(), self.__probe_timeout)
+        return perf_counter() - started_at
+
+    def probe(self) -> list[str]:
+        results = self.__fanout.map(self.__hosts, self.__probe_host)
+        for host, result in results.items():
+            if isinstance(result, Exception):
+                self.record_failure(host, f"{type(result).__name__}: {result}")
+                continue
+            DOCKER_HOST_PROBE_DURATION.labels(host).observe(result)
+            self.record_success(host, latency=result)
+        return [host for host in self.__hosts if self.is_available(host)]
+
+    def __run(self) -> None:
+        while not self.__stop.wait(self.__interval):
+            try:
+                self.probe()
+            except Exception:
+                logger.error("Failed to probe hosts", exc_info=True)
+
+    def record_success(self, host: str, latency: float | None = None) -> None:
+        with self.__lock:
+            state = self.__states.get(host)
+            if state is None:
+                return
+            if latency is not None:
+                # Only probes measure latency, real calls differ too much in cost
+                state.latency = latency
+                state.results.append(True)
+                state.last_checked_at = time()
+            state.consecutive_failures = 0
+            if state.state == "open":
+                logger.info(f"{host} is reachable again")
+            state.state = "closed"
+        DOCKER_HOST_UP.labels(host).set(1)
+
+    def record_failure(self, host: str, error: str | None = None) -> None:
+        with self.__lock:
+            state = self.__states.get(host)
+            if state is None:
+                return
+            state.consecutive_failures += 1
+            state.last_error = error
+            state.results.append(False)
+            state.last_checked_at = time()
+            # A host that never answered a probe gets no benefit of the doubt
+            tripped = state.state == "closed" and (
+                state.consecutive_failures >= self.__failure_threshold
+                or state.latency is None
+            )
+            if tripped:
+                state.state = "open"
+        if tripped:
+            logger.warning(f"{host} is unavailable: {error}")
+            DOCKER_HOST_UP.labels(host).set(0)
+
+    def is_available(self, host: str) -> bool:
+        # Open breakers are closed again by the next successful probe
+        with self.__lock:
+            state = self.__states.get(host)
+            return state is None or state.state == "closed"
+
+    def check(self, host: str) -> None:
+        if not self.is_available(host):
+            raise HostUnavailableError(f"{host} is unavailable")
+
+    def stats(self) -> list[HostHealth]:
+        with self.__lock:
+            return [
+                HostHealth(
+                    host=host,
+                    state=state.state,
+                    latency=state.latency,
+                    availability=(
+                        sum(state.results) / len(state.results)
+                        if state.results
+                        else None
+                    ),
+                    consecutive_failures=state.consecutive_failures,
+                    last_error=state.last_error,
+                    last_checked_at=state.last_checked_at,
+                )
+                for host, state in self.__states.items()
+            ]
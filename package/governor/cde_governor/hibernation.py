@@ -0,0 +1,209 @@
+import logging
+import threading
+from time import monotonic
+from typing import Callable, TypedDict
+
+from cde_governor.docker_clients import DockerClientRegistry
+from cde_governor.fanout import DockerAPIError, DockerFanout
+
+logger = logging.getLogger(__name__)
+
+
+class ActivitySample(TypedDict):
+    cpu_usage: int
+    network_bytes: int
+    sampled_at: float
+    active_at: float
+
+
+def _activity_counters(stats: dict) -> tuple[int, int]:
+    cpu_usage = stats["cpu_stats"]["cpu_usage"]["total_usage"]
+    network_bytes = sum(
+        interface["rx_bytes"] + interface["tx_bytes"]
+        for interface in (stats.get("networks") or {}).values()
+    )
+    return cpu_usage, network_bytes
+
+
+class IdleReaper:
+    def __init__(
+        self,
+        docker: DockerClientRegistry,
+        fanout: DockerFanout,
+        list_containers: Callable[[], list[tuple[str, str, int | None]]],
+        get_status: Callable[[str], str | None],
+        on_stop: Callable[[str], None] | None = None,
+        idle_timeout: float = 2 * 60 * 60,
+        interval: float = 5 * 60,
+        cpu_threshold: float = 0.02,
+        network_threshold: int = 64 * 1024,
+        stop_timeout: int = 10,
+    ):
+        self.__docker = docker
+        self.__fanout = fanout
+        self.__list_containers = list_containers
+        self.__get_status = get_status
+        self.__on_stop = on_stop
+        self.__idle_timeout = idle_timeout
+        self.__interval = interval
+        self.__cpu_threshold = cpu_threshold
+        self.__network_threshold = network_threshold
+        self.__stop_timeout = stop_timeout
+
+        self.__lock = threading.Lock()
+        self.__samples: dict[str, ActivitySample] = dict()
+        self.__connected_at: dict[str, float] = dict()
+
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(
+            target=self.__run, name="idle-reaper", daemon=True
+        )
+
+    def start(self) -> None:
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__stop.set()
+
+    def touch(self, container_id: str) -> None:
+        with self.__lock:
+            self.__connected_at[container_id] = monotonic()
+
+    def __last_active_at(self, container_id: str, sample: ActivitySample) -> float:
+        return max(sample["active_at"], self.__connected_at.get(container_id, 0))
+
+    def idle_for(self, container_id: str) -> float | None:
+        with self.__lock:
+            sample = self.__samples.get(container_id)
+            if sample is None:
+                return None
+            return monotonic() - self.__last_active_at(container_id, sample)
+
+    def __is_active(
+        self, previous: ActivitySample, cpu_usage: int, network_bytes: int, now: float
+    ) -> bool:
+        elapsed = max(now - previous["sampled_at"], 1)
+        # cpu_usage is cumulative CPU time in nanoseconds
+        cpu_ratio = (cpu_usage - previous["cpu_usage"]) / (elapsed * 1e9)
+        return (
+            cpu_ratio > self.__cpu_threshold
+            or network_bytes - previous["network_bytes"] > self.__network_threshold
+        )
+
+    def __forget(self, container_id: str) -> None:
+        self.__samples.pop(container_id, None)
+        self.__connected_at.pop(container_id, None)
+
+    def __running_containers(self, hosts: list[str]) -> dict[str, dict[str, str]]:
+        running = dict()
+        for host, containers in self.__fanout.map(
+            hosts, lambda client: client.containers(False)
+        ).items():
+            if isinstance(containers, Exception):
+                logger.warning(f"Failed to list containers on {host}: {containers}")
+                continue
+            running[host] = {
+                container["Id"]: container["Names"][0].lstrip("/")
+                for container in containers
+            }
+        return running
+
+    def reap(self) -> list[str]:
+        containers = self.__list_containers()
+        seen = {container_id for _, container_id, _ in containers}
+        candidates = []
+        for host, container_id, connected_ago in containers:
+            if connected_ago is not None:
+                # Connects served by other processes, as recorded in the DB
+                with self.__lock:
+                    self.__connected_at[container_id] = max(
+                        self.__connected_at.get(container_id, 0),
+                        monotonic() - connected_ago,
+                    )
+            status = self.__get_status(container_id)
+            if status is not None and status != "running":
+                with self.__lock:
+                    self.__forget(container_id)
+                continue
+            candidates.append((host, container_id))
+
+        running = self.__running_containers(
+            list(dict.fromkeys(host for host, _ in candidates))
+        )
+        candidates = [
+            (host, container_id)
+            for host, container_id in candidates
+            if container_id in running.get(host, dict())
+        ]
+        # A stats call takes a second or more, so all containers are sampled at
+        # once; activity is measured between passes, so one-shot stats suffice
+        results = self.__fanout.gather(
+            (
+                host,
+                lambda client, container_id=container_id: client.container_stats(
+                    container_id
+                ),
+            )
+            for host, container_id in candidates
+        )
+
+        stopped = []
+        for (host, container_id), stats in zip(candidates, results):
+            if isinstance(stats, DockerAPIError) and stats.status == 404:
+                continue
+            if isinstance(stats, Exception):
+                logger.warning(f"Failed to sample activity of {container_id}: {stats}")
+                continue
+            cpu_usage, network_bytes = _activity_counters(stats)
+
+            now = monotonic()
+            with self.__lock:
+                previous = self.__samples.get(container_id)
+                if previous is None:
+                    # Never reap a container the first time it is seen
+                    self.__samples[container_id] = ActivitySample(
+                        cpu_usage=cpu_usage,
+                        network_bytes=network_bytes,
+                        sampled_at=now,
+                        active_at=now,
+                    )
+                    continue
+
+                if self.__is_active(previous, cpu_usage, network_bytes, now):
+                    previous["active_at"] = now
+                previous["cpu_usage"] = cpu_usage
+                previous["network_bytes"] = network_bytes
+                previous["sampled_at"] = now
+                last_active_at = self.__last_active_at(container_id, previous)
+                idle = now - last_active_at > self.__idle_timeout
+
+            if not idle:
+                continue
+
+            try:
+                self.__docker.get(host).containers.get(container_id).stop(
+                    timeout=self.__stop_timeout
+                )
+            except Exception:
+                logger.warning(f"Failed to stop idle {container_id}", exc_info=True)
+                continue
+
+            logger.info(f"Stopped idle container {running[host][container_id]}")
+            with self.__lock:
+                self.__forget(container_id)
+            if self.__on_stop is not None:
+                self.__on_stop(container_id)
+            stopped.append(container_id)
+
+        with self.__lock:
+            for container_id in set(self.__samples) - seen:
+                self.__forget(container_id)
+
+        return stopped
+
+    def __run(self) -> None:
+        while not self.__stop.wait(self.__interval):
+            try:
+                self.reap()
+            except Exception:
+                logger.error("Failed to reap idle containers", exc_info=True)
@@ -0,0 +1,169 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Callable, TypedDict
+
+from cde_governor.docker_clients import DockerClientRegistry
+from docker.errors import ImageNotFound
+
+logger = logging.getLogger(__name__)
+
+
+class PullResult(TypedDict):
+    host: str
+    digest: str | None
+    duration: float
+    error: str | None
+
+
+def _split_image(image: str) -> tuple[str, str]:
+    repository, _, tag = image.rpartition(":")
+    # A colon before the last slash belongs to a registry port, not a tag
+    if not repository or "/" in tag:
+        return image, "latest"
+    return repository, tag
+
+
+class ImageDistributor:
+    def __init__(
+        self,
+        docker: DockerClientRegistry,
+        hosts: list[str],
+        image: str,
+        max_concurrent_pulls: int = 2,
+        is_available: Callable[[str], bool] | None = None,
+        refresh_interval: float = 60,
+    ):
+        self.__docker = docker
+        self.__hosts = hosts
+        self.__image = image
+        self.__repository, self.__tag = _split_image(image)
+        self.__max_concurrent_pulls = max_concurrent_pulls
+        self.__is_available = is_available
+        self.__refresh_interval = refresh_interval
+
+        self.__lock = threading.Lock()
+        self.__distribute_lock = threading.Lock()
+        self.__target_digest: str | None = None
+        self.__digests: dict[str, set[str]] = dict()
+
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(
+            target=self.__run, name="image-refresh", daemon=True
+        )
+
+    def start(self) -> None:
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__stop.set()
+
+    def __local_digests(self, host: str) -> set[str]:
+        image = self.__docker.get(host).images.get(self.__image)
+        return {
+            repo_digest.rpartition("@")[2]
+            for repo_digest in image.attrs.get("RepoDigests", [])
+        }
+
+    def __local_digests_or_empty(self, host: str) -> set[str]:
+        try:
+            return self.__local_digests(host)
+        except Exception:
+            return set()
+
+    def __available_hosts(self) -> list[str]:
+        if self.__is_available is None:
+            return self.__hosts
+        return [host for host in self.__hosts if self.__is_available(host)]
+
+    def __resolve_target_digest(self) -> str | None:
+        for host in self.__available_hosts():
+            try:
+                client = self.__docker.get(host)
+                return client.images.get_registry_data(self.__image).id
+            except Exception:
+                logger.warning(
+                    f"Failed to resolve digest of {self.__image} via {host}",
+                    exc_info=True,
+                )
+        return None
+
+    def __pull(self, host: str) -> PullResult:
+        started_at = monotonic()
+        result = PullResult(host=host, digest=None, duration=0.0, error=None)
+        if self.__is_available is not None and not self.__is_available(host):
+            # Picked up by the next distribution once the host is back
+            result["error"] = "Host unavailable"
+            return result
+        try:
+            digests = self.__local_digests_or_empty(host)
+            if self.__target_digest is None or self.__target_digest not in digests:
+                self.__docker.get(host).images.pull(self.__repository, tag=self.__tag)
+                digests = self.__local_digests(host)
+
+            with self.__lock:
+                self.__digests[host] = digests
+            result["digest"] = (
+                self.__target_digest
+                if self.__target_digest in digests
+                else next(iter(digests), None)
+            )
+        except Exception as e:
+            logger.warning(f"Failed to pull {self.__image} on {host}", exc_info=True)
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["duration"] = monotonic() - started_at
+        return result
+
+    def distribute(self) -> list[PullResult]:
+        with self.__distribute_lock:
+            target_digest = self.__resolve_target_digest()
+            with self.__lock:
+                if target_digest is not None:
+                    self.__target_digest = target_digest
+
+            with ThreadPoolExecutor(
+                max_workers=self.__max_concurrent_pulls,
+                thread_name_prefix="image-pull",
+            ) as executor:
+                return list(executor.map(self.__pull, self.__hosts))
+
+    def refresh(self) -> None:
+        # Picks up copies pulled by another process or by hand between pulls
+        for host in self.__available_hosts():
+            try:
+                digests = self.__local_digests(host)
+            except ImageNotFound:
+                digests = set()
+            except Exception:
+                logger.debug(
+                    f"Failed to inspect {self.__image} on {host}", exc_info=True
+                )
+                continue
+            with self.__lock:
+                self.__digests[host] = digests
+
+    def __run(self) -> None:
+        while not self.__stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                logger.error("Failed to refresh image digests", exc_info=True)
+            self.__stop.wait(self.__refresh_interval)
+
+    def is_ready(self, host: str) -> bool:
+        # Placement asks while holding its lock, so this never calls Docker
+        with self.__lock:
+            digests = self.__digests.get(host)
+            if not digests:
+                return False
+            # Without a known registry digest any local copy is the best we have
+            return self.__target_digest is None or self.__target_digest in digests
+
+    def digests(self) -> dict[str, set[str]]:
+        with self.__lock:
+            return {host: set(digests) for host, digests in self.__digests.items()}
+
+    @property
+    def target_digest(self) -> str | None:
+        return self.__target_digest
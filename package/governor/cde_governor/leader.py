@@ -0,0 +1,53 @@
+import fcntl
+import os
+import threading
+from time import sleep
+from typing import Callable
+
+
+class LeaderLock:
+    def __init__(self, path: str):
+        self.__path = path
+        self.__fd: int | None = None
+        self.__lock = threading.Lock()
+
+    @property
+    def is_leader(self) -> bool:
+        return self.__fd is not None
+
+    def try_acquire(self) -> bool:
+        with self.__lock:
+            if self.__fd is not None:
+                return True
+
+            fd = os.open(self.__path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                # The lock is held for as long as this process keeps the fd open
+                # and is released by the OS if the process dies
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+
+            os.ftruncate(fd, 0)
+            os.write(fd, str(os.getpid()).encode("utf-8"))
+            self.__fd = fd
+            return True
+
+    def wait_for_leadership(
+        self, on_acquired: Callable[[], None], interval: float = 30
+    ) -> None:
+        def watch() -> None:
+            while not self.try_acquire():
+                sleep(interval)
+            on_acquired()
+
+        threading.Thread(target=watch, name="leader-election", daemon=True).start()
+
+    def release(self) -> None:
+        with self.__lock:
+            if self.__fd is None:
+                return
+            fcntl.flock(self.__fd, fcntl.LOCK_UN)
+            os.close(self.__fd)
+            self.__fd = None
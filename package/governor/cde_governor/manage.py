@@ -1,14 +1,64 @@
 import json
+import logging
 import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import TypedDict
+from time import monotonic, perf_counter
+from typing import IO, Callable, Iterable, Iterator, Literal, NotRequired, TypedDict
 
-import docker
 import natsort
+from cde_governor.backup import BackupEngine, BackupReport
+from cde_governor.cache import EndpointCache
+from cde_governor.chunk_store import MANIFEST_SUFFIX, ChunkStore
+from cde_governor.compression import (
+    Compression,
+    CompressedWriter,
+    archive_mimetype,
+    archive_suffix,
+    compress_stream,
+)
 from cde_governor.db import Database
+from cde_governor.docker_clients import DockerClientRegistry
+from cde_governor.events import ContainerIndex, ContainerState, EventsListener
+from cde_governor.fanout import DockerFanout
+from cde_governor.health import HealthMonitor, HostHealth
+from cde_governor.hibernation import IdleReaper
+from cde_governor.images import ImageDistributor, PullResult
+from cde_governor.metrics import (
+    BACKUP_BYTES,
+    BACKUP_DURATION,
+    BACKUP_FAILURES,
+    UPLOAD_BYTES,
+    UPLOAD_DURATION,
+)
+from cde_governor.placement import (
+    DockerSampler,
+    NoCapacityError,
+    PlacementScheduler,
+    ResourceMonitor,
+    Slot,
+    Strategy,
+)
+from cde_governor.retention import (
+    BackupRecord,
+    RetentionEngine,
+    RetentionPolicy,
+    backup_record,
+    is_enabled,
+)
+from cde_governor.streams import read_stream
+from cde_governor.warm_pool import WarmPool
 from docker.models.containers import Container
 from docker.types import DeviceRequest
 
+logger = logging.getLogger(__name__)
+
+
+class ContainerNotFoundError(Exception):
+    pass
+
 
 class ManagerConfig(TypedDict):
     db: Database
@@ -17,98 +67,580 @@ class ManagerConfig(TypedDict):
     backup_dir: str
     cde_image: str
     cde_port: str
+    docker_port: NotRequired[int]
+    docker_api_version: NotRequired[str]
+    docker_max_pool_size: NotRequired[int]
+    docker_timeout: NotRequired[int]
+    docker_idle_timeout: NotRequired[float]
+    docker_fanout_concurrency: NotRequired[int]
+    docker_fanout_timeout: NotRequired[float]
+    health_check_interval: NotRequired[float]
+    health_probe_timeout: NotRequired[float]
+    health_failure_threshold: NotRequired[int]
+    endpoint_cache_ttl: NotRequired[float]
+    watch_events: NotRequired[bool]
+    placement_strategy: NotRequired[Strategy]
+    placement_slot_capacity: NotRequired[int | None]
+    resource_sample_interval: NotRequired[float]
+    gpu_probe_image: NotRequired[str | None]
+    gpu_probe_interval: NotRequired[float]
+    image_pull_concurrency: NotRequired[int]
+    image_refresh_interval: NotRequired[float]
+    background_tasks: NotRequired[bool]
+    idle_timeout: NotRequired[float]
+    idle_check_interval: NotRequired[float]
+    warm_pool_min_size: NotRequired[int]
+    warm_pool_max_size: NotRequired[int]
+    bulk_per_host_concurrency: NotRequired[int]
+    backup_per_host_concurrency: NotRequired[int]
+    backup_global_concurrency: NotRequired[int]
+    backup_retries: NotRequired[int]
+    backup_mode: NotRequired[Literal["full", "incremental"]]
+    backup_chunk_size: NotRequired[int]
+    backup_compression: NotRequired[Compression]
+    backup_compression_level: NotRequired[int]
+    backup_retention: NotRequired[RetentionPolicy]
+    backup_chunk_grace_period: NotRequired[float]
 
 
 class Manager:
     def __init__(self, config: ManagerConfig):
         self.__db = config["db"]
         self.__servers = config["servers"]
-        for server, _ in self.__servers:
-            self.__get_docker_client(server)
-            pass
+        self.__docker = DockerClientRegistry(
+            port=config.get("docker_port", 2375),
+            version=config.get("docker_api_version", "auto"),
+            max_pool_size=config.get("docker_max_pool_size", 10),
+            timeout=config.get("docker_timeout", 60),
+            idle_timeout=config.get("docker_idle_timeout", 600),
+            on_unreachable=lambda host, e: self.__health.record_failure(
+                host, f"{type(e).__name__}: {e}"
+            ),
+        )
+        # Calls that touch many hosts at once, e.g. inventories, go through this
+        self.__fanout = DockerFanout(
+            self.__docker.base_url,
+            version=config.get("docker_api_version", "auto"),
+            per_host_concurrency=config.get("docker_fanout_concurrency", 4),
+            timeout=config.get("docker_fanout_timeout", 10),
+        )
+        self.__health = HealthMonitor(
+            self.__fanout,
+            [host for host, _ in self.__servers],
+            interval=config.get("health_check_interval", 10),
+            probe_timeout=config.get("health_probe_timeout", 3),
+            failure_threshold=config.get("health_failure_threshold", 3),
+        )
 
         self.container_types = config["container_types"]
+        self.__db.sync_servers(self.__servers)
+        self.__placement = PlacementScheduler(
+            self.__servers,
+            strategy=config.get("placement_strategy", "least_loaded"),
+            allocations=self.__db.inspect_container_allocation(),
+            slot_capacity=config.get("placement_slot_capacity"),
+        )
+        self.__resource_monitor = ResourceMonitor(
+            self.__placement,
+            [host for host, _ in self.__servers],
+            DockerSampler(
+                self.__docker.get,
+                self.__fanout,
+                gpu_probe_image=config.get("gpu_probe_image"),
+                gpu_probe_interval=config.get("gpu_probe_interval", 600),
+            ),
+            interval=config.get("resource_sample_interval", 30),
+            is_available=self.__health.is_available,
+        )
+        self.__endpoints = EndpointCache(ttl=config.get("endpoint_cache_ttl", 300))
+        self.__index = ContainerIndex()
+        self.__events = None
+        if config.get("watch_events", False):
+            self.__events = EventsListener(
+                self.__docker,
+                [host for host, _ in self.__servers],
+                self.__index,
+                on_change=self.__handle_container_event,
+            )
 
         self.__backup_dir = config["backup_dir"]
         if not os.path.exists(self.__backup_dir):
             os.mkdir(self.__backup_dir)
+        self.__backup_mode = config.get("backup_mode", "full")
+        self.__chunk_store = ChunkStore(
+            os.path.join(self.__backup_dir, ".chunks"),
+            chunk_size=config.get("backup_chunk_size", 4 * 1024 * 1024),
+        )
+        self.__backup_compression = config.get("backup_compression", "none")
+        self.__backup_compression_level = config.get("backup_compression_level")
+
+        self.__backup_engine = BackupEngine(
+            self.__backup_by_id,
+            per_host_concurrency=config.get("backup_per_host_concurrency", 2),
+            global_concurrency=config.get("backup_global_concurrency", 8),
+            retries=config.get("backup_retries", 2),
+        )
+
+        self.__bulk_per_host_concurrency = config.get("bulk_per_host_concurrency", 2)
 
         self.__cde_image = config["cde_image"]
         self.__cde_port = config["cde_port"]
+        self.__images = ImageDistributor(
+            self.__docker,
+            [host for host, _ in self.__servers],
+            self.__cde_image,
+            max_concurrent_pulls=config.get("image_pull_concurrency", 2),
+            is_available=self.__health.is_available,
+            refresh_interval=config.get("image_refresh_interval", 60),
+        )
 
-    def __get_docker_client(self, host: str, port: int = 2375) -> docker.DockerClient:
-        if ":" in host:
-            return docker.DockerClient(base_url=host)
-        return docker.DockerClient(base_url=f"{host}:{port}")
+        self.__config = config
+        self.__idle_timeout = config.get("idle_timeout", 0)
+        # container id -> when this process last recorded a connect in the DB
+        self.__recorded_connects: dict[str, float] = dict()
+        self.__idle_reaper = None
+        self.__retention = None
+        self.__warm_pool = None
+        self.__background_lock = threading.Lock()
+        self.__background_started = False
 
-    def __get_mapped_port(self, container: Container) -> str:
-        container.reload()
+        # Threads are only started once everything above succeeded, and are
+        # stopped again if starting fails so a retried startup leaks nothing
+        try:
+            self.__start()
+        except:
+            self.close()
+            raise
+
+    def __start(self) -> None:
+        self.__fanout.start()
+        # Hosts that are down at startup get their client once they are back
+        self.__docker.warm_up(self.__health.probe())
+        self.__health.start()
+        if self.__events is not None:
+            self.__events.start()
+        # Fleet-wide housekeeping must only run in one governor process
+        if self.__config.get("background_tasks", True):
+            self.start_background_tasks()
+
+    def start_background_tasks(self) -> None:
+        # Also called when a process takes over the leadership long after startup
+        with self.__background_lock:
+            if self.__background_started:
+                return
+            self.__background_started = True
+
+        config = self.__config
+        # Other processes may have placed containers since this one started
+        self.__placement.resync(self.__db.inspect_container_allocation())
+        # Only the leader places, so only it needs the hosts' load and images
+        self.__resource_monitor.start()
+        self.__images.start()
+
+        if self.__idle_timeout > 0:
+            self.__idle_reaper = IdleReaper(
+                self.__docker,
+                self.__fanout,
+                self.__db.get_container_activity,
+                self.__get_indexed_status,
+                on_stop=self.invalidate_cde_url,
+                idle_timeout=self.__idle_timeout,
+                interval=config.get("idle_check_interval", 5 * 60),
+            )
+            self.__idle_reaper.start()
+
+        policy = config.get("backup_retention", RetentionPolicy())
+        if is_enabled(policy):
+            self.__retention = RetentionEngine(
+                self.__db,
+                self.__backup_dir,
+                self.__chunk_store,
+                policy,
+                chunk_grace_period=config.get(
+                    "backup_chunk_grace_period", 24 * 60 * 60
+                ),
+            )
+            self.__retention.start()
+
+        if config.get("warm_pool_max_size", 0) > 0:
+            self.__warm_pool = WarmPool(
+                self.__docker,
+                self.__servers,
+                self.container_types,
+                self.__create_container,
+                min_size=config.get("warm_pool_min_size", 0),
+                max_size=config["warm_pool_max_size"],
+                is_host_ready=lambda host: self.__images.is_ready(host)
+                and self.__health.is_available(host),
+            )
+            self.__warm_pool.start()
+
+    def __get_mapped_port(self, container: Container, reload: bool = True) -> str:
+        if reload:
+            container.reload()
         return container.attrs["NetworkSettings"]["Ports"][self.__cde_port][0][
             "HostPort"
         ]
 
-    def __get_idle_resource(self) -> tuple[str, int]:
-        allocations = self.__db.inspect_container_allocation()
-        print(allocations)
-        return min(
-            [(host, gpu) for (host, gpus) in self.__servers for gpu in range(gpus)],
-            key=lambda resource: (
-                allocations[resource] if resource in allocations else 0
-            ),
-        )
+    def create_cde(
+        self,
+        user_id: int,
+        username: str,
+        on_progress: Callable[[int, int], None] | None = None,
+    ) -> list[Container]:
+        slots = self.__place(1)
+        if not slots:
+            raise NoCapacityError("No GPU slot available for placement")
+        return self.__provision(user_id, username, slots[0], on_progress)
+
+    def create_cdes(
+        self,
+        users: list[tuple[int, str]],
+        on_result: Callable[[int, Exception | None], None] | None = None,
+    ) -> dict[int, Exception | None]:
+        slots = self.__place(len(users))
+        results: dict[int, Exception | None] = dict()
+
+        def report(user_id: int, error: Exception | None) -> None:
+            results[user_id] = error
+            if on_result is not None:
+                on_result(user_id, error)
 
-    def create_cde(self, user_id: int, username: str) -> list[Container]:
-        idle_host, idle_gpu = self.__get_idle_resource()
-        client = self.__get_docker_client(idle_host)
-        created_containers = [
-            client.containers.run(
-                self.__cde_image,
-                name=f"{username}_{container_type}",
-                stdin_open=True,
-                tty=True,
-                detach=True,
-                labels={
-                    "host": idle_host,
-                    "gpu": str(idle_gpu),
-                    "type": str(container_type),
-                },
-                ports={self.__cde_port: None},
-                device_requests=[
-                    DeviceRequest(
-                        driver="nvidia",
-                        device_ids=[str(idle_gpu)],
-                        capabilities=[["gpu"]],
+        def provision(user_id: int, username: str, slot: Slot) -> Exception | None:
+            try:
+                self.__provision(user_id, username, slot)
+            except Exception as e:
+                logger.error(f"Failed to provision CDE of {username}", exc_info=True)
+                return e
+            return None
+
+        for user_id, _ in users[len(slots) :]:
+            report(user_id, NoCapacityError("No GPU slot available for placement"))
+
+        # Hosts work through their share of the batch side by side
+        executors: dict[str, ThreadPoolExecutor] = dict()
+        futures = dict()
+        try:
+            for (user_id, username), slot in zip(users, slots):
+                executor = executors.get(slot[0])
+                if executor is None:
+                    executor = executors[slot[0]] = ThreadPoolExecutor(
+                        max_workers=self.__bulk_per_host_concurrency,
+                        thread_name_prefix=f"bulk-{slot[0]}",
                     )
-                ],
+                futures[executor.submit(provision, user_id, username, slot)] = user_id
+            for future in as_completed(futures):
+                report(futures[future], future.result())
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=True)
+
+        return results
+
+    def __place(self, count: int) -> list[Slot]:
+        weight = len(self.container_types)
+        # Hold off hosts that do not have the current image yet, and never place
+        # on hosts that are down
+        slots = self.__placement.place_many(
+            count,
+            weight=weight,
+            exclude=lambda slot: not self.__images.is_ready(slot[0])
+            or not self.__health.is_available(slot[0]),
+        )
+        if len(slots) < count:
+            slots += self.__placement.place_many(
+                count - len(slots),
+                weight=weight,
+                exclude=lambda slot: not self.__health.is_available(slot[0]),
             )
-            for container_type in self.container_types
-        ]
+        return slots
+
+    def __provision(
+        self,
+        user_id: int,
+        username: str,
+        slot: Slot,
+        on_progress: Callable[[int, int], None] | None = None,
+    ) -> list[Container]:
+        weight = len(self.container_types)
+        try:
+            created_containers = self.__run_cde_containers(*slot, username, on_progress)
+        except:
+            self.__placement.release(slot, weight=weight)
+            raise
 
         for container in created_containers:
-            self.__db.save_container_info(
-                id=container.id,
-                host=idle_host,
-                gpu=idle_gpu,
-                user_id=user_id,
-                container_type=container.labels.get("type"),
+            self.__endpoints.invalidate(user_id, int(container.labels.get("type")))
+        try:
+            self.__db.save_containers(
+                [
+                    (container.id, *slot, user_id, int(container.labels.get("type")))
+                    for container in created_containers
+                ]
             )
+        except:
+            # Unrecorded containers would hold their names and slot forever
+            self.__remove_containers(created_containers)
+            self.__placement.release(slot, weight=weight)
+            raise
 
         return created_containers
 
+    def __run_cde_container(
+        self, idle_host: str, idle_gpu: int, username: str, container_type: int
+    ) -> Container:
+        name = f"{username}_{container_type}"
+        if self.__warm_pool is not None:
+            container = self.__warm_pool.claim(
+                idle_host, idle_gpu, container_type, name
+            )
+            if container is not None:
+                return container
+
+        return self.__create_container(idle_host, idle_gpu, name, container_type)
+
+    def __create_container(
+        self, idle_host: str, idle_gpu: int, name: str, container_type: int
+    ) -> Container:
+        return self.__docker.get(idle_host).containers.run(
+            self.__cde_image,
+            name=name,
+            stdin_open=True,
+            tty=True,
+            detach=True,
+            labels={
+                "host": idle_host,
+                "gpu": str(idle_gpu),
+                "type": str(container_type),
+            },
+            ports={self.__cde_port: None},
+            device_requests=[
+                DeviceRequest(
+                    driver="nvidia",
+                    device_ids=[str(idle_gpu)],
+                    capabilities=[["gpu"]],
+                )
+            ],
+        )
+
+    def __run_cde_containers(
+        self,
+        idle_host: str,
+        idle_gpu: int,
+        username: str,
+        on_progress: Callable[[int, int], None] | None = None,
+    ) -> list[Container]:
+        total = len(self.container_types)
+        created_containers = []
+        errors = []
+        with ThreadPoolExecutor(max_workers=total) as executor:
+            futures = [
+                executor.submit(
+                    self.__run_cde_container,
+                    idle_host,
+                    idle_gpu,
+                    username,
+                    container_type,
+                )
+                for container_type in self.container_types
+            ]
+            for future in as_completed(futures):
+                try:
+                    created_containers.append(future.result())
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                if on_progress is not None:
+                    on_progress(len(created_containers), total)
+
+        if errors:
+            # Do not leave half of a user's environment behind
+            self.__remove_containers(created_containers)
+            raise errors[0]
+
+        return sorted(
+            created_containers, key=lambda container: int(container.labels["type"])
+        )
+
+    def __remove_containers(self, containers: list[Container]) -> None:
+        for container in containers:
+            try:
+                container.remove(force=True)
+            except Exception:
+                pass
+
+    def distribute_image(self) -> list[PullResult]:
+        return self.__images.distribute()
+
     def get_cde_url(self, user_id: int, container_type: int) -> str:
         assert container_type in self.container_types
 
-        host, container_id = self.__db.get_container(user_id, container_type)
-        client = docker.DockerClient(f"{host}:2375")
-        container = client.containers.get(container_id)
+        endpoint = self.__endpoints.get(user_id, container_type)
+        if endpoint is not None:
+            container_id, url = endpoint
+            self.__touch(container_id)
+            return url
+
+        host, container_id = self.__find_container(user_id, container_type)
+        self.__touch(container_id)
+
+        state = self.__index.get(container_id)
+        if state is not None and state["status"] == "running":
+            port = state["ports"].get(self.__cde_port)
+            if port is not None:
+                url = self.__cde_url(host, port)
+                self.__endpoints.set(user_id, container_type, container_id, url)
+                return url
+
+        container = self.get_container(host, container_id)
 
         assert container is not None
 
-        if container.status != "running":
+        # Ports are only published once the container is running, so a freshly
+        # started container has to be reloaded to read them
+        started = container.status != "running"
+        if started:
             container.start()
 
-        port = self.__get_mapped_port(container)
-        return f"http://{host}:{port}"
+        port = self.__get_mapped_port(container, reload=started)
+        url = self.__cde_url(host, port)
+        self.__endpoints.set(user_id, container_type, container.id, url)
+        return url
+
+    def __cde_url(self, host: str, port: str) -> str:
+        # Hosts may carry the port of their Docker daemon
+        return f"http://{host.partition(':')[0]}:{port}"
+
+    def __touch(self, container_id: str) -> None:
+        if self.__idle_timeout <= 0:
+            return
+        if self.__idle_reaper is not None:
+            self.__idle_reaper.touch(container_id)
+
+        # The reaper runs in another process than most connects, it learns of
+        # them through the DB. Once a minute per container is plenty for that
+        now = monotonic()
+        recorded_at = self.__recorded_connects.get(container_id)
+        if recorded_at is not None and now - recorded_at < min(
+            60, self.__idle_timeout / 10
+        ):
+            return
+        self.__recorded_connects[container_id] = now
+        try:
+            self.__db.touch_container(container_id)
+        except Exception:
+            logger.warning(f"Failed to record connect to {container_id}", exc_info=True)
+
+    def invalidate_cde_url(self, container_id: str) -> None:
+        self.__endpoints.invalidate_container(container_id)
+
+    def __handle_container_event(self, container_id: str, action: str) -> None:
+        if action != "rename":
+            self.invalidate_cde_url(container_id)
+
+    def __get_indexed_status(self, container_id: str) -> str | None:
+        state = self.__index.get(container_id)
+        return None if state is None else state["status"]
+
+    def get_cde_status(self, user_id: int, container_type: int) -> str | None:
+        container = self.__db.get_container(user_id, container_type)
+        if container is None:
+            return None
+
+        state = self.__index.get(container[1])
+        if state is not None:
+            return state["status"]
+        if self.__events is not None:
+            return None
+        return self.get_container(*container).status
+
+    def get_cde_statuses(self, user_id: int) -> dict[int, str | None]:
+        statuses: dict[int, str | None] = dict()
+        pending: list[tuple[int, str, str]] = []
+        for container_type in self.container_types:
+            container = self.__db.get_container(user_id, container_type)
+            state = None if container is None else self.__index.get(container[1])
+            if state is not None:
+                statuses[container_type] = state["status"]
+            elif (
+                container is None
+                or self.__events is not None
+                or not self.__health.is_available(container[0])
+            ):
+                statuses[container_type] = None
+            else:
+                pending.append((container_type, *container))
+
+        results = self.__fanout.gather(
+            (
+                host,
+                lambda client, container_id=container_id: client.inspect_container(
+                    container_id
+                ),
+            )
+            for _, host, container_id in pending
+        )
+        for (container_type, _, _), result in zip(pending, results):
+            if isinstance(result, Exception):
+                logger.debug(f"Failed to inspect container: {result}")
+                result = None
+            statuses[container_type] = (
+                None if result is None else result["State"]["Status"]
+            )
+        return statuses
+
+    def inventory(self) -> dict[str, list[dict] | None]:
+        inventory = dict()
+        listings = self.__list_containers(host for host, _ in self.__servers)
+        for host, listing in listings.items():
+            if isinstance(listing, Exception):
+                inventory[host] = None
+                continue
+            inventory[host] = [
+                container
+                for container in listing
+                if "type" in (container.get("Labels") or {})
+            ]
+        return inventory
+
+    def __list_containers(
+        self, hosts: Iterable[str]
+    ) -> dict[str, list[dict] | Exception]:
+        listings = self.__fanout.map(hosts, lambda client: client.containers(all=True))
+        for host, listing in listings.items():
+            if isinstance(listing, Exception):
+                logger.warning(f"Failed to list containers of {host}: {listing}")
+        return listings
+
+    def host_health(self) -> list[HostHealth]:
+        return self.__health.stats()
+
+    def container_states(self, host: str | None = None) -> list[ContainerState]:
+        return self.__index.containers(host)
+
+    def close(self) -> None:
+        self.__resource_monitor.stop()
+        self.__images.stop()
+        if self.__retention is not None:
+            self.__retention.stop()
+        if self.__warm_pool is not None:
+            self.__warm_pool.stop()
+        if self.__idle_reaper is not None:
+            self.__idle_reaper.stop()
+        if self.__events is not None:
+            self.__events.stop()
+        self.__health.stop()
+        self.__fanout.close()
+        self.__docker.close()
+
+    def __find_container(self, user_id: int, container_type: int) -> tuple[str, str]:
+        # Users have no containers until their provisioning job is done
+        container = self.__db.get_container(user_id, container_type)
+        if container is None:
+            raise ContainerNotFoundError(
+                f"User {user_id} has no container of type {container_type}"
+            )
+        return container
 
     def get_container(
         self,
@@ -118,44 +650,241 @@ class Manager:
         container_type=-1,
     ) -> Container:
         if not host or not container_id:
-            host, container_id = self.__db.get_container(user_id, container_type)
+            host, container_id = self.__find_container(user_id, container_type)
 
-        client = self.__get_docker_client(host)
-        return client.containers.get(container_id)
+        # Fail fast rather than wait for the client to time out
+        self.__health.check(host)
+        return self.__docker.call(
+            host, lambda client: client.containers.get(container_id)
+        )
 
     def backup_container(
         self,
         container: Container | None = None,
         user_id: int = 0,
         container_type: int = -1,
-    ) -> None:
+    ) -> str:
         if container is None:
             container = self.get_container(
                 user_id=user_id, container_type=container_type
             )
 
+        backup_path, _ = self.__write_backup(container)
+        return backup_path
+
+    def __write_backup(self, container: Container) -> tuple[str, int]:
+        started_at = perf_counter()
+        try:
+            backup_path, transferred, size = self.__store_backup(container)
+        except:
+            BACKUP_FAILURES.labels(self.__backup_mode, "stored").inc()
+            raise
+
+        BACKUP_BYTES.labels(self.__backup_mode, "stored").inc(transferred)
+        BACKUP_DURATION.labels(self.__backup_mode, "stored").observe(
+            perf_counter() - started_at
+        )
+        self.__index_backup(container.id, container.name, backup_path, size)
+        return backup_path, transferred
+
+    def __index_backup(
+        self, container_id: str, container_name: str, backup_path: str, size: int
+    ) -> None:
+        try:
+            self.__db.add_backup(
+                container_id, container_name, backup_path, self.__backup_mode, size
+            )
+        except Exception:
+            # The backup itself is fine, it is just not subject to retention
+            logger.error(f"Failed to index backup {backup_path}", exc_info=True)
+
+    def __store_backup(self, container: Container) -> tuple[str, int, int]:
         stream, _ = container.get_archive("/workspace")
         dir_path = f"{self.__backup_dir}/{container.name}"
-        if not os.path.exists(dir_path):
-            os.mkdir(dir_path)
-        backup_path = dir_path + f'/{datetime.now().strftime("%Y-%m-%d %H:%M:%S")}.tar'
+        os.makedirs(dir_path, exist_ok=True)
+        backup_name = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        with open(backup_path, "wb") as f:
-            for chunk in stream:
-                f.write(chunk)
+        if self.__backup_mode == "incremental":
+            backup_path = f"{dir_path}/{backup_name}{MANIFEST_SUFFIX}"
+            archive = read_stream(stream)
+            stats = self.__chunk_store.backup(
+                archive, backup_path, source=container.name
+            )
+            size = stats["stored_bytes"] + os.path.getsize(backup_path)
+            return backup_path, archive.raw.bytes_read, size
 
-        return backup_path
+        backup_path = (
+            f"{dir_path}/{backup_name}{archive_suffix(self.__backup_compression)}"
+        )
+        archive = read_stream(stream)
+        try:
+            with open(backup_path, "wb") as f:
+                for chunk in compress_stream(
+                    iter(lambda: archive.read1(), b""),
+                    self.__backup_compression,
+                    self.__backup_compression_level,
+                ):
+                    f.write(chunk)
+        except:
+            if os.path.exists(backup_path):
+                os.remove(backup_path)
+            raise
 
-    def backup_containers(self) -> None:
-        containers = self.__db.get_containers()
-        for host, container_id in containers:
-            container = self.get_container(host, container_id)
-            self.backup_container(container=container)
+        return backup_path, archive.raw.bytes_read, os.path.getsize(backup_path)
+
+    def open_backup(self, backup_path: str) -> tuple[IO[bytes], str, str]:
+        if not backup_path.endswith(MANIFEST_SUFFIX):
+            return (
+                open(backup_path, "rb"),
+                os.path.basename(backup_path),
+                archive_mimetype(backup_path),
+            )
+
+        archive = tempfile.TemporaryFile(dir=self.__backup_dir)
+        try:
+            writer = CompressedWriter(
+                archive, self.__backup_compression, self.__backup_compression_level
+            )
+            self.__chunk_store.restore(backup_path, writer)
+            writer.finish()
+        except:
+            archive.close()
+            raise
+        archive.seek(0)
+
+        backup_name = os.path.basename(backup_path).removesuffix(MANIFEST_SUFFIX)
+        download_name = backup_name + archive_suffix(self.__backup_compression)
+        return archive, download_name, archive_mimetype(download_name)
+
+    def stream_backup(
+        self,
+        container: Container | None = None,
+        user_id: int = 0,
+        container_type: int = -1,
+        store: bool = True,
+    ) -> tuple[Iterator[bytes], str, str]:
+        if container is None:
+            container = self.get_container(
+                user_id=user_id, container_type=container_type
+            )
+
+        stream, _ = container.get_archive("/workspace")
+        backup_name = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        download_name = backup_name + archive_suffix(self.__backup_compression)
+
+        return (
+            self.__relay_backup(
+                container.id, container.name, stream, backup_name, store
+            ),
+            download_name,
+            archive_mimetype(download_name),
+        )
+
+    def __relay_backup(
+        self,
+        container_id: str,
+        container_name: str,
+        stream: Iterable[bytes],
+        backup_name: str,
+        store: bool,
+    ) -> Iterator[bytes]:
+        dir_path = f"{self.__backup_dir}/{container_name}"
+        backup_path = f"{dir_path}/{backup_name}"
+        store_writer = None
+        store_file = None
+        if store:
+            os.makedirs(dir_path, exist_ok=True)
+            if self.__backup_mode == "incremental":
+                store_writer = self.__chunk_store.open_writer(
+                    backup_path + MANIFEST_SUFFIX, container_name
+                )
+            else:
+                backup_path += archive_suffix(self.__backup_compression)
+                store_file = open(backup_path + ".partial", "wb")
+
+        started_at = perf_counter()
+        transferred = 0
+
+        def tee(chunks: Iterable[bytes]) -> Iterator[bytes]:
+            nonlocal transferred
+            for chunk in chunks:
+                transferred += len(chunk)
+                if store_writer is not None:
+                    store_writer.write(chunk)
+                yield chunk
+
+        completed = False
+        try:
+            for chunk in compress_stream(
+                tee(stream), self.__backup_compression, self.__backup_compression_level
+            ):
+                if store_file is not None:
+                    store_file.write(chunk)
+                yield chunk
+            completed = True
+        finally:
+            if completed:
+                BACKUP_BYTES.labels(self.__backup_mode, "stream").inc(transferred)
+                BACKUP_DURATION.labels(self.__backup_mode, "stream").observe(
+                    perf_counter() - started_at
+                )
+            else:
+                BACKUP_FAILURES.labels(self.__backup_mode, "stream").inc()
+
+            if store_writer is not None:
+                if completed:
+                    stats = store_writer.close()
+                    backup_path += MANIFEST_SUFFIX
+                    size = stats["stored_bytes"] + os.path.getsize(backup_path)
+                    self.__index_backup(container_id, container_name, backup_path, size)
+                else:
+                    store_writer.abort()
+            if store_file is not None:
+                store_file.close()
+                if completed:
+                    os.replace(backup_path + ".partial", backup_path)
+                    size = os.path.getsize(backup_path)
+                    self.__index_backup(container_id, container_name, backup_path, size)
+                else:
+                    os.remove(backup_path + ".partial")
+
+    def __backup_by_id(self, host: str, container_id: str) -> tuple[str, int]:
+        return self.__write_backup(self.get_container(host, container_id))
+
+    def backup_containers(self) -> BackupReport:
+        targets = self.__db.get_containers()
+
+        # One listing per host up front spares the engine from retrying
+        # containers that are gone or hosts that are down
+        listings = self.__list_containers(
+            host for host, _ in targets if self.__health.is_available(host)
+        )
+        unavailable = dict()
+        for host, container_id in targets:
+            listing = listings.get(host)
+            if listing is None:
+                unavailable[(host, container_id)] = "Host unavailable"
+            elif isinstance(listing, Exception):
+                unavailable[(host, container_id)] = (
+                    f"{type(listing).__name__}: {listing}"
+                )
+            elif all(container["Id"] != container_id for container in listing):
+                unavailable[(host, container_id)] = "Container not found"
+
+        return self.__backup_engine.run(targets, unavailable)
+
+    def enforce_retention(self) -> list[BackupRecord]:
+        if self.__retention is None:
+            return []
+        return self.__retention.enforce()
+
+    def list_backups(self, user_id: int) -> list[BackupRecord]:
+        return [backup_record(row) for row in self.__db.get_backups(user_id)]
 
     def upload_file(
         self,
         container: Container | None = None,
-        file=None,
+        file: bytes | IO[bytes] | Iterable[bytes] | None = None,
         upload_to: str = "/workspace",
         user_id: int = 0,
         container_type: int = -1,
@@ -165,5 +894,23 @@ class Manager:
                 user_id=user_id, container_type=container_type
             )
 
+        if isinstance(file, bytes):
+            chunks = [file]
+        elif hasattr(file, "read"):
+            chunks = iter(lambda: file.read(1024 * 1024), b"")
+        else:
+            chunks = file
+
+        started_at = perf_counter()
+        uploaded = 0
+
+        def count(chunks: Iterable[bytes]) -> Iterator[bytes]:
+            nonlocal uploaded
+            for chunk in chunks:
+                uploaded += len(chunk)
+                yield chunk
+
         container.exec_run(f"mkdir -p {upload_to}")
-        container.put_archive(upload_to, file)
+        container.put_archive(upload_to, count(chunks))
+        UPLOAD_BYTES.inc(uploaded)
+        UPLOAD_DURATION.observe(perf_counter() - started_at)
@@ -0,0 +1,147 @@
+import functools
+import os
+import re
+from time import perf_counter
+from typing import Callable, ParamSpec, TypeVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+# Backups and uploads move whole workspaces and take far longer than requests
+TRANSFER_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, float("inf"))
+
+REQUEST_DURATION = Histogram(
+    "governor_request_duration_seconds",
+    "Time spent handling a request until the response starts",
+    ["method", "route", "status"],
+)
+DB_QUERY_DURATION = Histogram(
+    "governor_db_query_duration_seconds",
+    "Time spent in a Database method including waiting for a connection",
+    ["method"],
+)
+DB_QUERY_ERRORS = Counter(
+    "governor_db_query_errors_total", "Database methods that raised", ["method"]
+)
+DOCKER_CALL_DURATION = Histogram(
+    "governor_docker_call_duration_seconds",
+    "Time until a Docker daemon answered with response headers",
+    ["host", "operation"],
+)
+DOCKER_CALL_ERRORS = Counter(
+    "governor_docker_call_errors_total",
+    "Docker calls that failed to reach the daemon",
+    ["host"],
+)
+DOCKER_HOST_UP = Gauge(
+    "governor_docker_host_up",
+    "Whether the circuit breaker of a Docker daemon lets calls through",
+    ["host"],
+    # A host counts as down as soon as one worker gave up on it
+    multiprocess_mode="livemin",
+)
+DOCKER_HOST_PROBE_DURATION = Histogram(
+    "governor_docker_host_probe_duration_seconds",
+    "Round trip of health probes to Docker daemons",
+    ["host"],
+)
+BACKUP_BYTES = Counter(
+    "governor_backup_bytes_total",
+    "Archive bytes read from containers for backups",
+    ["mode", "kind"],
+)
+BACKUP_DURATION = Histogram(
+    "governor_backup_duration_seconds",
+    "Time spent backing up a single container",
+    ["mode", "kind"],
+    buckets=TRANSFER_BUCKETS,
+)
+BACKUP_FAILURES = Counter(
+    "governor_backup_failures_total", "Backups that failed", ["mode", "kind"]
+)
+BACKUPS_PRUNED = Counter(
+    "governor_backups_pruned_total", "Backups deleted by the retention policy"
+)
+BACKUP_PRUNED_BYTES = Counter(
+    "governor_backup_pruned_bytes_total",
+    "Disk space freed by deleting backups and unreferenced chunks",
+)
+UPLOAD_BYTES = Counter(
+    "governor_upload_bytes_total", "Archive bytes uploaded into containers"
+)
+UPLOAD_DURATION = Histogram(
+    "governor_upload_duration_seconds",
+    "Time spent uploading an archive into a container",
+    buckets=TRANSFER_BUCKETS,
+)
+SCHEDULER_JOB_DURATION = Histogram(
+    "governor_scheduler_job_duration_seconds",
+    "Runtime of scheduled jobs",
+    ["job"],
+    buckets=TRANSFER_BUCKETS,
+)
+SCHEDULER_JOB_FAILURES = Counter(
+    "governor_scheduler_job_failures_total", "Scheduled jobs that failed", ["job"]
+)
+
+_API_VERSION = re.compile(r"^v\d+\.\d+$")
+# Second path segments that name an action rather than an object
+_COLLECTION_ACTIONS = {"json", "create", "prune", "load", "search", "get"}
+
+
+def docker_operation(method: str, path: str) -> str:
+    # Collapse ids and names so the label set stays bounded,
+    # e.g. /v1.43/containers/3f2a.../archive -> GET /containers/{id}/archive
+    path = path.partition("?")[0]
+    segments = [segment for segment in path.split("/") if segment]
+    if segments and _API_VERSION.match(segments[0]):
+        segments = segments[1:]
+
+    if len(segments) == 2 and segments[1] not in _COLLECTION_ACTIONS:
+        segments = [segments[0], "{id}"]
+    elif len(segments) > 2:
+        segments = [segments[0], "{id}", segments[-1]]
+    return f"{method} /{'/'.join(segments)}"
+
+
+def timed_query(method: Callable[P, T]) -> Callable[P, T]:
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+        started_at = perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except:
+            DB_QUERY_ERRORS.labels(name).inc()
+            raise
+        finally:
+            DB_QUERY_DURATION.labels(name).observe(perf_counter() - started_at)
+
+    return wrapper
+
+
+def render() -> tuple[bytes, str]:
+    registry = REGISTRY
+    # Under gunicorn every worker writes its samples to this directory and a
+    # scrape has to aggregate them, whichever worker happens to answer
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int) -> None:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,227 @@
+import logging
+
+import pymysql
+
+logger = logging.getLogger(__name__)
+
+LOCK_NAME = "cde_governor.migrations"
+
+# Append only: a released migration must never change, add a new version instead.
+# DDL commits implicitly in MariaDB, so statements are written to be re-runnable
+# in case a migration fails halfway.
+MIGRATIONS: list[tuple[int, str, list[str]]] = [
+    (
+        1,
+        "initial schema",
+        [
+            """CREATE TABLE IF NOT EXISTS users (
+            id          INT AUTO_INCREMENT,
+            username    TINYTEXT NOT NULL,
+            password    TINYTEXT NOT NULL,
+            PRIMARY KEY(id),
+            UNIQUE(username))""",
+            """CREATE TABLE IF NOT EXISTS servers (
+            host    INET4,
+            GPUs    TINYINT UNSIGNED NOT NULL,
+            PRIMARY KEY(host))""",
+            """CREATE TABLE IF NOT EXISTS containers (
+            id      VARCHAR(64),
+            server  INET4 NOT NULL,
+            GPU     TINYINT UNSIGNED NOT NULL,
+            user    INT NOT NULL NOT NULL,
+            type    TINYINT UNSIGNED NOT NULL,
+            PRIMARY KEY(server, id),
+            UNIQUE(user, type),
+            FOREIGN KEY(server) REFERENCES servers(host)
+            ON UPDATE CASCADE
+            ON DELETE CASCADE,
+            FOREIGN KEY(user) REFERENCES users(id)
+            ON UPDATE CASCADE
+            ON DELETE CASCADE
+            )""",
+            """CREATE TABLE IF NOT EXISTS provisioning_jobs (
+            id          INT AUTO_INCREMENT,
+            user        INT NOT NULL,
+            status      ENUM('pending', 'running', 'done', 'failed') NOT NULL DEFAULT 'pending',
+            progress    TINYINT UNSIGNED NOT NULL DEFAULT 0,
+            error       TEXT,
+            created_at  TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at  TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY(id),
+            INDEX(user, id),
+            INDEX(status),
+            FOREIGN KEY(user) REFERENCES users(id)
+            ON UPDATE CASCADE
+            ON DELETE CASCADE
+            )""",
+        ],
+    ),
+    (
+        2,
+        "column types",
+        [
+            # A unique TEXT column is kept unique through a hidden hash instead of
+            # a searchable B-tree, and hosts may be names or carry a port
+            """ALTER TABLE users
+            DROP INDEX IF EXISTS username,
+            MODIFY username VARCHAR(64) NOT NULL,
+            MODIFY password VARCHAR(255) NOT NULL,
+            ADD UNIQUE INDEX IF NOT EXISTS users_username (username)""",
+            "ALTER TABLE containers DROP FOREIGN KEY IF EXISTS containers_ibfk_1",
+            "ALTER TABLE servers MODIFY host VARCHAR(255) NOT NULL",
+            """ALTER TABLE containers
+            MODIFY id VARCHAR(64) NOT NULL,
+            MODIFY server VARCHAR(255) NOT NULL,
+            MODIFY user INT NOT NULL""",
+            """ALTER TABLE containers
+            ADD CONSTRAINT containers_server
+            FOREIGN KEY IF NOT EXISTS (server) REFERENCES servers(host)
+            ON UPDATE CASCADE
+            ON DELETE CASCADE""",
+        ],
+    ),
+    (
+        3,
+        "container access paths",
+        [
+            # (user, type) is already unique and carries the primary key (server,
+            # id), so get_container is answered from that index alone
+            "ALTER TABLE containers ADD INDEX IF NOT EXISTS containers_slot (server, GPU)",
+        ],
+    ),
+    (
+        4,
+        "slot allocation counters",
+        [
+            """CREATE TABLE IF NOT EXISTS slot_allocations (
+            server      VARCHAR(255) NOT NULL,
+            GPU         TINYINT UNSIGNED NOT NULL,
+            containers  INT UNSIGNED NOT NULL DEFAULT 0,
+            PRIMARY KEY(server, GPU),
+            CONSTRAINT slot_allocations_server
+            FOREIGN KEY(server) REFERENCES servers(host)
+            ON UPDATE CASCADE
+            ON DELETE CASCADE
+            )""",
+            """INSERT INTO slot_allocations (server, GPU, containers)
+            SELECT server, GPU, COUNT(*) FROM containers GROUP BY server, GPU
+            ON DUPLICATE KEY UPDATE containers = VALUES(containers)""",
+        ],
+    ),
+    (
+        5,
+        "backup index",
+        [
+            # Backups are recorded by container id and attributed to its user
+            "ALTER TABLE containers ADD INDEX IF NOT EXISTS containers_id (id)",
+            """CREATE TABLE IF NOT EXISTS backups (
+            id          INT AUTO_INCREMENT,
+            user        INT,
+            container   VARCHAR(64) NOT NULL,
+            name        VARCHAR(255) NOT NULL,
+            path        VARCHAR(1024) NOT NULL,
+            mode        ENUM('full', 'incremental') NOT NULL,
+            size        BIGINT UNSIGNED NOT NULL,
+            created_at  TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            deleted_at  TIMESTAMP NULL DEFAULT NULL,
+            PRIMARY KEY(id),
+            INDEX backups_user (user, deleted_at, created_at),
+            INDEX backups_deleted (deleted_at),
+            CONSTRAINT backups_user
+            FOREIGN KEY(user) REFERENCES users(id)
+            ON UPDATE CASCADE
+            ON DELETE SET NULL
+            )""",
+        ],
+    ),
+    (
+        6,
+        "container activity",
+        [
+            # Connects are served by every worker, the idle reaper runs in one
+            "ALTER TABLE containers ADD COLUMN IF NOT EXISTS connected_at TIMESTAMP NULL DEFAULT NULL",
+        ],
+    ),
+    (
+        7,
+        "provisioning job batches",
+        [
+            # Bulk submissions report progress on their own jobs only
+            """ALTER TABLE provisioning_jobs
+            ADD COLUMN IF NOT EXISTS batch CHAR(32) NULL DEFAULT NULL,
+            ADD INDEX IF NOT EXISTS provisioning_jobs_batch (batch)""",
+        ],
+    ),
+]
+
+# Checked before a migration is applied: (query, message) pairs, where any row
+# returned by the query means the migration cannot succeed on this data
+PRECONDITIONS: dict[int, list[tuple[str, str]]] = {
+    2: [
+        (
+            "SELECT username FROM users WHERE CHAR_LENGTH(username) > 64 LIMIT 10",
+            "Usernames longer than 64 characters must be shortened first",
+        ),
+    ],
+}
+
+
+class MigrationError(Exception):
+    pass
+
+
+def migrate(
+    conn: pymysql.Connection,
+    migrations: list[tuple[int, str, list[str]]] = MIGRATIONS,
+    preconditions: dict[int, list[tuple[str, str]]] = PRECONDITIONS,
+    lock_timeout: int = 60,
+) -> list[int]:
+    cursor = conn.cursor()
+    # Every governor worker migrates on startup, only one may do so at a time
+    cursor.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, lock_timeout))
+    if cursor.fetchone()[0] != 1:
+        raise MigrationError("Timed out waiting for the migration lock")
+
+    applied = []
+    try:
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS schema_migrations (
+            version     INT NOT NULL,
+            name        VARCHAR(255) NOT NULL,
+            applied_at  TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY(version))"""
+        )
+        cursor.execute("SELECT version FROM schema_migrations")
+        done = {version for version, in cursor.fetchall()}
+
+        for version, name, statements in sorted(migrations):
+            if version in done:
+                continue
+
+            for query, message in preconditions.get(version, []):
+                cursor.execute(query)
+                rows = cursor.fetchall()
+                if rows:
+                    raise MigrationError(
+                        f"Migration {version} ({name}): {message}: "
+                        + ", ".join(str(row[0]) for row in rows)
+                    )
+
+            logger.info(f"Applying migration {version} ({name})")
+            try:
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                    (version, name),
+                )
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise MigrationError(f"Migration {version} ({name}) failed") from e
+            applied.append(version)
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+        cursor.fetchone()
+
+    return applied
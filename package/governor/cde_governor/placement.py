@@ -0,0 +1,352 @@
+import heapq
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Callable, Literal, TypedDict
+
+import docker
+from cde_governor.fanout import DockerFanout
+from docker.types import DeviceRequest
+
+logger = logging.getLogger(__name__)
+
+Slot = tuple[str, int]
+Strategy = Literal["least_loaded", "bin_packing", "spread"]
+
+
+class HostSample(TypedDict):
+    cpu_ratio: float
+    memory_ratio: float
+    gpu_memory_ratio: dict[int, float]
+
+
+class NoCapacityError(Exception):
+    pass
+
+
+class PlacementScheduler:
+    def __init__(
+        self,
+        servers: list[tuple[str, int]],
+        strategy: Strategy = "least_loaded",
+        allocations: dict[Slot, int] | None = None,
+        slot_capacity: int | None = None,
+        load_weight: float = 2,
+    ):
+        if strategy not in ("least_loaded", "bin_packing", "spread"):
+            raise ValueError(f"Unknown placement strategy: {strategy}")
+        if strategy == "bin_packing" and slot_capacity is None:
+            raise ValueError("bin_packing placement requires a slot capacity")
+
+        self.__strategy = strategy
+        self.__slot_capacity = slot_capacity
+        self.__load_weight = load_weight
+
+        self.__lock = threading.Lock()
+        self.__slots: list[Slot] = [
+            (host, gpu) for host, gpus in servers for gpu in range(gpus)
+        ]
+        self.__slots_of_host: dict[str, list[Slot]] = dict()
+        for host, gpu in self.__slots:
+            self.__slots_of_host.setdefault(host, []).append((host, gpu))
+
+        self.__allocations: dict[Slot, int] = {slot: 0 for slot in self.__slots}
+        self.__host_allocations: dict[str, int] = {
+            host: 0 for host in self.__slots_of_host
+        }
+        self.__samples: dict[str, HostSample] = dict()
+
+        # Lazy-deletion heap of (key, version, slot): an entry is only valid while
+        # its version matches the slot's current version
+        self.__heap: list[tuple[tuple, int, Slot]] = []
+        self.__versions: dict[Slot, int] = {slot: 0 for slot in self.__slots}
+
+        self.resync(allocations or dict())
+
+    def __load(self, slot: Slot) -> float:
+        host, gpu = slot
+        sample = self.__samples.get(host)
+        if sample is None:
+            return 0.0
+        return (
+            2 * sample["gpu_memory_ratio"].get(gpu, 0.0)
+            + sample["memory_ratio"]
+            + sample["cpu_ratio"]
+        ) / 4
+
+    def __key(self, slot: Slot) -> tuple:
+        load = self.__load(slot)
+        if self.__strategy == "bin_packing":
+            return (-self.__allocations[slot], load)
+        if self.__strategy == "spread":
+            return (self.__host_allocations[slot[0]], self.__allocations[slot], load)
+        return (self.__allocations[slot] + self.__load_weight * load,)
+
+    def __has_capacity(self, slot: Slot, weight: int = 1) -> bool:
+        return (
+            self.__slot_capacity is None
+            or self.__allocations[slot] + weight <= self.__slot_capacity
+        )
+
+    def __push(self, slot: Slot) -> None:
+        self.__versions[slot] += 1
+        if self.__has_capacity(slot):
+            heapq.heappush(self.__heap, (self.__key(slot), self.__versions[slot], slot))
+        if len(self.__heap) > 4 * len(self.__slots):
+            self.__rebuild()
+
+    def __rebuild(self) -> None:
+        self.__heap = [
+            (self.__key(slot), self.__versions[slot], slot)
+            for slot in self.__slots
+            if self.__has_capacity(slot)
+        ]
+        heapq.heapify(self.__heap)
+
+    def __touch(self, slot: Slot) -> None:
+        # With the spread strategy every slot's key depends on its host's total
+        if self.__strategy == "spread":
+            for host_slot in self.__slots_of_host[slot[0]]:
+                self.__push(host_slot)
+        else:
+            self.__push(slot)
+
+    def __add(self, slot: Slot, weight: int) -> None:
+        self.__allocations[slot] += weight
+        self.__host_allocations[slot[0]] += weight
+        self.__touch(slot)
+
+    def __place(
+        self, weight: int, exclude: Callable[[Slot], bool] | None = None
+    ) -> Slot:
+        skipped = []
+        try:
+            while self.__heap:
+                entry = heapq.heappop(self.__heap)
+                _, version, slot = entry
+                if version != self.__versions[slot]:
+                    continue
+                if not self.__has_capacity(slot, weight) or (
+                    exclude is not None and exclude(slot)
+                ):
+                    skipped.append(entry)
+                    continue
+
+                self.__add(slot, weight)
+                return slot
+        finally:
+            for entry in skipped:
+                heapq.heappush(self.__heap, entry)
+
+        raise NoCapacityError("No GPU slot available for placement")
+
+    def place(
+        self, weight: int = 1, exclude: Callable[[Slot], bool] | None = None
+    ) -> Slot:
+        with self.__lock:
+            return self.__place(weight, exclude)
+
+    def place_many(
+        self,
+        count: int,
+        weight: int = 1,
+        exclude: Callable[[Slot], bool] | None = None,
+    ) -> list[Slot]:
+        # Plans a whole batch against one view of the allocations, every
+        # placement counts towards the next. Stops short when capacity runs out
+        slots = []
+        with self.__lock:
+            while len(slots) < count:
+                try:
+                    slots.append(self.__place(weight, exclude))
+                except NoCapacityError:
+                    break
+        return slots
+
+    def release(self, slot: Slot, weight: int = 1) -> None:
+        with self.__lock:
+            if slot in self.__allocations:
+                self.__add(slot, -min(weight, self.__allocations[slot]))
+
+    def update_sample(self, host: str, sample: HostSample) -> None:
+        with self.__lock:
+            if host not in self.__slots_of_host:
+                return
+            self.__samples[host] = sample
+            for slot in self.__slots_of_host[host]:
+                self.__push(slot)
+
+    def resync(self, allocations: dict[Slot, int]) -> None:
+        with self.__lock:
+            for slot in self.__slots:
+                self.__allocations[slot] = allocations.get(slot, 0)
+            for host, slots in self.__slots_of_host.items():
+                self.__host_allocations[host] = sum(
+                    self.__allocations[slot] for slot in slots
+                )
+            self.__rebuild()
+
+    def allocations(self) -> dict[Slot, int]:
+        with self.__lock:
+            return dict(self.__allocations)
+
+    def samples(self) -> dict[str, HostSample]:
+        with self.__lock:
+            return dict(self.__samples)
+
+
+class StaticSampler:
+    def __init__(self, samples: dict[str, HostSample]):
+        self.samples = samples
+
+    def __call__(self, host: str) -> HostSample:
+        return self.samples[host]
+
+
+class DockerSampler:
+    def __init__(
+        self,
+        get_client: Callable[[str], docker.DockerClient],
+        fanout: DockerFanout,
+        gpu_probe_image: str | None = None,
+        gpu_probe_interval: float = 600,
+    ):
+        self.__get_client = get_client
+        self.__fanout = fanout
+        self.__gpu_probe_image = gpu_probe_image
+        self.__gpu_probe_interval = gpu_probe_interval
+
+        self.__lock = threading.Lock()
+        # host -> container id -> (total_usage, system_cpu_usage) of the last pass
+        self.__cpu_counters: dict[str, dict[str, tuple[int, int]]] = dict()
+        # host -> (GPU memory ratios, probed_at)
+        self.__gpu_samples: dict[str, tuple[dict[int, float], float]] = dict()
+
+    def __call__(self, host: str) -> HostSample:
+        info = self.__fanout.call(host, lambda client: client.info())
+        containers = self.__fanout.call(host, lambda client: client.containers(False))
+        container_ids = [container["Id"] for container in containers]
+        results = self.__fanout.gather(
+            (
+                host,
+                lambda client, container_id=container_id: client.container_stats(
+                    container_id
+                ),
+            )
+            for container_id in container_ids
+        )
+
+        # One-shot stats carry no previous CPU sample, so the CPU share is taken
+        # between this pass and the last one
+        with self.__lock:
+            previous_counters = self.__cpu_counters.get(host, dict())
+        counters = dict()
+        cpu_usage = 0.0
+        memory_usage = 0
+        for container_id, stats in zip(container_ids, results):
+            if isinstance(stats, Exception):
+                logger.debug(f"Failed to read stats of {container_id}: {stats}")
+                continue
+            counters[container_id] = (
+                stats["cpu_stats"]["cpu_usage"]["total_usage"],
+                stats["cpu_stats"].get("system_cpu_usage", 0),
+            )
+            previous = previous_counters.get(container_id)
+            if previous is not None:
+                cpu_delta = counters[container_id][0] - previous[0]
+                system_delta = counters[container_id][1] - previous[1]
+                if system_delta > 0:
+                    cpu_usage += cpu_delta / system_delta
+            memory_usage += stats["memory_stats"].get("usage", 0)
+        with self.__lock:
+            self.__cpu_counters[host] = counters
+
+        return HostSample(
+            cpu_ratio=min(cpu_usage, 1.0),
+            memory_ratio=min(memory_usage / max(info["MemTotal"], 1), 1.0),
+            gpu_memory_ratio=self.__gpu_memory_ratio(host),
+        )
+
+    def __gpu_memory_ratio(self, host: str) -> dict[int, float]:
+        if self.__gpu_probe_image is None:
+            return dict()
+
+        # Probing starts a container, which is far too costly for every pass
+        with self.__lock:
+            sample = self.__gpu_samples.get(host)
+        if sample is not None and monotonic() - sample[1] < self.__gpu_probe_interval:
+            return sample[0]
+
+        ratios = self.__probe_gpus(self.__get_client(host))
+        with self.__lock:
+            self.__gpu_samples[host] = (ratios, monotonic())
+        return ratios
+
+    def __probe_gpus(self, client: docker.DockerClient) -> dict[int, float]:
+        output = client.containers.run(
+            self.__gpu_probe_image,
+            "nvidia-smi --query-gpu=index,memory.used,memory.total "
+            "--format=csv,noheader,nounits",
+            remove=True,
+            device_requests=[
+                DeviceRequest(driver="nvidia", count=-1, capabilities=[["gpu"]])
+            ],
+        )
+
+        ratios = dict()
+        for line in output.decode("utf-8").strip().splitlines():
+            index, used, total = (value.strip() for value in line.split(","))
+            ratios[int(index)] = int(used) / max(int(total), 1)
+        return ratios
+
+
+class ResourceMonitor:
+    def __init__(
+        self,
+        scheduler: PlacementScheduler,
+        hosts: list[str],
+        sample: Callable[[str], HostSample],
+        interval: float = 30,
+        is_available: Callable[[str], bool] | None = None,
+    ):
+        self.__scheduler = scheduler
+        self.__hosts = hosts
+        self.__sample = sample
+        self.__interval = interval
+        self.__is_available = is_available
+
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(
+            target=self.__run, name="resource-monitor", daemon=True
+        )
+
+    def start(self) -> None:
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__stop.set()
+
+    def __poll_host(self, host: str) -> None:
+        try:
+            self.__scheduler.update_sample(host, self.__sample(host))
+        except Exception:
+            logger.warning(f"Failed to sample resources of {host}", exc_info=True)
+
+    def poll(self) -> None:
+        hosts = [
+            host
+            for host in self.__hosts
+            if self.__is_available is None or self.__is_available(host)
+        ]
+        if not hosts:
+            return
+        with ThreadPoolExecutor(
+            max_workers=min(len(hosts), 8), thread_name_prefix="resource-sample"
+        ) as executor:
+            executor.map(self.__poll_host, hosts)
+
+    def __run(self) -> None:
+        while not self.__stop.is_set():
+            self.poll()
+            self.__stop.wait(self.__interval)
@@ -0,0 +1,249 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+from time import monotonic
+from typing import Callable, Iterator, TypedDict
+
+import pymysql
+from pymysql.constants import SERVER_STATUS
+
+
+class PoolTimeout(pymysql.OperationalError):
+    pass
+
+
+class PoolStats(TypedDict):
+    size: int
+    idle: int
+    in_use: int
+    checkouts: int
+    waits: int
+    timeouts: int
+    wait_time_total: float
+    wait_time_max: float
+    recycled: int
+    broken: int
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        connect: Callable[[], pymysql.Connection],
+        min_size: int = 1,
+        max_size: int = 10,
+        timeout: float = 10,
+        max_idle_time: float = 300,
+        max_lifetime: float = 3600,
+        ping_interval: float = 30,
+    ):
+        assert 0 <= min_size <= max_size and max_size > 0
+
+        self.__connect = connect
+        self.__min_size = min_size
+        self.__max_size = max_size
+        self.__timeout = timeout
+        self.__max_idle_time = max_idle_time
+        self.__max_lifetime = max_lifetime
+        self.__ping_interval = ping_interval
+
+        self.__cond = threading.Condition()
+        # (connection, created_at, last_used_at), most recently used on the right
+        self.__idle: deque[tuple[pymysql.Connection, float, float]] = deque()
+        self.__created_at: dict[int, float] = dict()
+        self.__size = 0
+        self.__closed = False
+
+        self.__stats = PoolStats(
+            size=0,
+            idle=0,
+            in_use=0,
+            checkouts=0,
+            waits=0,
+            timeouts=0,
+            wait_time_total=0.0,
+            wait_time_max=0.0,
+            recycled=0,
+            broken=0,
+        )
+
+    def fill(self) -> None:
+        while True:
+            with self.__cond:
+                if self.__closed or self.__size >= self.__min_size:
+                    return
+                self.__size += 1
+            try:
+                conn = self.__open()
+            except Exception:
+                self.__discard()
+                raise
+            self.__put_back(conn)
+
+    def __open(self) -> pymysql.Connection:
+        conn = self.__connect()
+        self.__created_at[id(conn)] = monotonic()
+        return conn
+
+    def __discard(self, conn: pymysql.Connection | None = None) -> None:
+        if conn is not None:
+            self.__created_at.pop(id(conn), None)
+            try:
+                conn.close()
+            except Exception:
+                pass
+        with self.__cond:
+            self.__size -= 1
+            self.__cond.notify()
+
+    def __put_back(self, conn: pymysql.Connection) -> None:
+        now = monotonic()
+        with self.__cond:
+            self.__idle.append((conn, self.__created_at.get(id(conn), now), now))
+            self.__cond.notify()
+
+    def __is_expired(
+        self, created_at: float, last_used_at: float, now: float, alive: int
+    ) -> bool:
+        if self.__max_lifetime and now - created_at > self.__max_lifetime:
+            return True
+        return bool(
+            self.__max_idle_time
+            and alive > self.__min_size
+            and now - last_used_at > self.__max_idle_time
+        )
+
+    def __recycle_idle(self) -> list[pymysql.Connection]:
+        # Least recently used connections sit on the left of the deque
+        now = monotonic()
+        expired = []
+        while self.__idle:
+            conn, created_at, last_used_at = self.__idle[0]
+            alive = self.__size - len(expired)
+            if not self.__is_expired(created_at, last_used_at, now, alive):
+                break
+            self.__idle.popleft()
+            expired.append(conn)
+        return expired
+
+    def acquire(self) -> pymysql.Connection:
+        started_at = monotonic()
+        deadline = started_at + self.__timeout
+        waited = False
+
+        while True:
+            with self.__cond:
+                if self.__closed:
+                    raise pymysql.InterfaceError("Connection pool is closed")
+
+                expired = self.__recycle_idle()
+                self.__stats["recycled"] += len(expired)
+
+                candidate = None
+                create = False
+                if self.__idle:
+                    candidate = self.__idle.pop()
+                elif self.__size - len(expired) < self.__max_size:
+                    self.__size += 1
+                    create = True
+                elif not expired:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        self.__stats["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"Timed out after {self.__timeout}s waiting for a DB connection"
+                        )
+                    waited = True
+                    self.__cond.wait(remaining)
+                    continue
+
+            for conn in expired:
+                self.__discard(conn)
+
+            if create:
+                try:
+                    conn = self.__open()
+                except Exception:
+                    self.__discard()
+                    raise
+                break
+
+            if candidate is None:
+                continue
+
+            conn, _, last_used_at = candidate
+            if self.__is_healthy(conn, last_used_at):
+                break
+
+            with self.__cond:
+                self.__stats["broken"] += 1
+            self.__discard(conn)
+
+        wait_time = monotonic() - started_at
+        with self.__cond:
+            self.__stats["checkouts"] += 1
+            if waited:
+                self.__stats["waits"] += 1
+            self.__stats["wait_time_total"] += wait_time
+            self.__stats["wait_time_max"] = max(
+                self.__stats["wait_time_max"], wait_time
+            )
+
+        return conn
+
+    def __is_healthy(self, conn: pymysql.Connection, last_used_at: float) -> bool:
+        if not conn.open:
+            return False
+        if monotonic() - last_used_at < self.__ping_interval:
+            return True
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except pymysql.Error:
+            return False
+
+    def release(self, conn: pymysql.Connection, broken: bool = False) -> None:
+        if broken or self.__closed or not conn.open:
+            self.__discard(conn)
+            return
+
+        # Never hand out a connection that is still inside a transaction,
+        # otherwise the next user would read from a stale snapshot
+        if conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            try:
+                conn.rollback()
+            except pymysql.Error:
+                self.__discard(conn)
+                return
+
+        self.__put_back(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[pymysql.Connection]:
+        conn = self.acquire()
+        try:
+            yield conn
+        except pymysql.OperationalError:
+            self.release(conn, broken=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def stats(self) -> PoolStats:
+        with self.__cond:
+            stats = PoolStats(**self.__stats)
+            stats["size"] = self.__size
+            stats["idle"] = len(self.__idle)
+            stats["in_use"] = self.__size - len(self.__idle)
+            return stats
+
+    def close(self) -> None:
+        with self.__cond:
+            self.__closed = True
+            idle = [conn for conn, _, _ in self.__idle]
+            self.__idle.clear()
+            self.__cond.notify_all()
+        for conn in idle:
+            self.__discard(conn)
@@ -0,0 +1,179 @@
+import logging
+import queue
+import threading
+from typing import Callable, TypedDict
+
+from cde_governor.db import Database
+from docker.models.containers import Container
+
+logger = logging.getLogger(__name__)
+
+
+class ProvisioningJob(TypedDict):
+    id: int
+    status: str
+    progress: int
+    error: str | None
+
+
+class ProvisioningQueue:
+    def __init__(
+        self,
+        db: Database,
+        create_cde: Callable[..., list[Container]],
+        create_cdes: Callable[..., dict[int, Exception | None]] | None = None,
+        workers: int = 4,
+        poll_interval: float = 1,
+    ):
+        self.__db = db
+        self.__create_cde = create_cde
+        self.__create_cdes = create_cdes
+        self.__poll_interval = poll_interval
+        self.__queue: queue.Queue[tuple[int, int, str] | None] = queue.Queue()
+        self.__batches: queue.Queue[list[tuple[int, int, str]] | None] = queue.Queue()
+        self.__threads = [
+            threading.Thread(
+                target=self.__work, name=f"provisioning-{index}", daemon=True
+            )
+            for index in range(workers)
+        ]
+        self.__threads.append(
+            threading.Thread(
+                target=self.__work_batches, name="provisioning-batch", daemon=True
+            )
+        )
+
+        self.__dispatching = threading.Event()
+        self.__wake = threading.Event()
+        self.__stop = threading.Event()
+        self.__dispatcher = threading.Thread(
+            target=self.__dispatch, name="provisioning-dispatcher", daemon=True
+        )
+
+    def start(self, dispatch: bool = True) -> None:
+        for thread in self.__threads:
+            thread.start()
+        self.__dispatcher.start()
+        if dispatch:
+            self.start_dispatching()
+
+    def start_dispatching(self) -> None:
+        # Jobs are only taken from the DB by the one process that places
+        # containers, so placement and the warm pool see every signup. Jobs
+        # left running by a previous leader are picked up again
+        if self.__dispatching.is_set():
+            return
+        requeued = self.__db.requeue_provisioning_jobs()
+        if requeued:
+            logger.info(f"Requeued {requeued} unfinished provisioning jobs")
+        self.__dispatching.set()
+        self.wake()
+
+    def stop(self) -> None:
+        self.__stop.set()
+        self.__wake.set()
+        for _ in self.__threads:
+            self.__queue.put(None)
+        self.__batches.put(None)
+
+    def wake(self) -> None:
+        self.__wake.set()
+
+    def submit(self, job_id: int) -> int:
+        # Jobs are saved along with their users, this only has the dispatcher
+        # look for them now instead of at its next poll
+        self.wake()
+        return job_id
+
+    def get_job(self, user_id: int) -> ProvisioningJob | None:
+        job = self.__db.get_provisioning_job(user_id)
+        if job is None:
+            return None
+        job_id, status, progress, error = job
+        return ProvisioningJob(id=job_id, status=status, progress=progress, error=error)
+
+    def pending(self) -> int:
+        return self.__queue.qsize()
+
+    def __dispatch(self) -> None:
+        while not self.__stop.is_set():
+            self.__wake.wait(self.__poll_interval)
+            self.__wake.clear()
+            if self.__stop.is_set() or not self.__dispatching.is_set():
+                continue
+
+            try:
+                jobs = self.__db.claim_provisioning_jobs()
+            except Exception:
+                logger.error("Failed to claim provisioning jobs", exc_info=True)
+                continue
+
+            # Jobs that arrive together, e.g. from a bulk submission, are
+            # placed as one batch
+            if len(jobs) > 1 and self.__create_cdes is not None:
+                self.__batches.put(jobs)
+                continue
+            for job in jobs:
+                self.__queue.put(job)
+
+    def __work(self) -> None:
+        while True:
+            job = self.__queue.get()
+            if job is None:
+                return
+            self.__run(*job)
+
+    def __work_batches(self) -> None:
+        while True:
+            jobs = self.__batches.get()
+            if jobs is None:
+                return
+            self.__run_batch(jobs)
+
+    def __fail(self, job_id: int, error: Exception) -> None:
+        try:
+            self.__db.update_provisioning_job(
+                job_id, "failed", 0, f"{type(error).__name__}: {error}"
+            )
+        except Exception:
+            logger.error("Failed to record provisioning failure", exc_info=True)
+
+    def __run(self, job_id: int, user_id: int, username: str) -> None:
+        def on_progress(done: int, total: int) -> None:
+            self.__db.update_provisioning_job(job_id, "running", done * 100 // total)
+
+        try:
+            self.__db.update_provisioning_job(job_id, "running", 0)
+            self.__create_cde(user_id, username, on_progress=on_progress)
+            self.__db.update_provisioning_job(job_id, "done", 100)
+        except Exception as e:
+            logger.error(f"Failed to provision CDE of {username}", exc_info=True)
+            self.__fail(job_id, e)
+
+    def __run_batch(self, jobs: list[tuple[int, int, str]]) -> None:
+        job_ids = {user_id: job_id for job_id, user_id, _ in jobs}
+
+        def on_result(user_id: int, error: Exception | None) -> None:
+            if error is not None:
+                self.__fail(job_ids[user_id], error)
+                return
+            try:
+                self.__db.update_provisioning_job(job_ids[user_id], "done", 100)
+            except Exception:
+                logger.error("Failed to record provisioning result", exc_info=True)
+
+        try:
+            results = self.__create_cdes(
+                [(user_id, username) for _, user_id, username in jobs],
+                on_result=on_result,
+            )
+        except Exception as e:
+            logger.error("Failed to provision CDEs in bulk", exc_info=True)
+            for job_id, _, _ in jobs:
+                self.__fail(job_id, e)
+            return
+
+        failed = sum(1 for error in results.values() if error is not None)
+        logger.info(
+            f"Provisioned {len(results) - failed} CDEs in bulk, {failed} failed"
+        )
@@ -0,0 +1,221 @@
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+from time import time
+from typing import Callable, Literal, NotRequired, TypedDict
+
+from cde_governor.chunk_store import MANIFEST_SUFFIX, ChunkStore
+from cde_governor.db import Database
+from cde_governor.metrics import BACKUPS_PRUNED, BACKUP_PRUNED_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+class BackupRecord(TypedDict):
+    id: int
+    user: int | None
+    container: str
+    name: str
+    path: str
+    mode: Literal["full", "incremental"]
+    size: int
+    created_at: datetime
+
+
+class RetentionPolicy(TypedDict):
+    keep_last: NotRequired[int]
+    keep_daily: NotRequired[int]
+    keep_weekly: NotRequired[int]
+    keep_monthly: NotRequired[int]
+    max_bytes_per_user: NotRequired[int]
+
+
+def backup_record(row: tuple) -> BackupRecord:
+    backup_id, user, container, name, path, mode, size, created_at = row
+    return BackupRecord(
+        id=backup_id,
+        user=user,
+        container=container,
+        name=name,
+        path=path,
+        mode=mode,
+        size=size,
+        created_at=created_at,
+    )
+
+
+PERIODS: dict[str, Callable[[datetime], tuple]] = {
+    "keep_daily": lambda created_at: (created_at.date(),),
+    "keep_weekly": lambda created_at: created_at.isocalendar()[:2],
+    "keep_monthly": lambda created_at: (created_at.year, created_at.month),
+}
+
+
+def is_enabled(policy: RetentionPolicy) -> bool:
+    return any(policy.get(key, 0) > 0 for key in RetentionPolicy.__annotations__)
+
+
+def select_kept(backups: list[BackupRecord], policy: RetentionPolicy) -> set[int]:
+    if not any(policy.get(rule, 0) > 0 for rule in ["keep_last", *PERIODS]):
+        return {backup["id"] for backup in backups}
+
+    # backups of one container, newest first. A backup is kept if any rule keeps
+    # it: the last N, or the newest one of each of the last N days/weeks/months
+    kept = {backup["id"] for backup in backups[: max(policy.get("keep_last", 0), 1)]}
+    for rule, period_of in PERIODS.items():
+        periods = set()
+        for backup in backups:
+            if len(periods) >= policy.get(rule, 0):
+                break
+            period = period_of(backup["created_at"])
+            if period not in periods:
+                periods.add(period)
+                kept.add(backup["id"])
+    return kept
+
+
+def select_expired(
+    backups: list[BackupRecord], policy: RetentionPolicy
+) -> list[BackupRecord]:
+    if not is_enabled(policy):
+        return []
+
+    series: dict[str, list[BackupRecord]] = dict()
+    for backup in sorted(
+        backups, key=lambda backup: (backup["created_at"], backup["id"]), reverse=True
+    ):
+        series.setdefault(backup["container"], []).append(backup)
+
+    kept: dict[int, BackupRecord] = dict()
+    expired = []
+    for container_backups in series.values():
+        kept_ids = select_kept(container_backups, policy)
+        for backup in container_backups:
+            if backup["id"] in kept_ids:
+                kept[backup["id"]] = backup
+            else:
+                expired.append(backup)
+
+    max_bytes = policy.get("max_bytes_per_user", 0)
+    if max_bytes > 0:
+        # The newest backup of every container survives any quota
+        newest = {container_backups[0]["id"] for container_backups in series.values()}
+        by_user: dict[int, list[BackupRecord]] = dict()
+        for backup in kept.values():
+            if backup["user"] is not None:
+                by_user.setdefault(backup["user"], []).append(backup)
+        for user_backups in by_user.values():
+            used = sum(backup["size"] for backup in user_backups)
+            for backup in sorted(
+                user_backups, key=lambda backup: (backup["created_at"], backup["id"])
+            ):
+                if used <= max_bytes:
+                    break
+                if backup["id"] in newest:
+                    continue
+                expired.append(backup)
+                used -= backup["size"]
+
+    return expired
+
+
+class RetentionEngine:
+    def __init__(
+        self,
+        db: Database,
+        backup_dir: str,
+        chunk_store: ChunkStore,
+        policy: RetentionPolicy,
+        chunk_grace_period: float = 24 * 60 * 60,
+    ):
+        self.__db = db
+        self.__backup_dir = backup_dir
+        self.__chunk_store = chunk_store
+        self.__policy = policy
+        self.__chunk_grace_period = chunk_grace_period
+
+        self.__queue: queue.Queue[list[BackupRecord] | None] = queue.Queue()
+        self.__thread = threading.Thread(
+            target=self.__run, name="backup-retention", daemon=True
+        )
+
+    def start(self) -> None:
+        self.__thread.start()
+        # Deletions interrupted by a restart are still marked in the index
+        pending = [backup_record(row) for row in self.__db.get_deleted_backups()]
+        if pending:
+            self.__queue.put(pending)
+
+    def stop(self) -> None:
+        self.__queue.put(None)
+
+    def plan(self) -> list[BackupRecord]:
+        backups = [backup_record(row) for row in self.__db.get_backups()]
+        return select_expired(backups, self.__policy)
+
+    def enforce(self) -> list[BackupRecord]:
+        # Only marks backups in the index, files are deleted by the worker
+        expired = self.plan()
+        if expired:
+            self.__db.mark_backups_deleted([backup["id"] for backup in expired])
+            self.__queue.put(expired)
+        return expired
+
+    def __run(self) -> None:
+        while True:
+            backups = self.__queue.get()
+            if backups is None:
+                return
+            try:
+                self.__delete(backups)
+            except Exception:
+                logger.error("Failed to delete expired backups", exc_info=True)
+
+    def __delete(self, backups: list[BackupRecord]) -> None:
+        deleted = []
+        freed = 0
+        for backup in backups:
+            try:
+                freed += os.path.getsize(backup["path"])
+                os.remove(backup["path"])
+            except FileNotFoundError:
+                pass
+            except Exception:
+                # Stays marked and is retried on the next start
+                logger.warning(f"Failed to delete {backup['path']}", exc_info=True)
+                continue
+            deleted.append(backup)
+
+        self.__db.purge_backups([backup["id"] for backup in deleted])
+        BACKUPS_PRUNED.inc(len(deleted))
+
+        if any(backup["mode"] == "incremental" for backup in deleted):
+            try:
+                freed += self.__collect_chunks()
+            except Exception:
+                # Unreferenced chunks are picked up by the next collection
+                logger.error("Failed to collect unreferenced chunks", exc_info=True)
+
+        BACKUP_PRUNED_BYTES.inc(freed)
+        logger.info(f"Deleted {len(deleted)} expired backups, freed {freed} bytes")
+
+    def __manifests(self) -> list[str]:
+        manifests = []
+        for dir_path, _, file_names in os.walk(self.__backup_dir):
+            manifests.extend(
+                os.path.join(dir_path, file_name)
+                for file_name in file_names
+                if file_name.endswith(MANIFEST_SUFFIX)
+            )
+        return manifests
+
+    def __collect_chunks(self) -> int:
+        # Every manifest on disk counts, not only the indexed ones: backups from
+        # before the index or whose indexing failed still need their chunks. A
+        # manifest that cannot be read fails the whole collection
+        return self.__chunk_store.collect_garbage(
+            self.__chunk_store.referenced_chunks(self.__manifests()),
+            older_than=time() - self.__chunk_grace_period,
+        )
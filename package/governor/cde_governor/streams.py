@@ -0,0 +1,55 @@
+import io
+import tarfile
+from typing import IO, Iterable, Iterator
+
+
+class IterableReader(io.RawIOBase):
+    def __init__(self, chunks: Iterable[bytes]):
+        self.__chunks: Iterator[bytes] = iter(chunks)
+        self.__buffer = memoryview(b"")
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.__buffer:
+            try:
+                self.__buffer = memoryview(next(self.__chunks))
+            except StopIteration:
+                return 0
+
+        size = min(len(buffer), len(self.__buffer))
+        buffer[:size] = self.__buffer[:size]
+        self.__buffer = self.__buffer[size:]
+        self.bytes_read += size
+        return size
+
+
+def read_stream(
+    chunks: Iterable[bytes], buffer_size: int = 1024 * 1024
+) -> io.BufferedReader:
+    return io.BufferedReader(IterableReader(chunks), buffer_size=buffer_size)
+
+
+def tar_stream(
+    entries: Iterable[tuple[tarfile.TarInfo, IO[bytes] | None]],
+    chunk_size: int = 1024 * 1024,
+) -> Iterator[bytes]:
+    for tarinfo, fileobj in entries:
+        yield tarinfo.tobuf(format=tarfile.PAX_FORMAT)
+        if fileobj is None or not tarinfo.isreg():
+            continue
+
+        remaining = tarinfo.size
+        while remaining > 0:
+            data = fileobj.read(min(chunk_size, remaining))
+            if not data:
+                raise OSError(f"Unexpected end of data for {tarinfo.name}")
+            remaining -= len(data)
+            yield data
+
+        if tarinfo.size % tarfile.BLOCKSIZE:
+            yield tarfile.NUL * (tarfile.BLOCKSIZE - tarinfo.size % tarfile.BLOCKSIZE)
+
+    yield tarfile.NUL * (tarfile.BLOCKSIZE * 2)
@@ -0,0 +1,192 @@
+import logging
+import math
+import secrets
+import threading
+from collections import deque
+from time import monotonic
+from typing import Callable
+
+from cde_governor.docker_clients import DockerClientRegistry
+from docker.errors import NotFound
+from docker.models.containers import Container
+
+logger = logging.getLogger(__name__)
+
+WARM_PREFIX = "warm_"
+
+Slot = tuple[str, int]
+
+
+class WarmPool:
+    def __init__(
+        self,
+        docker: DockerClientRegistry,
+        servers: list[tuple[str, int]],
+        container_types: list[int],
+        create: Callable[[str, int, str, int], Container],
+        min_size: int = 1,
+        max_size: int = 4,
+        signup_window: float = 3600,
+        refill_horizon: float = 600,
+        interval: float = 30,
+        is_host_ready: Callable[[str], bool] | None = None,
+    ):
+        self.__docker = docker
+        self.__slots: list[Slot] = [
+            (host, gpu) for host, gpus in servers for gpu in range(gpus)
+        ]
+        self.__container_types = container_types
+        self.__create = create
+        self.__min_size = min_size
+        self.__max_size = max_size
+        self.__signup_window = signup_window
+        self.__refill_horizon = refill_horizon
+        self.__interval = interval
+        self.__is_host_ready = is_host_ready
+
+        self.__lock = threading.Lock()
+        self.__pool: dict[tuple[Slot, int], deque[str]] = {
+            (slot, container_type): deque()
+            for slot in self.__slots
+            for container_type in container_types
+        }
+        self.__claims: deque[float] = deque()
+
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(
+            target=self.__run, name="warm-pool", daemon=True
+        )
+
+    def start(self) -> None:
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__stop.set()
+
+    def target_size(self) -> int:
+        # Keep enough containers per slot to absorb the signups expected before
+        # the next refills catch up, based on the recent signup rate
+        now = monotonic()
+        with self.__lock:
+            while self.__claims and now - self.__claims[0] > self.__signup_window:
+                self.__claims.popleft()
+            # Every signup claims one container of each type
+            signups = len(self.__claims) / max(len(self.__container_types), 1)
+
+        expected = signups * self.__refill_horizon / self.__signup_window
+        per_slot = math.ceil(expected / max(len(self.__slots), 1))
+        return max(self.__min_size, min(self.__max_size, per_slot))
+
+    def sizes(self) -> dict[tuple[Slot, int], int]:
+        with self.__lock:
+            return {
+                key: len(container_ids) for key, container_ids in self.__pool.items()
+            }
+
+    def claim(
+        self, host: str, gpu: int, container_type: int, name: str
+    ) -> Container | None:
+        key = ((host, gpu), container_type)
+        with self.__lock:
+            self.__claims.append(monotonic())
+
+        while True:
+            with self.__lock:
+                container_ids = self.__pool.get(key)
+                if not container_ids:
+                    return None
+                container_id = container_ids.popleft()
+
+            try:
+                container = self.__docker.get(host).containers.get(container_id)
+                container.rename(name)
+                return container
+            except NotFound:
+                continue
+            except Exception:
+                logger.warning(
+                    f"Failed to claim warm container {container_id}", exc_info=True
+                )
+                self.__discard(host, key, container_id)
+                return None
+
+    def __discard(self, host: str, key: tuple[Slot, int], container_id: str) -> None:
+        # The rename may have gone through, so the container cannot stay pooled
+        # under a user's name; keep it only if it cannot be removed either
+        try:
+            self.__docker.get(host).containers.get(container_id).remove(force=True)
+        except NotFound:
+            pass
+        except Exception:
+            logger.warning(
+                f"Failed to remove warm container {container_id}", exc_info=True
+            )
+            with self.__lock:
+                self.__pool[key].appendleft(container_id)
+
+    def recover(self) -> None:
+        for host in {host for host, _ in self.__slots}:
+            try:
+                containers = self.__docker.get(host).containers.list(
+                    all=True, filters={"name": WARM_PREFIX}
+                )
+            except Exception:
+                logger.warning(
+                    f"Failed to list warm containers of {host}", exc_info=True
+                )
+                continue
+
+            for container in containers:
+                if not container.name.startswith(WARM_PREFIX):
+                    continue
+                key = (
+                    (host, int(container.labels["gpu"])),
+                    int(container.labels["type"]),
+                )
+                with self.__lock:
+                    if key in self.__pool and container.id not in self.__pool[key]:
+                        self.__pool[key].append(container.id)
+
+    def refill(self) -> None:
+        target = self.target_size()
+        for (slot, container_type), container_ids in self.__pool.items():
+            host, gpu = slot
+            self.__trim(host, container_ids, target)
+            if self.__is_host_ready is not None and not self.__is_host_ready(host):
+                continue
+
+            while len(container_ids) < target and not self.__stop.is_set():
+                name = f"{WARM_PREFIX}{secrets.token_hex(8)}"
+                try:
+                    container = self.__create(host, gpu, name, container_type)
+                except Exception:
+                    logger.warning(
+                        f"Failed to create warm container on {host} GPU {gpu}",
+                        exc_info=True,
+                    )
+                    break
+                with self.__lock:
+                    container_ids.append(container.id)
+
+    def __trim(self, host: str, container_ids: deque[str], target: int) -> None:
+        while True:
+            with self.__lock:
+                if len(container_ids) <= target:
+                    return
+                container_id = container_ids.pop()
+
+            try:
+                self.__docker.get(host).containers.get(container_id).remove(force=True)
+            except NotFound:
+                pass
+            except Exception:
+                logger.warning(
+                    f"Failed to remove warm container {container_id}", exc_info=True
+                )
+                return
+
+    def __run(self) -> None:
+        self.recover()
+        while not self.__stop.is_set():
+            self.refill()
+            self.__stop.wait(self.__interval)
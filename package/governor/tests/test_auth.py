@@ -0,0 +1,60 @@
+import unittest
+from time import sleep
+
+from cde_governor.auth import Authenticator
+from cde_governor.crpyto import encrypt_with_salt
+
+
+class CredentialStore:
+    def __init__(self):
+        self.users: dict[str, tuple[int, str]] = dict()
+        self.reads = 0
+
+    def create_user(self, username: str, password: str) -> None:
+        self.users[username] = (len(self.users) + 1, encrypt_with_salt(password))
+
+    def get_credentials(self, username: str) -> tuple[int, str] | None:
+        self.reads += 1
+        return self.users.get(username)
+
+    def update_pw(self, username: str, new_password: str) -> None:
+        user_id, _ = self.users[username]
+        self.users[username] = (user_id, encrypt_with_salt(new_password))
+
+
+class AuthenticatorTest(unittest.TestCase):
+    def setUp(self):
+        self.db = CredentialStore()
+        self.db.create_user("alice", "old")
+
+    def test_cache_hit_skips_db(self):
+        auth = Authenticator(self.db)
+        self.assertEqual(auth.auth("alice", "old"), 1)
+        self.assertEqual(auth.auth("alice", "old"), 1)
+        self.assertEqual(self.db.reads, 1)
+
+    def test_password_changed_by_another_worker(self):
+        worker, other = Authenticator(self.db, ttl=0.2), Authenticator(self.db)
+        self.assertEqual(worker.auth("alice", "old"), 1)
+
+        other.update_pw("alice", "new")
+        # The new password works right away and replaces the cached entry
+        self.assertEqual(worker.auth("alice", "new"), 1)
+        self.assertIsNone(worker.auth("alice", "old"))
+
+    def test_stale_entry_expires(self):
+        worker = Authenticator(self.db, ttl=0.1)
+        self.assertEqual(worker.auth("alice", "old"), 1)
+
+        self.db.update_pw("alice", "new")
+        sleep(0.2)
+        self.assertIsNone(worker.auth("alice", "old"))
+
+    def test_wrong_password(self):
+        auth = Authenticator(self.db)
+        self.assertIsNone(auth.auth("alice", "wrong"))
+        self.assertIsNone(auth.auth("bob", "old"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+
+from cde_governor.placement import (
+    HostSample,
+    NoCapacityError,
+    PlacementScheduler,
+    ResourceMonitor,
+    StaticSampler,
+)
+
+IDLE = HostSample(cpu_ratio=0.0, memory_ratio=0.0, gpu_memory_ratio={0: 0.0})
+BUSY = HostSample(cpu_ratio=1.0, memory_ratio=1.0, gpu_memory_ratio={0: 1.0})
+
+
+def monitor(scheduler: PlacementScheduler, samples: dict[str, HostSample]):
+    return ResourceMonitor(scheduler, list(samples), StaticSampler(samples))
+
+
+class PlacementSchedulerTest(unittest.TestCase):
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            PlacementScheduler([("a", 1)], strategy="random")
+        with self.assertRaises(ValueError):
+            PlacementScheduler([("a", 1)], strategy="bin_packing")
+
+    def test_least_loaded_balances_allocations(self):
+        scheduler = PlacementScheduler([("a", 1), ("b", 1)])
+        for _ in range(4):
+            scheduler.place()
+        self.assertEqual(scheduler.allocations(), {("a", 0): 2, ("b", 0): 2})
+
+    def test_least_loaded_avoids_busy_host(self):
+        scheduler = PlacementScheduler([("a", 1), ("b", 1)])
+        monitor(scheduler, {"a": BUSY, "b": IDLE}).poll()
+        self.assertEqual(scheduler.place(), ("b", 0))
+        self.assertEqual(scheduler.place(), ("b", 0))
+
+    def test_update_sample_replaces_stale_entries(self):
+        scheduler = PlacementScheduler([("a", 1), ("b", 1)])
+        scheduler.update_sample("a", BUSY)
+        scheduler.update_sample("b", IDLE)
+        scheduler.update_sample("a", IDLE)
+        scheduler.update_sample("b", BUSY)
+        self.assertEqual(scheduler.place(), ("a", 0))
+        self.assertEqual(scheduler.samples()["b"], BUSY)
+
+    def test_bin_packing_fills_slots_first(self):
+        scheduler = PlacementScheduler(
+            [("a", 2)], strategy="bin_packing", slot_capacity=2
+        )
+        slots = [scheduler.place() for _ in range(3)]
+        self.assertEqual(slots[0], slots[1])
+        self.assertNotEqual(slots[1], slots[2])
+
+    def test_spread_alternates_hosts(self):
+        scheduler = PlacementScheduler([("a", 2), ("b", 2)], strategy="spread")
+        hosts = [scheduler.place()[0] for _ in range(4)]
+        self.assertEqual(sorted(hosts), ["a", "a", "b", "b"])
+        self.assertNotEqual(hosts[0], hosts[1])
+        self.assertNotEqual(hosts[2], hosts[3])
+
+    def test_place_many_stops_at_capacity(self):
+        scheduler = PlacementScheduler([("a", 2), ("b", 1)], slot_capacity=1)
+        slots = scheduler.place_many(5)
+        self.assertEqual(sorted(slots), [("a", 0), ("a", 1), ("b", 0)])
+        with self.assertRaises(NoCapacityError):
+            scheduler.place()
+
+    def test_weight_counts_against_capacity(self):
+        scheduler = PlacementScheduler([("a", 1)], slot_capacity=3)
+        scheduler.place(weight=2)
+        with self.assertRaises(NoCapacityError):
+            scheduler.place(weight=2)
+        self.assertEqual(scheduler.place(weight=1), ("a", 0))
+
+    def test_release_frees_capacity(self):
+        scheduler = PlacementScheduler([("a", 1)], slot_capacity=1)
+        slot = scheduler.place()
+        scheduler.release(slot)
+        self.assertEqual(scheduler.place(), slot)
+        # Releasing more than was placed never goes below zero
+        scheduler.release(slot, weight=5)
+        self.assertEqual(scheduler.allocations(), {("a", 0): 0})
+
+    def test_exclude_skips_slots_and_keeps_them(self):
+        scheduler = PlacementScheduler([("a", 1), ("b", 1)])
+        for _ in range(3):
+            self.assertEqual(
+                scheduler.place(exclude=lambda slot: slot[0] == "a"), ("b", 0)
+            )
+        with self.assertRaises(NoCapacityError):
+            scheduler.place(exclude=lambda slot: True)
+        self.assertEqual(scheduler.place(), ("a", 0))
+
+    def test_resync_restores_allocations(self):
+        scheduler = PlacementScheduler([("a", 1), ("b", 1)], slot_capacity=2)
+        scheduler.resync({("a", 0): 2})
+        self.assertEqual(scheduler.place_many(3), [("b", 0), ("b", 0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import io
+import os
+import tarfile
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+from time import monotonic, sleep, time
+
+from cde_governor.chunk_store import MANIFEST_SUFFIX, ChunkStore
+from cde_governor.retention import RetentionEngine, RetentionPolicy
+
+
+def workspace(files: dict[str, bytes]) -> io.BytesIO:
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        for name, data in files.items():
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = len(data)
+            tar.addfile(tarinfo, io.BytesIO(data))
+    archive.seek(0)
+    return archive
+
+
+class BackupIndex:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.backups: dict[int, tuple] = dict()
+        self.deleted: set[int] = set()
+
+    def add(self, container: str, path: str, created_at: datetime) -> None:
+        backup_id = len(self.backups) + 1
+        self.backups[backup_id] = (
+            backup_id,
+            1,
+            container,
+            container,
+            path,
+            "incremental",
+            os.path.getsize(path),
+            created_at,
+        )
+
+    def get_backups(self) -> list[tuple]:
+        with self.__lock:
+            return [
+                backup
+                for backup_id, backup in self.backups.items()
+                if backup_id not in self.deleted
+            ]
+
+    def get_deleted_backups(self) -> list[tuple]:
+        with self.__lock:
+            return [self.backups[backup_id] for backup_id in self.deleted]
+
+    def mark_backups_deleted(self, backup_ids: list[int]) -> None:
+        with self.__lock:
+            self.deleted.update(backup_ids)
+
+    def purge_backups(self, backup_ids: list[int]) -> None:
+        with self.__lock:
+            for backup_id in backup_ids:
+                self.backups.pop(backup_id, None)
+                self.deleted.discard(backup_id)
+
+
+class RetentionEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.__dir = tempfile.TemporaryDirectory()
+        self.backup_dir = self.__dir.name
+        self.store = ChunkStore(os.path.join(self.backup_dir, ".chunks"), 1024)
+        self.db = BackupIndex()
+
+    def tearDown(self):
+        self.__dir.cleanup()
+
+    def backup(self, container: str, name: str, files: dict[str, bytes]) -> str:
+        dir_path = os.path.join(self.backup_dir, container)
+        os.makedirs(dir_path, exist_ok=True)
+        path = os.path.join(dir_path, name + MANIFEST_SUFFIX)
+        self.store.backup(workspace(files), path, container)
+        return path
+
+    def age_chunks(self) -> None:
+        # Past the grace period, so only references keep a chunk alive
+        old = time() - 7 * 24 * 60 * 60
+        for dir_path, _, file_names in os.walk(
+            os.path.join(self.backup_dir, ".chunks")
+        ):
+            for file_name in file_names:
+                os.utime(os.path.join(dir_path, file_name), (old, old))
+
+    def test_unindexed_manifest_survives_gc(self):
+        now = datetime.now()
+        expired = self.backup("cde-a", "old", {"old.bin": os.urandom(4096)})
+        kept = self.backup("cde-a", "new", {"new.bin": os.urandom(4096)})
+        unindexed_data = os.urandom(4096)
+        unindexed = self.backup("cde-b", "legacy", {"legacy.bin": unindexed_data})
+        self.db.add("cde-a", expired, now - timedelta(days=2))
+        self.db.add("cde-a", kept, now - timedelta(days=1))
+        self.age_chunks()
+
+        engine = RetentionEngine(
+            self.db, self.backup_dir, self.store, RetentionPolicy(keep_last=1)
+        )
+        engine.start()
+        self.assertEqual([backup["path"] for backup in engine.enforce()], [expired])
+        # Files are deleted and chunks collected by the worker
+        referenced = self.store.referenced_chunks([kept, unindexed])
+        deadline = monotonic() + 10
+        while set(self.store.chunks()) != referenced and monotonic() < deadline:
+            sleep(0.01)
+        engine.stop()
+
+        self.assertFalse(os.path.exists(expired))
+        self.assertEqual(set(self.store.chunks()), referenced)
+        restored = io.BytesIO()
+        self.store.restore(unindexed, restored)
+        restored.seek(0)
+        with tarfile.open(fileobj=restored) as tar:
+            self.assertEqual(tar.extractfile("legacy.bin").read(), unindexed_data)
+
+
+if __name__ == "__main__":
+    unittest.main()
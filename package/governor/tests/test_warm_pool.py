@@ -0,0 +1,43 @@
+import unittest
+from unittest import mock
+
+from cde_governor.warm_pool import WARM_PREFIX, WarmPool
+from docker.errors import APIError
+
+
+class ClaimTest(unittest.TestCase):
+    def setUp(self):
+        self.container = mock.Mock(
+            id="abc", labels={"gpu": "0", "type": "0"}, status="running"
+        )
+        self.container.name = f"{WARM_PREFIX}abc"
+        self.docker = mock.Mock()
+        client = self.docker.get.return_value
+        client.containers.list.return_value = [self.container]
+        client.containers.get.return_value = self.container
+
+        self.pool = WarmPool(self.docker, [("host", 1)], [0], create=mock.Mock())
+        self.pool.recover()
+
+    def test_claim_renames_pooled_container(self):
+        self.assertIs(self.pool.claim("host", 0, 0, "user_0"), self.container)
+        self.container.rename.assert_called_once_with("user_0")
+        self.assertEqual(self.pool.sizes()[(("host", 0), 0)], 0)
+
+    def test_failed_rename_removes_container(self):
+        self.container.rename.side_effect = APIError("Conflict")
+
+        self.assertIsNone(self.pool.claim("host", 0, 0, "user_0"))
+        self.container.remove.assert_called_once_with(force=True)
+        self.assertEqual(self.pool.sizes()[(("host", 0), 0)], 0)
+
+    def test_container_stays_pooled_when_it_cannot_be_removed(self):
+        self.container.rename.side_effect = ConnectionError()
+        self.container.remove.side_effect = ConnectionError()
+
+        self.assertIsNone(self.pool.claim("host", 0, 0, "user_0"))
+        self.assertEqual(self.pool.sizes()[(("host", 0), 0)], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()